@@ -6,7 +6,6 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional
-from deepface import DeepFace
 import uuid
 import os
 import base64
@@ -25,10 +24,13 @@ from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 import matplotlib.pyplot as plt
-import math
 from sklearn.metrics import silhouette_score, homogeneity_score, completeness_score, v_measure_score
 import numpy as np
 import time
+import importlib
+import sys
+import threading
+from collections import OrderedDict
 
 
 
@@ -51,6 +53,19 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
+# Busca por imagem: modelo das galerias e serviço local de embeddings (opcional;
+# sem ele o embedding é gerado aqui mesmo com o DeepFace)
+MODEL_NAME = os.getenv("MODEL_NAME")
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+BUSCA_MAX_INDICES = int(os.getenv("BUSCA_MAX_INDICES", "16"))  # índices (tag_video, modelo) em memória
+
+# Cliente do serviço de embeddings e formato binário vêm do worker de reconhecimento,
+# importados só quando usados (a API sobe sem a árvore do worker ao lado)
+WORKER_RECONHECIMENTO_DIR = os.getenv(
+    "WORKER_RECONHECIMENTO_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workers", "reconhecimento")
+)
+
 # ----------------------------
 # Configuração de Logs
 # ----------------------------
@@ -70,6 +85,34 @@ presencas = db["presencas"]
 users = db["users"]
 frames = db["frames"]
 fontes = db["fonte"]
+embeddings = db["embeddings"]  # vetores binários gravados pelo worker de reconhecimento
+galerias = db["galerias"]  # contador de versão das galerias de cada tag_video
+
+
+def _modulo_worker(nome: str):
+    """Módulo do worker de reconhecimento (cliente_embeddings, repositorio_embeddings)."""
+    if WORKER_RECONHECIMENTO_DIR not in sys.path:
+        sys.path.append(WORKER_RECONHECIMENTO_DIR)
+    return importlib.import_module(nome)
+
+
+def desempacotar(docs: list) -> np.ndarray:
+    """Matriz (N, D) float32 dos documentos de `embeddings` (formato do worker)."""
+    return _modulo_worker("repositorio_embeddings").desempacotar(docs)
+
+
+# conexões keep-alive por thread com o serviço de embeddings (None: DeepFace aqui mesmo)
+_cliente_embeddings = None
+_trava_cliente = threading.Lock()
+
+
+def obter_cliente_embeddings():
+    global _cliente_embeddings
+    if EMBEDDING_SERVICE_URL and _cliente_embeddings is None:
+        with _trava_cliente:
+            if _cliente_embeddings is None:
+                _cliente_embeddings = _modulo_worker("cliente_embeddings").ClienteEmbeddings(EMBEDDING_SERVICE_URL)
+    return _cliente_embeddings
 
 class PresencaUpdate(BaseModel):
     confusionCategory: Optional[str] = None  # "TP", "TN", "FP", "FN", etc.
@@ -246,6 +289,11 @@ app.mount("/static", StaticFiles(directory=IMAGES_DIR), name="static")
 class ImagePayload(BaseModel):
     image: str  # Base64-encoded image
 
+class BuscaPayload(ImagePayload):
+    top_k: int = 5
+    tag_video: Optional[str] = None  # sem tag_video, busca em todas as galerias
+    modelo: Optional[str] = None     # padrão: MODEL_NAME
+
 class TagPayload(BaseModel):
     tag: str
 
@@ -415,14 +463,19 @@ def get_presigned_url(object_name: str, expiration: int = 600) -> str:
 # ----------------------------
 
 @app.get("/pessoas", dependencies=[Depends(get_current_active_user)])
-async def list_pessoas(page: int = 1, limit: int = 10):
+async def list_pessoas(page: int = 1, limit: int = 10, fonte_id: Optional[str] = None):
     """
     Retorna uma lista paginada de pessoas com seus UUIDs e tags (sem fotos).
+    Com `fonte_id`, só as pessoas daquela execução (tag_video + modelo).
     """
     try:
-        total = pessoas.count_documents({})
+        filtro = {}
+        if fonte_id:
+            _, fonte_doc = _get_fonte_or_404(fonte_id)
+            filtro = _filtro_pessoas_da_fonte(fonte_doc)
+        total = pessoas.count_documents(filtro)
         skip = (page - 1) * limit
-        cursor = pessoas.find({}).skip(skip).limit(limit)
+        cursor = pessoas.find(filtro).skip(skip).limit(limit)
         result = []
         for p in cursor:
             result.append({
@@ -502,12 +555,33 @@ async def delete_pessoa(uuid: str):
         if not pessoa:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
 
-        # Deletar imagens do MinIO
-        for image_path in pessoa.get("image_paths", []):
-            minio_client.remove_object(MINIO_BUCKET, image_path)
+        # Deletar imagens do MinIO — só as que nenhuma outra pessoa ou presença usa
+        # (ex.: recortes de pessoas reprocessadas antes das cópias por modelo)
+        image_paths = pessoa.get("image_paths", [])
+        em_uso = set(pessoas.distinct("image_paths", {"uuid": {"$ne": uuid}, "image_paths": {"$in": image_paths}}))
+        em_uso.update(presencas.distinct("foto_captura", {"pessoa": {"$ne": uuid}, "foto_captura": {"$in": image_paths}}))
+        for image_path in image_paths:
+            if image_path not in em_uso:
+                minio_client.remove_object(MINIO_BUCKET, image_path)
 
         # Deletar do banco de dados
+        galerias_da_pessoa = {}
+        for doc in embeddings.aggregate([
+            {"$match": {"pessoa": uuid}},
+            {"$group": {"_id": "$tag_video", "modelos": {"$addToSet": "$modelo"}}},
+        ]):
+            galerias_da_pessoa[doc["_id"]] = doc["modelos"]
         pessoas.delete_one({"uuid": uuid})
+        embeddings.delete_many({"pessoa": uuid})
+
+        # invalida as galerias em memória dos workers e da busca (como a consolidação):
+        # a geração nova faz os workers recarregarem em vez de só aplicar o que foi gravado
+        for tag_video, modelos in galerias_da_pessoa.items():
+            galerias.update_one(
+                {"_id": tag_video},
+                {"$inc": {"versao": 1, "geracao": 1, **{_campo_versao(m): 1 for m in modelos}}},
+                upsert=True
+            )
 
         return JSONResponse({"message": "Pessoa deletada com sucesso"}, status_code=200)
     except Exception as e:
@@ -576,6 +650,203 @@ async def count_photos(uuid: str):
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+# ----------------------------
+# Busca por imagem
+# ----------------------------
+
+def _gerar_embedding_busca(image_bytes: bytes, modelo: str) -> np.ndarray:
+    """
+    Embedding da imagem enviada: pelo serviço de embeddings (mesmo usado pelo
+    worker, http:// ou unix://) ou, sem ele, pelo DeepFace neste processo.
+    """
+    cliente = obter_cliente_embeddings()
+    if cliente is not None:
+        embedding = cliente.gerar([image_bytes], modelo)[0]
+    else:
+        from deepface import DeepFace
+        image_np = np.array(Image.open(BytesIO(image_bytes)))
+        resultado = DeepFace.represent(img_path=image_np, model_name=modelo, enforce_detection=False)
+        embedding = resultado[0]["embedding"] if resultado else None
+
+    if embedding is None:
+        raise HTTPException(status_code=422, detail="Não foi possível gerar o embedding da imagem")
+    return np.asarray(embedding, dtype=np.float32)
+
+
+_limiares_busca = {}  # modelo -> limiar de cosseno
+
+
+def _limiar_busca(modelo: str) -> float:
+    """
+    Limiar de cosseno do modelo (o mesmo que o worker usa para casar uma face).
+    Com o serviço de embeddings, vem dele: o DeepFace não é carregado na API.
+    """
+    if modelo not in _limiares_busca:
+        cliente = obter_cliente_embeddings()
+        if cliente is not None:
+            _limiares_busca[modelo] = cliente.info(modelo, espera_max=0)["threshold"]
+        else:
+            from deepface.modules.verification import find_threshold
+            _limiares_busca[modelo] = find_threshold(modelo, "cosine")
+    return _limiares_busca[modelo]
+
+
+def _campo_versao(modelo: str) -> str:
+    """Contador de versão da galeria em `galerias` (mesma convenção do worker)."""
+    return "versao" if modelo == MODEL_NAME else f"versao_{modelo}"
+
+
+class _IndiceBusca:
+    """
+    Embeddings de uma tag_video e modelo em uma única matriz normalizada, com as
+    linhas agrupadas por pessoa. Fica em memória enquanto a versão da galeria
+    não muda; a busca é um produto matriz-vetor e uma redução por pessoa.
+    """
+
+    def __init__(self, tag_video: str, modelo: str, versao: int):
+        self.versao = versao
+        docs = list(embeddings.find(
+            # embeddings de fontes reprocessadas (com fonte_id) ficam fora da busca ao vivo
+            {"tag_video": tag_video, "modelo": modelo, "fonte_id": {"$exists": False}},
+            {"pessoa": 1, "formato": 1, "dim": 1, "escala": 1, "vetor": 1}
+        ))
+        if not docs:
+            self.uuids, self.matriz, self.inicios = [], np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+            return
+        matriz = desempacotar(docs)
+        uuids, donos = np.unique([d["pessoa"] for d in docs], return_inverse=True)
+        ordem = np.argsort(donos, kind="stable")
+        matriz = matriz[ordem]
+        self.matriz = matriz / np.maximum(np.linalg.norm(matriz, axis=1, keepdims=True), 1e-12)
+        self.uuids = uuids.tolist()
+        self.inicios = np.concatenate([[0], np.cumsum(np.bincount(donos))[:-1]])
+
+    def buscar(self, consulta: np.ndarray) -> tuple:
+        """(uuids, menor distância de cosseno de cada pessoa à consulta normalizada)."""
+        if not self.uuids or self.matriz.shape[1] != consulta.shape[0]:
+            return [], np.empty(0, dtype=np.float32)
+        distancias = 1.0 - self.matriz @ consulta
+        return self.uuids, np.minimum.reduceat(distancias, self.inicios)
+
+
+_indices_busca = OrderedDict()  # (tag_video, modelo, versao) -> _IndiceBusca, LRU com BUSCA_MAX_INDICES
+_tags_busca = {}  # (modelo, tag_video ou None) -> (versões das galerias, tags com embeddings)
+_trava_busca = threading.Lock()
+
+
+def _indice_busca(tag_video: str, modelo: str, versao: int) -> _IndiceBusca:
+    chave = (tag_video, modelo, versao)
+    with _trava_busca:
+        indice = _indices_busca.get(chave)
+        if indice is not None:
+            _indices_busca.move_to_end(chave)
+            return indice
+
+    indice = _IndiceBusca(tag_video, modelo, versao)
+    with _trava_busca:
+        # versões antigas da mesma galeria não voltam a ser usadas
+        for antiga in [c for c in _indices_busca if c[:2] == chave[:2] and c[2] < versao]:
+            del _indices_busca[antiga]
+        _indices_busca[chave] = indice
+        while len(_indices_busca) > BUSCA_MAX_INDICES:
+            _indices_busca.popitem(last=False)
+    return indice
+
+
+def _galerias_busca(modelo: str, tag_video: Optional[str]) -> dict:
+    """
+    {tag_video: versão} das galerias no escopo da busca. As versões vêm de
+    `galerias` a cada busca; o `distinct` em `embeddings` (tags migradas não têm
+    documento em `galerias`) só é refeito quando alguma versão muda.
+    """
+    campo = _campo_versao(modelo)
+    versoes = {d["_id"]: d.get(campo, 0) for d in galerias.find(
+        {"_id": tag_video} if tag_video else {}, {campo: 1}
+    )}
+    chave = (modelo, tag_video)
+    em_cache = _tags_busca.get(chave)
+    if em_cache is None or em_cache[0] != versoes:
+        filtro_tags = {"modelo": modelo}
+        if tag_video:
+            filtro_tags["tag_video"] = tag_video
+        em_cache = (versoes, embeddings.distinct("tag_video", filtro_tags))
+        with _trava_busca:
+            _tags_busca.pop(chave, None)
+            _tags_busca[chave] = em_cache
+            while len(_tags_busca) > BUSCA_MAX_INDICES:
+                _tags_busca.pop(next(iter(_tags_busca)))
+    return {tag: versoes.get(tag, 0) for tag in em_cache[1]}
+
+
+@app.post("/pessoas/search", dependencies=[Depends(get_current_active_user)])
+def search_pessoas(payload: BuscaPayload):
+    """
+    Busca as pessoas mais parecidas com a face enviada (base64), opcionalmente
+    só na galeria de uma tag_video. Retorna as top_k pessoas com a menor
+    distância de cosseno entre a face e os embeddings de cada uma.
+    Rota síncrona: o FastAPI a executa no threadpool (embedding e Mongo bloqueiam).
+    """
+    try:
+        inicio = time.perf_counter()
+        modelo = payload.modelo or MODEL_NAME
+        if not modelo:
+            raise HTTPException(status_code=400, detail="Modelo não informado (MODEL_NAME não configurado)")
+        if payload.top_k < 1:
+            raise HTTPException(status_code=400, detail="top_k deve ser >= 1")
+        try:
+            image_bytes = base64.b64decode(payload.image.split(",", 1)[-1])
+        except Exception:
+            raise HTTPException(status_code=400, detail="Imagem base64 inválida")
+
+        consulta = _gerar_embedding_busca(image_bytes, modelo)
+        consulta = consulta / max(float(np.linalg.norm(consulta)), 1e-12)
+        tempo_embedding = time.perf_counter() - inicio
+
+        # versão de cada galeria no escopo: índices em memória só são refeitos quando ela muda
+        candidatos_uuid, candidatos_dist, candidatos_tag = [], [], []
+        for tag, versao in _galerias_busca(modelo, payload.tag_video).items():
+            uuids, distancias = _indice_busca(tag, modelo, versao).buscar(consulta)
+            candidatos_uuid.extend(uuids)
+            candidatos_dist.append(distancias)
+            candidatos_tag.extend([tag] * len(uuids))
+
+        distancias = np.concatenate(candidatos_dist) if candidatos_dist else np.empty(0, dtype=np.float32)
+        k = min(payload.top_k, len(distancias))
+        melhores = np.argpartition(distancias, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        melhores = melhores[np.argsort(distancias[melhores])]
+
+        limiar = _limiar_busca(modelo)
+        uuids_top = [candidatos_uuid[i] for i in melhores]
+        docs = {p["uuid"]: p for p in pessoas.find(
+            {"uuid": {"$in": uuids_top}}, {"uuid": 1, "tags": 1, "image_paths": {"$slice": 1}}
+        )}
+        resultados = []
+        for i in melhores:
+            pessoa = docs.get(candidatos_uuid[i], {})
+            resultados.append({
+                "uuid": candidatos_uuid[i],
+                "tag_video": candidatos_tag[i],
+                "tags": pessoa.get("tags", []),
+                "distancia": float(distancias[i]),
+                "similaridade": 1.0 - float(distancias[i]),
+                "corresponde": bool(distancias[i] < limiar),
+                "primary_photo": get_presigned_url(pessoa["image_paths"][0]) if pessoa.get("image_paths") else None,
+            })
+
+        return JSONResponse({
+            "modelo": modelo,
+            "limiar": limiar,
+            "resultados": resultados,
+            "pessoas_comparadas": int(len(distancias)),
+            "tempo_embedding_ms": tempo_embedding * 1000,
+            "tempo_busca_ms": (time.perf_counter() - inicio - tempo_embedding) * 1000,
+        }, status_code=200)
+    except HTTPException as e:
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
+    except Exception as e:
+        logger.error(f"Erro na busca por imagem: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
 @app.delete("/presencas/{id}", dependencies=[Depends(get_current_active_user)])
 async def delete_presenca(id: str):
     """
@@ -1074,7 +1345,48 @@ def _calc_frames_stats(fonte_oid: ObjectId, tag_video_da_fonte: str) -> dict:
     }
 
 
-def _calc_faces_clusters_stats(fonte_oid: ObjectId, tag_video_da_fonte: str) -> dict:
+def _carregar_embeddings_por_pessoa(tag_video: str, modelo: Optional[str] = None,
+                                    fonte_id: Optional[ObjectId] = None) -> dict:
+    """
+    Retorna {uuid: matriz (n, D)} com os embeddings observados de cada pessoa
+    da tag_video. Centróides das pessoas compactadas (slot -1) ficam de fora.
+    Com `fonte_id`, só os da fonte reprocessada; sem, só os do worker ao vivo.
+    """
+    filtro = {
+        "tag_video": tag_video,
+        "slot": {"$ne": -1},
+        "fonte_id": fonte_id if fonte_id is not None else {"$exists": False},
+    }
+    if modelo:
+        filtro["modelo"] = modelo
+    docs = list(embeddings.find(filtro, {"pessoa": 1, "formato": 1, "dim": 1, "escala": 1, "vetor": 1}))
+    if not docs:
+        return {}
+
+    matriz = desempacotar(docs)
+    uuids, owners = np.unique([d["pessoa"] for d in docs], return_inverse=True)
+    ordem = np.argsort(owners, kind="stable")
+    blocos = np.split(matriz[ordem], np.cumsum(np.bincount(owners))[:-1])
+    return dict(zip(uuids.tolist(), blocos))
+
+
+def _filtro_pessoas_da_fonte(fonte_doc: dict) -> dict:
+    """
+    Pessoas de uma execução. Fontes reprocessadas (reprocessar.py) marcam suas
+    pessoas com `fonte_id`; o worker ao vivo marca `modelo_utilizado` (pessoas
+    antigas não têm nenhum dos dois e contam para as fontes ao vivo da tag_video).
+    """
+    if fonte_doc.get("reprocessamento"):
+        return {"fonte_id": fonte_doc["_id"]}
+    return {
+        "tag_video": fonte_doc.get("tag_video"),
+        "fonte_id": {"$exists": False},
+        "modelo_utilizado": {"$in": [fonte_doc.get("modelo_utilizado"), None]},
+    }
+
+
+def _calc_faces_clusters_stats(fonte_oid: ObjectId, tag_video_da_fonte: str, modelo: Optional[str] = None,
+                               filtro_pessoas: Optional[dict] = None, reprocessada: bool = False) -> dict:
     """
     Calcula:
       - total_faces_analisadas = presenças com essa fonte_id
@@ -1084,12 +1396,22 @@ def _calc_faces_clusters_stats(fonte_oid: ObjectId, tag_video_da_fonte: str) ->
         "total_faces_analisadas": int,
         "total_clusters_gerados": int
       }
+
+    Os embeddings de cada pessoa vêm da coleção 'embeddings' (matrizes NumPy);
+    pessoas ainda não migradas usam a lista antiga do próprio documento.
     """
     total_faces_analisadas = presencas.count_documents({"fonte_id": fonte_oid})
 
-    pessoas_docs = list(pessoas.find({"tag_video": tag_video_da_fonte}))
+    pessoas_docs = list(pessoas.find(filtro_pessoas or {"tag_video": tag_video_da_fonte}, {"uuid": 1, "embeddings": 1}))
     total_clusters_gerados = len(pessoas_docs)
 
+    embeddings_por_pessoa = _carregar_embeddings_por_pessoa(
+        tag_video_da_fonte, modelo, fonte_oid if reprocessada else None
+    )
+    for pessoa_doc in pessoas_docs:
+        if pessoa_doc.get("uuid") in embeddings_por_pessoa:
+            pessoa_doc["embeddings"] = embeddings_por_pessoa[pessoa_doc["uuid"]]
+
     return {
         "total_faces_analisadas": total_faces_analisadas,
         "total_clusters_gerados": total_clusters_gerados,
@@ -1149,43 +1471,40 @@ def _calc_confusion_metrics(fonte_oid: ObjectId, pessoas_nao_cobertas: int) -> d
         "f1_score": f1_score,
     }
 
-def _calc_centroid(embs: list[list[float]]) -> list[float] | None:
+def _como_matriz(embs) -> np.ndarray | None:
     """
-    Calcula o centróide (média coordenada-a-coordenada) de uma lista de embeddings
-    de uma pessoa. Ignora embeddings vazios/dimensionados errado.
-    Retorna o vetor centróide ou None se não conseguir.
+    Converte os embeddings de uma pessoa (matriz NumPy ou lista de listas) em
+    uma matriz float32, descartando vetores com dimensão diferente do primeiro.
     """
-    if not embs:
+    if embs is None or len(embs) == 0:
         return None
+    if isinstance(embs, np.ndarray):
+        return embs if embs.ndim == 2 and embs.shape[1] > 0 else None
 
     dim = len(embs[0])
-    if dim == 0:
-        return None
-
-    # Verifica se há ao menos um embedding válido com esse dim
     valid_embs = [e for e in embs if isinstance(e, list) and len(e) == dim]
-    if not valid_embs:
+    if dim == 0 or not valid_embs:
         return None
+    return np.asarray(valid_embs, dtype=np.float32)
 
-    centroid = []
-    for k in range(dim):
-        soma_k = 0.0
-        for e in valid_embs:
-            soma_k += float(e[k])
-        centroid.append(soma_k / len(valid_embs))
 
-    return centroid
+def _calc_centroid(embs) -> np.ndarray | None:
+    """
+    Calcula o centróide (média coordenada-a-coordenada) dos embeddings
+    de uma pessoa. Ignora embeddings vazios/dimensionados errado.
+    Retorna o vetor centróide ou None se não conseguir.
+    """
+    matriz = _como_matriz(embs)
+    if matriz is None:
+        return None
+    return matriz.mean(axis=0)
 
 
-def _euclidean_distance(a: list[float], b: list[float]) -> float:
+def _euclidean_distance(a, b) -> float:
     """
     Distância euclidiana padrão entre dois vetores de mesma dimensão.
     """
-    dist_sq = 0.0
-    for i in range(len(a)):
-        diff = a[i] - b[i]
-        dist_sq += diff * diff
-    return math.sqrt(dist_sq)
+    return float(np.linalg.norm(np.asarray(a, dtype=np.float32) - np.asarray(b, dtype=np.float32)))
 
 
 def _calc_inter_cluster_distance(pessoas_docs: list[dict]) -> float:
@@ -1196,28 +1515,21 @@ def _calc_inter_cluster_distance(pessoas_docs: list[dict]) -> float:
       - Retorna a média dessas distâncias.
       - Se houver menos de 2 centróides válidos, retorna 0.0.
     """
-    centroids: list[list[float]] = []
-
-    for pessoa_doc in pessoas_docs:
-        embs = pessoa_doc.get("embeddings", [])
-        centroid = _calc_centroid(embs)
-        if centroid is not None:
-            centroids.append(centroid)
+    centroids = [_calc_centroid(p.get("embeddings")) for p in pessoas_docs]
+    centroids = [c for c in centroids if c is not None]
+    if centroids:
+        dim = len(centroids[0])
+        centroids = [c for c in centroids if len(c) == dim]
 
     if len(centroids) < 2:
         return 0.0
 
-    soma_dist = 0.0
-    pares = 0
-    for i in range(len(centroids)):
-        for j in range(i + 1, len(centroids)):
-            soma_dist += _euclidean_distance(centroids[i], centroids[j])
-            pares += 1
-
-    if pares == 0:
-        return 0.0
-
-    return soma_dist / pares
+    # todas as distâncias par-a-par de uma vez: ||a||² + ||b||² - 2·a·b
+    C = np.stack(centroids).astype(np.float64)
+    sq = (C * C).sum(axis=1)
+    dist = np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2.0 * (C @ C.T), 0.0))
+    i, j = np.triu_indices(len(C), k=1)
+    return float(dist[i, j].mean())
 
 
 def _calc_intra_cluster_distance(pessoas_docs: list[dict]) -> float:
@@ -1235,28 +1547,13 @@ def _calc_intra_cluster_distance(pessoas_docs: list[dict]) -> float:
     dispersoes_por_pessoa: list[float] = []
 
     for pessoa_doc in pessoas_docs:
-        embs = pessoa_doc.get("embeddings", [])
-        if not embs:
-            continue
-
-        centroid = _calc_centroid(embs)
-        if centroid is None:
-            continue
-
-        # filtra embeddings válidos (mesmo dim do centróide)
-        dim = len(centroid)
-        valid_embs = [e for e in embs if isinstance(e, list) and len(e) == dim]
-        if not valid_embs:
+        matriz = _como_matriz(pessoa_doc.get("embeddings"))
+        if matriz is None:
             continue
 
         # distâncias de cada embedding até o centróide
-        distancias = []
-        for e in valid_embs:
-            distancias.append(_euclidean_distance(e, centroid))
-
-        if distancias:
-            media_cluster = sum(distancias) / len(distancias)
-            dispersoes_por_pessoa.append(media_cluster)
+        distancias = np.linalg.norm(matriz - matriz.mean(axis=0), axis=1)
+        dispersoes_por_pessoa.append(float(distancias.mean()))
 
     if not dispersoes_por_pessoa:
         return 0.0
@@ -1266,18 +1563,22 @@ def _calc_intra_cluster_distance(pessoas_docs: list[dict]) -> float:
 
 def _calc_silhouette_score(pessoas_docs):
     # Coleta todos os embeddings e rótulos correspondentes
-    X = []
+    matrizes = []
     labels = []
     for idx, pessoa in enumerate(pessoas_docs):
-        for emb in pessoa.get("embeddings", []):
-            X.append(emb)
-            labels.append(idx)  # cluster ID da pessoa
+        matriz = _como_matriz(pessoa.get("embeddings"))
+        if matriz is None:
+            continue
+        if matrizes and matriz.shape[1] != matrizes[0].shape[1]:
+            continue
+        matrizes.append(matriz)
+        labels.append(np.full(len(matriz), idx))  # cluster ID da pessoa
 
-    if len(set(labels)) < 2:
+    if len(matrizes) < 2:
         return None  # Silhouette não é definido para apenas 1 cluster
 
-    X = np.array(X, dtype=np.float32)
-    labels = np.array(labels)
+    X = np.concatenate(matrizes).astype(np.float32)
+    labels = np.concatenate(labels)
 
     try:
         score = silhouette_score(X, labels, metric="euclidean")
@@ -1447,7 +1748,10 @@ async def recalcular_fonte(id: str):
         total_de_frames = frames_stats["total_de_frames"]
 
         # 4. faces & clusters
-        faces_clusters_stats = _calc_faces_clusters_stats(oid, tag_video_da_fonte)
+        faces_clusters_stats = _calc_faces_clusters_stats(
+            oid, tag_video_da_fonte, fonte_doc.get("modelo_utilizado"), _filtro_pessoas_da_fonte(fonte_doc),
+            reprocessada=bool(fonte_doc.get("reprocessamento")),
+        )
         total_faces_analisadas = faces_clusters_stats["total_faces_analisadas"]
         total_clusters_gerados = faces_clusters_stats["total_clusters_gerados"]
         pessoas_docs = faces_clusters_stats["pessoas_docs"]
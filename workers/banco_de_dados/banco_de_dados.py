@@ -22,7 +22,9 @@ MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 QUEUE_NAME_BD = os.getenv("QUEUE_NAME_BD")
-MODEL_NAME = os.getenv("MODEL_NAME", "desconhecido")  # versão/modelo do reconhecimento
+# Modelo do reconhecimento: vem em cada mensagem; o .env só vale para mensagens sem
+# o campo (workers antigos e continuações de rastreio ainda sem identidade)
+MODEL_NAME = os.getenv("MODEL_NAME")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("banco_de_dados")
 
@@ -35,6 +37,7 @@ presencas: Collection = db["presencas"]
 frames: Collection = db["frames"]
 counters: Collection = db["counters"]
 fontes: Collection = db["fonte"]  # nova coleção
+rastreios: Collection = db["rastreios"]  # última identidade reconhecida de cada rastreio da detecção
 
 
 # =========================
@@ -189,6 +192,12 @@ def montar_presence_doc(
         "tempo_fila_real": tempo_fila_real,
 
         "similarity_value": msg.get("similarity_value"),
+        "cascata": msg.get("cascata"),  # estágio e tempos do reconhecimento em cascata (se ligado)
+
+        # rastreio da detecção: continuações não passam pelo reconhecimento
+        "track_id": msg.get("track_id"),
+        "continuacao_rastreio": bool(msg.get("continuacao_rastreio")),
+        "qualidade": msg.get("qualidade"),  # nota e critérios do filtro de qualidade da detecção
 
         # relacionamento explícito
         "fonte_id": fonte_id,
@@ -283,6 +292,46 @@ def atualizar_ou_criar_frame(
     frames.insert_one(novo_frame)
 
 
+# =========================
+# Repositório: Rastreios
+# =========================
+
+def registrar_identidade_rastreio(track_id: str, presence_doc: Dict[str, Any], modelo: str) -> None:
+    """
+    Guarda a identidade reconhecida para o rastreio e completa as continuações
+    que chegaram antes dela (o reconhecimento é mais lento que a detecção).
+    """
+    identidade = {
+        "pessoa": presence_doc.get("pessoa"),
+        "tags": presence_doc.get("tags", []),
+        "similarity_value": presence_doc.get("similarity_value"),
+    }
+    rastreios.update_one(
+        {"_id": track_id},
+        {"$set": {**identidade, "tag_video": presence_doc.get("tag_video"), "modelo": modelo,
+                  "atualizado_em": presence_doc["fim_processamento"]}},
+        upsert=True
+    )
+    completadas = presencas.update_many(
+        {"track_id": track_id, "continuacao_rastreio": True, "pessoa": None},
+        {"$set": identidade}
+    ).modified_count
+    if completadas:
+        logger.info(f"🧭 {completadas} continuações do rastreio {track_id} atribuídas a {identidade['pessoa']}")
+
+
+def identidade_do_rastreio(track_id: str) -> Optional[Dict[str, Any]]:
+    return rastreios.find_one({"_id": track_id}, {"pessoa": 1, "tags": 1, "similarity_value": 1, "modelo": 1})
+
+
+def atribuir_continuacao(presence_doc: Dict[str, Any], identidade: Optional[Dict[str, Any]]) -> None:
+    """Continuação de rastreio: herda a última identidade reconhecida (se já houver)."""
+    if identidade:
+        presence_doc["pessoa"] = identidade.get("pessoa")
+        presence_doc["tags"] = identidade.get("tags", [])
+        presence_doc["similarity_value"] = identidade.get("similarity_value")
+
+
 # =========================
 # Orquestrador principal (consumer)
 # =========================
@@ -309,12 +358,20 @@ async def registrar_presenca(message: aio_pika.IncomingMessage):
             fps = msg.get("fps")
             duracao = msg["duracao"]
             tag_video = msg.get("tag_video")
-            
+            track_id = msg.get("track_id")
+            continuacao = bool(msg.get("continuacao_rastreio"))
+
+            # --- modelo da fonte: o da mensagem (ou o do rastreio, nas continuações)
+            identidade = identidade_do_rastreio(track_id) if track_id and continuacao else None
+            modelo = msg.get("modelo") or (identidade or {}).get("modelo") or MODEL_NAME
+            if not modelo:
+                raise ValueError("mensagem sem 'modelo' e MODEL_NAME não configurado")
+
             # --- garantir/obter fonte
             fonte_doc = get_or_create_fonte(
                 tag_video=tag_video,
                 timestamp_atual=fim_processamento,
-                modelo_utilizado=MODEL_NAME,
+                modelo_utilizado=modelo,
                 duracao=duracao
             )
             fonte_id = fonte_doc["_id"]
@@ -330,9 +387,23 @@ async def registrar_presenca(message: aio_pika.IncomingMessage):
                 fonte_id=fonte_id
             )
 
+            if track_id and continuacao:
+                atribuir_continuacao(presence_doc, identidade)
+
             # --- inserir presença e recuperar ID
             presenca_id = inserir_presenca(presence_doc)
 
+            if track_id and not continuacao:
+                registrar_identidade_rastreio(track_id, presence_doc, modelo)
+            elif track_id and presence_doc.get("pessoa") is None:
+                # o reconhecimento pode ter registrado a identidade entre a consulta e a inserção
+                identidade = identidade_do_rastreio(track_id)
+                if identidade:
+                    presencas.update_one(
+                        {"_id": presenca_id, "pessoa": None},
+                        {"$set": {k: identidade.get(k) for k in ("pessoa", "tags", "similarity_value")}}
+                    )
+
             # --- atualizar ou criar frame associado
             atualizar_ou_criar_frame(
                 frame_uuid=frame_uuid,
@@ -360,6 +431,8 @@ async def registrar_presenca(message: aio_pika.IncomingMessage):
 # =========================
 
 async def main():
+    if not MODEL_NAME:
+        logger.warning("⚠️ MODEL_NAME não configurado: mensagens sem 'modelo' serão rejeitadas")
     connection = await aio_pika.connect_robust(f"amqp://{RABBITMQ_HOST}/")
     channel = await connection.channel()
     await channel.set_qos(prefetch_count=10)
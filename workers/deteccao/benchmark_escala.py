@@ -0,0 +1,169 @@
+"""
+Benchmark: latência x revocação da detecção em frames reduzidos.
+
+Roda o mesmo MediaPipe FaceDetection do worker (model_selection=1, confiança
+mínima 0.80) sobre frames gravados, primeiro na resolução original (referência)
+e depois com o lado maior reduzido para cada escala pedida. Para cada escala mede:
+  - latência média e p95 por frame (redimensionamento + detecção)
+  - revocação: fração das faces da referência encontradas na escala (IoU >= --iou
+    entre as caixas no frame original), no total e por faixa de largura da face
+  - faces extras: detecções na escala sem par na referência
+
+Os frames vêm de uma pasta local (--pasta) ou do bucket de frames no MinIO
+(--prefixo, usando FRAME_BUCKET e as credenciais do .env).
+
+Uso:
+    python benchmark_escala.py --pasta ./frames --lados 320 480 640 960
+    python benchmark_escala.py --prefixo 16-10-2026/ --limite 300
+"""
+import argparse
+import os
+import time
+
+import cv2
+import mediapipe as mp
+import numpy as np
+from dotenv import load_dotenv
+
+MIN_DETECTION_CONFIDENCE = 0.80
+# faixas de largura da face (px no frame original) para a revocação por tamanho
+FAIXAS_LARGURA = [(0, 40), (40, 80), (80, 160), (160, 100000)]
+
+
+def carregar_frames(args) -> list:
+    if args.pasta:
+        nomes = sorted(n for n in os.listdir(args.pasta) if n.lower().endswith((".jpg", ".jpeg", ".png")))
+        frames = [cv2.imread(os.path.join(args.pasta, n)) for n in nomes[:args.limite]]
+        return [f for f in frames if f is not None]
+
+    from minio import Minio
+    client = Minio(
+        os.getenv("MINIO_ENDPOINT"),
+        access_key=os.getenv("MINIO_ACCESS_KEY"),
+        secret_key=os.getenv("MINIO_SECRET_KEY"),
+        secure=False
+    )
+    frames = []
+    for obj in client.list_objects(os.getenv("FRAME_BUCKET"), prefix=args.prefixo, recursive=True):
+        if len(frames) >= args.limite:
+            break
+        resp = client.get_object(os.getenv("FRAME_BUCKET"), obj.object_name)
+        try:
+            img = cv2.imdecode(np.frombuffer(resp.read(), np.uint8), cv2.IMREAD_COLOR)
+        finally:
+            resp.close()
+            resp.release_conn()
+        if img is not None:
+            frames.append(img)
+    return frames
+
+
+def detectar(detector, img, lado_maior: int):
+    """(caixas (x1, y1, x2, y2) no frame original, segundos). lado_maior 0 = original."""
+    h, w = img.shape[:2]
+    inicio = time.perf_counter()
+    entrada = img
+    escala = lado_maior / max(h, w) if lado_maior else 1.0
+    if escala < 1.0:
+        entrada = cv2.resize(img, (round(w * escala), round(h * escala)), interpolation=cv2.INTER_AREA)
+    results = detector.process(cv2.cvtColor(entrada, cv2.COLOR_BGR2RGB))
+    tempo = time.perf_counter() - inicio
+
+    caixas = []
+    for det in results.detections or []:
+        if det.score[0] < MIN_DETECTION_CONFIDENCE:
+            continue
+        bb = det.location_data.relative_bounding_box
+        x1, y1 = max(0.0, bb.xmin * w), max(0.0, bb.ymin * h)
+        caixas.append((x1, y1, min(w, x1 + bb.width * w), min(h, y1 + bb.height * h)))
+    return np.array(caixas, dtype=np.float64).reshape(-1, 4), tempo
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Matriz (len(a), len(b)) de IoU entre caixas (x1, y1, x2, y2)."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def encontradas(referencia: np.ndarray, caixas: np.ndarray, limiar_iou: float) -> np.ndarray:
+    """Máscara das faces da referência com par na escala (casamento guloso por IoU)."""
+    achou = np.zeros(len(referencia), dtype=bool)
+    if not len(referencia) or not len(caixas):
+        return achou
+    m = iou(referencia, caixas)
+    while m.size and m.max() >= limiar_iou:
+        i, j = np.unravel_index(np.argmax(m), m.shape)
+        achou[i] = True
+        m[i, :] = -1
+        m[:, j] = -1
+    return achou
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Mede latência e revocação da detecção em frames reduzidos.")
+    origem = parser.add_mutually_exclusive_group(required=True)
+    origem.add_argument("--pasta", help="pasta com frames .jpg/.png")
+    origem.add_argument("--prefixo", help="prefixo dos frames no FRAME_BUCKET")
+    parser.add_argument("--limite", type=int, default=200, help="número máximo de frames")
+    parser.add_argument("--lados", type=int, nargs="+", default=[320, 480, 640, 960],
+                        help="lado maior (px) de cada escala testada")
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--aquecimento", type=int, default=5, help="frames descartados antes de medir")
+    args = parser.parse_args()
+
+    frames = carregar_frames(args)
+    if not frames:
+        raise SystemExit("❌ Nenhum frame carregado")
+    altura, largura = frames[0].shape[:2]
+    print(f"📂 {len(frames)} frames ({largura}x{altura})")
+
+    detector = mp.solutions.face_detection.FaceDetection(
+        model_selection=1, min_detection_confidence=MIN_DETECTION_CONFIDENCE
+    )
+    for img in frames[:args.aquecimento]:
+        detectar(detector, img, 0)
+
+    referencia, tempos = [], []
+    for img in frames:
+        caixas, tempo = detectar(detector, img, 0)
+        referencia.append(caixas)
+        tempos.append(tempo)
+    total_ref = sum(len(c) for c in referencia)
+    larguras = np.concatenate([c[:, 2] - c[:, 0] for c in referencia]) if total_ref else np.empty(0)
+    base_ms = np.mean(tempos) * 1000
+    print(f"🎯 Referência (original): {total_ref} faces, {base_ms:.2f} ms/frame média, "
+          f"p95 {np.percentile(tempos, 95) * 1000:.2f} ms")
+
+    cabecalho_faixas = " ".join(f"{a}-{b if b < 100000 else '∞'}px".rjust(11) for a, b in FAIXAS_LARGURA)
+    print(f"\n{'lado':>6} {'média ms':>9} {'p95 ms':>8} {'speedup':>8} {'revocação':>10} {'extras':>7}  {cabecalho_faixas}")
+    for lado in sorted(args.lados, reverse=True):
+        tempos, mascaras, extras = [], [], 0
+        for img, ref in zip(frames, referencia):
+            caixas, tempo = detectar(detector, img, lado)
+            tempos.append(tempo)
+            achou = encontradas(ref, caixas, args.iou)
+            mascaras.append(achou)
+            extras += max(len(caixas) - int(achou.sum()), 0)
+        achou = np.concatenate(mascaras) if mascaras else np.empty(0, dtype=bool)
+        revocacao = achou.mean() if len(achou) else float("nan")
+
+        por_faixa = []
+        for a, b in FAIXAS_LARGURA:
+            na_faixa = (larguras >= a) & (larguras < b)
+            por_faixa.append(f"{achou[na_faixa].mean():.3f} ({na_faixa.sum()})" if na_faixa.any() else "-")
+        media_ms = np.mean(tempos) * 1000
+        print(
+            f"{lado:>6} {media_ms:>9.2f} {np.percentile(tempos, 95) * 1000:>8.2f} {base_ms / media_ms:>7.2f}x "
+            f"{revocacao:>10.3f} {extras:>7}  " + " ".join(f.rjust(11) for f in por_faixa)
+        )
+
+
+if __name__ == "__main__":
+    main()
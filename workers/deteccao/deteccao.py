@@ -7,18 +7,29 @@ logging.getLogger('absl').setLevel(logging.ERROR)
 # imports principais
 import time
 import json
+import hashlib
+import multiprocessing
+import queue
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from io import BytesIO
 
 import cv2
 import numpy as np
 import pika
 import mediapipe as mp
+import urllib3
 from dotenv import load_dotenv
 from minio import Minio
 from minio.error import S3Error
 from pymongo import MongoClient, ReturnDocument
 
+import qualidade
+from rastreador import Rastreador
+
 # resto do seu script…
 
 
@@ -34,39 +45,140 @@ MINIO_ACCESS_KEY         = os.getenv('MINIO_ACCESS_KEY')
 MINIO_SECRET_KEY         = os.getenv('MINIO_SECRET_KEY')
 FRAME_BUCKET             = os.getenv('FRAME_BUCKET')
 DETECCOES_BUCKET         = os.getenv('DETECCOES_BUCKET')
+BUCKET_RECONHECIMENTO    = os.getenv('BUCKET_RECONHECIMENTO')
+QUEUE_NAME_BD            = os.getenv('QUEUE_NAME_BD', 'reconhecimentos')
 OUTPUT_FOLDER_DETECTIONS = os.getenv('OUTPUT_FOLDER_DETECTIONS')
 MONGO_URI                = os.getenv('MONGO_URI')
 MONGO_DB_NAME            = os.getenv('MONGO_DB_NAME')
 
+# Sharding do reconhecimento: as faces de cada tag_video vão sempre para a mesma
+# fila 'deteccoes.<shard>' (0 = fila única 'deteccoes', sem sharding)
+RECONHECIMENTO_SHARDS    = int(os.getenv('RECONHECIMENTO_SHARDS', '0'))
+# um consumidor ativo por shard: os demais ficam de reserva
+ARGS_FILA_SHARD          = {"x-single-active-consumer": True}
+
+# Uploads dos recortes: pool de threads criado uma vez, com no máximo
+# DETECCAO_UPLOADS_PENDENTES faces aguardando upload (o callback espera abaixo disso)
+DETECCAO_UPLOAD_WORKERS    = int(os.getenv('DETECCAO_UPLOAD_WORKERS', '8'))
+DETECCAO_UPLOADS_PENDENTES = int(os.getenv('DETECCAO_UPLOADS_PENDENTES', str(DETECCAO_UPLOAD_WORKERS * 4)))
+
+# Pipeline de entrada: até DETECCAO_PREFETCH frames não confirmados em voo, baixados
+# e decodificados por DETECCAO_DOWNLOAD_WORKERS threads antes de chegarem ao detector
+DETECCAO_PREFETCH          = int(os.getenv('DETECCAO_PREFETCH', '8'))
+DETECCAO_DOWNLOAD_WORKERS  = int(os.getenv('DETECCAO_DOWNLOAD_WORKERS', '4'))
+
+# Modo multiprocesso: DETECCAO_PROCESSOS consumidores (cada um com seu detector,
+# sua conexão e o prefetch acima) sob um processo supervisor; 1 = processo único
+DETECCAO_PROCESSOS         = int(os.getenv('DETECCAO_PROCESSOS', '1'))
+ESTATISTICAS_INTERVALO     = float(os.getenv('DETECCAO_ESTATISTICAS_INTERVALO', '10'))
+
+# Rastreamento (rastreador.py): só o início do rastreio, cada K-ésimo frame e as
+# melhoras de qualidade vão para o reconhecimento; os demais recortes seguem direto
+# para o banco como continuação do rastreio. Com DETECCAO_PROCESSOS > 1 cada processo
+# só vê parte dos frames de um vídeo e os rastreios ficam mais curtos.
+DETECCAO_RASTREIO          = os.getenv('DETECCAO_RASTREIO', 'false').lower() in ('1', 'true', 'sim')
+RASTREIO_IOU               = float(os.getenv('DETECCAO_RASTREIO_IOU', '0.3'))
+RASTREIO_K                 = int(os.getenv('DETECCAO_RASTREIO_K', '10'))
+RASTREIO_MELHORA           = float(os.getenv('DETECCAO_RASTREIO_MELHORA', '0.25'))
+RASTREIO_INTERVALO_MAXIMO  = float(os.getenv('DETECCAO_RASTREIO_INTERVALO_MAXIMO', '2.0'))  # segundos
+RASTREIO_OCIOSO            = float(os.getenv('DETECCAO_RASTREIO_OCIOSO', '300'))  # s sem frames da tag_video
+
 MIN_DETECTION_CONFIDENCE = 0.80   # confiança mínima MediaPipe
-#MIN_FACE_WIDTH           = 30    # px
-#MIN_FACE_HEIGHT          = 30    # px
+# Detecção em escala reduzida: o MediaPipe roda no frame redimensionado para este
+# lado maior (px) e as caixas relativas recortam o frame original (0 = resolução original).
+# Medir o efeito na revocação com benchmark_escala.py
+DETECCAO_LADO_MAIOR      = int(os.getenv('DETECCAO_LADO_MAIOR', '0'))
+
+# Filtro de qualidade (qualidade.py): 'desligado', 'descartar' (faces reprovadas não
+# são enviadas) ou 'marcar' (enviadas com o motivo na mensagem para a fila de baixa
+# prioridade '<fila>.baixa', que o reconhecimento só consome quando está ocioso)
+DETECCAO_QUALIDADE       = os.getenv('DETECCAO_QUALIDADE', 'desligado').lower()
+LIMITES_QUALIDADE        = qualidade.LimitesQualidade(
+    lado_minimo=int(os.getenv('DETECCAO_QUALIDADE_LADO_MINIMO', '40')),            # px
+    nitidez_minima=float(os.getenv('DETECCAO_QUALIDADE_NITIDEZ_MINIMA', '40')),    # var. do Laplaciano
+    yaw_maximo=float(os.getenv('DETECCAO_QUALIDADE_YAW_MAXIMO', '45')),            # graus
+)
 
 # ----------------------------------------
-# Inicializa MediaPipe FaceDetection
+# MediaPipe FaceDetection — criado no primeiro uso, um por processo
+# (o supervisor do modo multiprocesso não carrega o modelo)
 # ----------------------------------------
-mp_face_detector = mp.solutions.face_detection.FaceDetection(
-    model_selection=1,
-    min_detection_confidence=MIN_DETECTION_CONFIDENCE
-)
+mp_face_detector = None
+
+def obter_detector():
+    global mp_face_detector
+    if mp_face_detector is None:
+        mp_face_detector = mp.solutions.face_detection.FaceDetection(
+            model_selection=1,
+            min_detection_confidence=MIN_DETECTION_CONFIDENCE
+        )
+    return mp_face_detector
+
+# Contadores do modo multiprocesso: Array compartilhado com CAMPOS_POR_PROCESSO
+# posições por processo (frames, faces, segundos de detecção e uma por motivo de
+# rejeição de qualidade); cada processo só escreve nas suas
+CAMPOS_POR_PROCESSO = 3 + len(qualidade.MOTIVOS_REJEICAO)
+contadores      = None
+indice_processo = 0
+rejeicoes       = Counter()  # rejeições de qualidade deste processo, por motivo
+
+def registrar_deteccao(faces: int, tempo: float):
+    if contadores is None:
+        return
+    base = indice_processo * CAMPOS_POR_PROCESSO
+    contadores[base]     += 1
+    contadores[base + 1] += faces
+    contadores[base + 2] += tempo
+
+def registrar_rejeicao(motivo: str):
+    rejeicoes[motivo] += 1
+    if contadores is not None:
+        contadores[indice_processo * CAMPOS_POR_PROCESSO + 3 + qualidade.MOTIVOS_REJEICAO.index(motivo)] += 1
 
 # ----------------------------------------
-# Conexões externas
+# Conexões externas — criadas por `conectar` em cada processo consumidor
+# (o supervisor do modo multiprocesso não abre conexões nem pools)
 # ----------------------------------------
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=False
-)
-mongo_client = MongoClient(MONGO_URI)
-db           = mongo_client[MONGO_DB_NAME]
-frames       = db["frames"]
-counters     = db["counters"]
-
-# Garante que o bucket de detecções exista
-if not minio_client.bucket_exists(DETECCOES_BUCKET):
-    minio_client.make_bucket(DETECCOES_BUCKET)
+minio_client  = None
+upload_pool   = None
+download_pool = None
+vagas_upload  = threading.BoundedSemaphore(DETECCAO_UPLOADS_PENDENTES)
+# (delivery_tag, future do download) na ordem de entrega; limitada pelo prefetch
+fila_frames   = queue.Queue()
+frames        = None
+counters      = None
+
+def conectar():
+    global minio_client, upload_pool, download_pool, frames, counters
+    # pool HTTP compartilhado: uma conexão keep-alive por thread de download e de upload
+    minio_http = urllib3.PoolManager(
+        maxsize=DETECCAO_DOWNLOAD_WORKERS + DETECCAO_UPLOAD_WORKERS,
+        timeout=urllib3.Timeout(connect=5, read=60),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+    )
+    minio_client = Minio(
+        MINIO_ENDPOINT,
+        access_key=MINIO_ACCESS_KEY,
+        secret_key=MINIO_SECRET_KEY,
+        secure=False,
+        http_client=minio_http
+    )
+    upload_pool   = ThreadPoolExecutor(max_workers=DETECCAO_UPLOAD_WORKERS, thread_name_prefix="upload")
+    download_pool = ThreadPoolExecutor(max_workers=DETECCAO_DOWNLOAD_WORKERS, thread_name_prefix="download")
+    db       = MongoClient(MONGO_URI)[MONGO_DB_NAME]
+    frames   = db["frames"]
+    counters = db["counters"]
+
+    # Garante que o bucket de detecções exista
+    if not minio_client.bucket_exists(DETECCOES_BUCKET):
+        minio_client.make_bucket(DETECCOES_BUCKET)
+    # continuações de rastreio vão direto para o bucket do reconhecimento
+    if DETECCAO_RASTREIO and not minio_client.bucket_exists(BUCKET_RECONHECIMENTO):
+        minio_client.make_bucket(BUCKET_RECONHECIMENTO)
+
+# Rastreadores por tag_video (só a thread do detector usa), do usado há mais
+# tempo para o mais recente: os ociosos por RASTREIO_OCIOSO são descartados
+rastreadores = OrderedDict()  # tag_video -> (Rastreador, último uso em time.monotonic())
 
 # ----------------------------------------
 # Helpers MongoDB
@@ -96,25 +208,69 @@ def salvar_frame_sem_faces(frame_uuid: str, tag_video: str, duracao: float = Non
     print(f"🗃️ Frame sem faces salvo no MongoDB: {novo_frame}")
 
 # ----------------------------------------
-# Filtro de tamanhos e landmarks
+# Roteamento por tag_video
 # ----------------------------------------
-#def filtros(index: int, facial_area: dict) -> bool:
-#    w, h = facial_area.get("w", 0), facial_area.get("h", 0)
-#    if w < MIN_FACE_WIDTH or h < MIN_FACE_HEIGHT:
-#        print(f"⚠️ Face {index} ignorada por ser muito pequena (w={w}, h={h})")
-#        return True
-#    if not (facial_area.get("left_eye") and facial_area.get("right_eye")):
-#        print(f"⚠️ Face {index} ignorada por falta dos landmarks dos dois olhos.")
-#        return True
-#    return False
+def shard_da_tag(tag_video: str, num_shards: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach): ao passar de N para N+1 shards,
+    só ~1/(N+1) das tag_videos mudam de fila.
+    """
+    chave = int.from_bytes(hashlib.md5(tag_video.encode()).digest()[:8], "big")
+    b, j = -1, 0
+    while j < num_shards:
+        b = j
+        chave = (chave * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((chave >> 33) + 1)))
+    return b
+
+def fila_deteccoes(tag_video: str) -> str:
+    if RECONHECIMENTO_SHARDS <= 0:
+        return 'deteccoes'
+    return f"deteccoes.{shard_da_tag(str(tag_video), RECONHECIMENTO_SHARDS)}"
+
+def fila_baixa_prioridade(fila: str) -> str:
+    """Fila das faces marcadas pelo filtro de qualidade."""
+    return f"{fila}.baixa"
+
+# ----------------------------------------
+# Filtro de qualidade (tamanho, nitidez e pose)
+# ----------------------------------------
+def filtros(img, detections: list, image_name: str) -> list:
+    """
+    Avalia cada face e devolve as que seguem, das melhores para as piores (os
+    uploads são submetidos nessa ordem). No modo 'marcar' as reprovadas seguem
+    com o motivo; no 'descartar' ficam de fora.
+    """
+    aprovadas = []
+    for i, det in enumerate(detections):
+        avaliacao = qualidade.avaliar(img, det["facial_area"], det["score"], LIMITES_QUALIDADE)
+        det["qualidade"] = avaliacao.nota
+        det["avaliacao_qualidade"] = {
+            "nota": round(avaliacao.nota, 4),
+            "lado": int(avaliacao.lado),
+            "nitidez": round(avaliacao.nitidez, 1),
+            "yaw": round(avaliacao.yaw, 1),
+            "motivo": avaliacao.motivo,
+        }
+        if avaliacao.motivo:
+            registrar_rejeicao(avaliacao.motivo)
+            acao = "marcada" if DETECCAO_QUALIDADE == "marcar" else "descartada"
+            print(
+                f"⚠️ Face {i} de {image_name} {acao} por {avaliacao.motivo} "
+                f"(lado={avaliacao.lado}px, nitidez={avaliacao.nitidez:.0f}, yaw={avaliacao.yaw:.0f}°) "
+                f"| rejeições: {dict(rejeicoes)}"
+            )
+            if DETECCAO_QUALIDADE != "marcar":
+                continue
+        aprovadas.append(det)
+    aprovadas.sort(key=lambda d: (d["avaliacao_qualidade"]["motivo"] is not None, -d["qualidade"]))
+    return aprovadas
 
 # ----------------------------------------
 # Processa e envia cada face para o MinIO
 # ----------------------------------------
 def process_face(i: int, detection: dict, img, today: str, save_folder: str, image_name: str):
     facial_area = detection["facial_area"]
-    #if filtros(i, facial_area):
-    #    return None
 
     x, y, w, h = facial_area["x"], facial_area["y"], facial_area["w"], facial_area["h"]
     face_img = img[y:y+h, x:x+w]
@@ -126,11 +282,17 @@ def process_face(i: int, detection: dict, img, today: str, save_folder: str, ima
     face_bytes = encoded.tobytes()
     timestamp  = datetime.now().strftime("%H%M%S%f")
     filename   = f"face_{timestamp}.png"
-    object_path = f"{today}/{filename}".replace("\\", "/")
+    if detection.get("reconhecer", True):
+        bucket      = DETECCOES_BUCKET
+        object_path = f"{today}/{filename}".replace("\\", "/")
+    else:
+        # continuação de rastreio: não passa pelo reconhecimento, já vai para o bucket final
+        bucket      = BUCKET_RECONHECIMENTO
+        object_path = f"rastreios/{detection['track_id']}/{filename}"
 
     try:
         minio_client.put_object(
-            DETECCOES_BUCKET,
+            bucket,
             object_path,
             BytesIO(face_bytes),
             len(face_bytes),
@@ -143,31 +305,28 @@ def process_face(i: int, detection: dict, img, today: str, save_folder: str, ima
         return None
 
 # ----------------------------------------
-# Executa detecção MediaPipe + paraleliza cortes
+# Executa detecção MediaPipe
 # ----------------------------------------
-def process_image(image_bytes: bytes, image_name: str):
-    faces_paths = []
-    arr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if img is None:
-        print(f"❌ Erro ao carregar a imagem: {image_name}")
-        return faces_paths
+def process_image(img, image_name: str):
+    """Detecta as faces do frame já decodificado (BGR). Retorna a lista de detecções."""
+    h, w = img.shape[:2]
+    entrada = img
+    escala = DETECCAO_LADO_MAIOR / max(h, w) if DETECCAO_LADO_MAIOR else 1.0
+    if escala < 1.0:
+        # coordenadas do MediaPipe são relativas: valem igual no frame original
+        entrada = cv2.resize(img, (round(w * escala), round(h * escala)), interpolation=cv2.INTER_AREA)
 
-    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    rgb = cv2.cvtColor(entrada, cv2.COLOR_BGR2RGB)
     start = time.time()
-    results = mp_face_detector.process(rgb)
+    results = obter_detector().process(rgb)
     detection_time = time.time() - start
     print(f"⏱ Tempo de detecção: {detection_time*1000:.2f} ms")
+    registrar_deteccao(len(results.detections or []), detection_time)
 
     if not results.detections:
         print(f"🚫 Sem faces em {image_name}")
-        return faces_paths
-
-    today       = datetime.now().strftime("%d-%m-%Y")
-    save_folder = os.path.join(OUTPUT_FOLDER_DETECTIONS, today)
-    os.makedirs(save_folder, exist_ok=True)
+        return []
 
-    h, w = img.shape[:2]
     detections = []
     for i, det in enumerate(results.detections):
 
@@ -184,39 +343,61 @@ def process_image(image_bytes: bytes, image_name: str):
         bh = min(int(rel_bb.height * h), h - y1)
 
         kp = det.location_data.relative_keypoints
-        re, le = kp[0], kp[1]
+        re, le, ns = kp[0], kp[1], kp[2]
         right_eye = (int(re.x * w), int(re.y * h))
         left_eye  = (int(le.x * w), int(le.y * h))
+        nose      = (int(ns.x * w), int(ns.y * h))
 
         facial_area = {
             "x": x1, "y": y1, "w": bw, "h": bh,
-            "right_eye": right_eye, "left_eye": left_eye
+            "right_eye": right_eye, "left_eye": left_eye, "nose": nose
         }
-        detections.append({"facial_area": facial_area})
-
-    import concurrent.futures
-    with concurrent.futures.ThreadPoolExecutor() as exe:
-        futures = [
-            exe.submit(process_face, i, det, img, today, save_folder, image_name)
-            for i, det in enumerate(detections)
-        ]
-        for fut in concurrent.futures.as_completed(futures):
-            path = fut.result()
-            if path:
-                faces_paths.append(path)
+        detections.append({"facial_area": facial_area, "score": float(score)})
 
-    return faces_paths
+    return detections
 
 # ----------------------------------------
-# Callback RabbitMQ — sempre ack no finally
+# Uploads em segundo plano
 # ----------------------------------------
-def callback(ch, method, properties, body):
+class FrameEmUpload:
+    """
+    Faces de um frame enviadas ao pool de upload. A thread que termina o último
+    upload agenda, na thread da conexão, a publicação das faces e o ack do frame
+    (o pika não é thread-safe: tudo que usa o canal passa por add_callback_threadsafe).
+    """
+
+    def __init__(self, msg: dict, delivery_tag: int, detections: list):
+        self.msg          = msg
+        self.delivery_tag = delivery_tag
+        self.detections   = detections
+        self.paths        = [None] * len(detections)
+        self.pendentes    = len(detections)
+        self.trava        = threading.Lock()
+
+    def concluir(self, i: int, path) -> bool:
+        """Registra o upload da face i; True para quem concluiu o último."""
+        with self.trava:
+            self.paths[i] = path
+            self.pendentes -= 1
+            return self.pendentes == 0
+
+def enviar_face(frame: FrameEmUpload, i: int, det: dict, img, today: str, image_name: str):
+    """Executado no upload_pool: recorta, envia ao MinIO e, se for a última face, agenda a publicação."""
+    path = None
     try:
-        msg = json.loads(body.decode())
-        resp = minio_client.get_object(FRAME_BUCKET, msg["minio_path"])
-        img_bytes = resp.read()
+        path = process_face(i, det, img, today, None, image_name)
+    except Exception as e:
+        print(f"❌ Erro no upload da face {i} de {image_name}: {e}")
+    finally:
+        vagas_upload.release()
+        if frame.concluir(i, path):
+            conn.add_callback_threadsafe(partial(publicar_frame, frame))
 
-        detected = process_image(img_bytes, os.path.basename(msg["minio_path"]))
+def publicar_frame(frame: FrameEmUpload):
+    """Na thread da conexão: publica as faces enviadas do frame e confirma a mensagem."""
+    msg = frame.msg
+    try:
+        detected = [(p, det) for p, det in zip(frame.paths, frame.detections) if p]
         if not detected:
             salvar_frame_sem_faces(
                 msg["frame_uuid"],
@@ -225,51 +406,285 @@ def callback(ch, method, properties, body):
                 msg.get("fps")
             )
         else:
-            tempo_deteccao = datetime.now().timestamp() - float(msg["inicio_processamento"])
-            for face_path in detected:
-                out_msg = {
-                    "data_captura_frame":      msg["data_captura_frame"],
-                    "minio_path":              face_path,
-                    "inicio_processamento":    msg["inicio_processamento"],
-                    "tempo_captura_frame":     msg["tempo_captura_frame"],
-                    "tempo_deteccao":          tempo_deteccao,
-                    "tag_video":               msg["tag_video"],
-                    "timestamp":               msg["timestamp"],
-                    "frame_uuid":              msg["frame_uuid"],
-                    "frame_total_faces":       len(detected),
-                    "fps":                     msg.get("fps"),
-                    "duracao":                 msg.get("duracao"),
-                    "tempo_espera_captura_deteccao":
-                        datetime.now().timestamp() - float(msg.get("fim_captura", msg["inicio_processamento"])),
-                    "inicio_deteccao": datetime.now().timestamp(),
-                    "fim_deteccao":    datetime.now().timestamp(),
-                }
-                channel.basic_publish(
-                    exchange='',
-                    routing_key='deteccoes',
-                    body=json.dumps(out_msg),
-                    properties=pika.BasicProperties(delivery_mode=2)
-                )
-                print(f"✅ Enviada detecção: {out_msg}")
-
+            publicar_deteccoes(msg, detected)
     except Exception as e:
-        print(f"❌ Erro no callback: {e}")
+        print(f"❌ Erro ao publicar o frame {msg.get('frame_uuid')}: {e}")
+    finally:
+        acks.confirmar(frame.delivery_tag)
+
+def publicar_deteccoes(msg: dict, detected: list):
+    """Publica cada face: para o reconhecimento ou, se é continuação de rastreio, direto para o banco."""
+    tempo_deteccao = datetime.now().timestamp() - float(msg["inicio_processamento"])
+    fila = fila_deteccoes(msg["tag_video"])
+    for face_path, det in detected:
+        out_msg = {
+            "data_captura_frame":      msg["data_captura_frame"],
+            "minio_path":              face_path,
+            "inicio_processamento":    msg["inicio_processamento"],
+            "tempo_captura_frame":     msg["tempo_captura_frame"],
+            "tempo_deteccao":          tempo_deteccao,
+            "tag_video":               msg["tag_video"],
+            "timestamp":               msg["timestamp"],
+            "frame_uuid":              msg["frame_uuid"],
+            "frame_total_faces":       len(detected),
+            "fps":                     msg.get("fps"),
+            "duracao":                 msg.get("duracao"),
+            "tempo_espera_captura_deteccao":
+                datetime.now().timestamp() - float(msg.get("fim_captura", msg["inicio_processamento"])),
+            "inicio_deteccao": datetime.now().timestamp(),
+            "fim_deteccao":    datetime.now().timestamp(),
+        }
+        if "avaliacao_qualidade" in det:
+            out_msg["qualidade"] = det["avaliacao_qualidade"]
+        destino = fila
+        if "track_id" in det:
+            out_msg["track_id"] = det["track_id"]
+            if not det["reconhecer"]:
+                # o banco atribui a presença à última identidade reconhecida do rastreio
+                destino = QUEUE_NAME_BD
+                out_msg.update({
+                    "continuacao_rastreio": True,
+                    "reconhecimento_path":  face_path,
+                    "uuid":                 None,
+                    "tags":                 [],
+                    "tempo_reconhecimento": 0.0,
+                    "tempo_espera_deteccao_reconhecimento": 0.0,
+                    "similarity_value":     None,
+                })
+        if destino == fila and det.get("avaliacao_qualidade", {}).get("motivo"):
+            destino = fila_baixa_prioridade(fila)
+        channel.basic_publish(
+            exchange='',
+            routing_key=destino,
+            body=json.dumps(out_msg),
+            properties=pika.BasicProperties(delivery_mode=2)
+        )
+        print(f"✅ Enviada detecção para '{destino}': {out_msg}")
+
+def obter_rastreador(tag_video: str) -> Rastreador:
+    agora = time.monotonic()
+    while rastreadores:
+        tag_antiga, (_, usado_em) = next(iter(rastreadores.items()))
+        if agora - usado_em <= RASTREIO_OCIOSO:
+            break
+        del rastreadores[tag_antiga]
+        print(f"🧹 Rastreador de {tag_antiga} descartado após {RASTREIO_OCIOSO:.0f}s sem frames")
+
+    rastreador, _ = rastreadores.pop(tag_video, (None, None))
+    if rastreador is None:
+        rastreador = Rastreador(RASTREIO_IOU, RASTREIO_K, RASTREIO_MELHORA, RASTREIO_INTERVALO_MAXIMO)
+    rastreadores[tag_video] = (rastreador, agora)
+    return rastreador
+
+def rastrear(msg: dict, detections: list, img):
+    """Marca cada detecção com o id do rastreio e se ela deve ser reconhecida."""
+    rastreador = obter_rastreador(msg["tag_video"])
+    caixas, qualidades = [], []
+    for det in detections:
+        fa = det["facial_area"]
+        caixas.append((fa["x"], fa["y"], fa["x"] + fa["w"], fa["y"] + fa["h"]))
+        # a nota de qualidade.py é a única métrica do rastreador, com ou sem o filtro ligado
+        if "qualidade" not in det:
+            det["qualidade"] = qualidade.avaliar(img, fa, det["score"], LIMITES_QUALIDADE).nota
+        qualidades.append(det["qualidade"])
+    # faces marcadas pelo filtro vão para a fila de baixa prioridade: não abrem
+    # rastreio, senão as continuações chegariam ao banco antes da identidade
+    abre = [not det.get("avaliacao_qualidade", {}).get("motivo") for det in detections]
+    decisoes = rastreador.atualizar(caixas, qualidades, float(msg["timestamp"]), abre)
+    for det, (track_id, reconhecer) in zip(detections, decisoes):
+        det["reconhecer"] = reconhecer
+        if track_id is not None:
+            det["track_id"] = track_id
+    enviadas = sum(1 for _, reconhecer in decisoes if reconhecer)
+    print(f"🧭 Rastreio: {enviadas}/{len(decisoes)} faces para o reconhecimento")
+
+# ----------------------------------------
+# Acks em ordem de entrega
+# ----------------------------------------
+class AcksEmOrdem:
+    """
+    Frames terminam fora de ordem (uploads em paralelo), mas são confirmados na
+    ordem de entrega: um ack (multiple=True) cobre o maior prefixo já concluído.
+    Usado só na thread da conexão.
+    """
+
+    def __init__(self):
+        self.entregues  = deque()
+        self.concluidos = set()
+
+    def registrar(self, delivery_tag: int):
+        self.entregues.append(delivery_tag)
+
+    def confirmar(self, delivery_tag: int):
+        self.concluidos.add(delivery_tag)
+        ultimo = None
+        while self.entregues and self.entregues[0] in self.concluidos:
+            ultimo = self.entregues.popleft()
+            self.concluidos.discard(ultimo)
+        if ultimo is not None:
+            channel.basic_ack(delivery_tag=ultimo, multiple=True)
+
+acks = AcksEmOrdem()
+
+def concluir_frame(delivery_tag: int):
+    """De qualquer thread: marca o frame como concluído (o ack roda na thread da conexão)."""
+    conn.add_callback_threadsafe(partial(acks.confirmar, delivery_tag))
+
+# ----------------------------------------
+# Estágio 1 — download e decodificação (download_pool)
+# ----------------------------------------
+def baixar_frame(body: bytes):
+    """Baixa o frame do MinIO e decodifica. Retorna (mensagem, imagem BGR ou None)."""
+    msg = json.loads(body.decode())
+    resp = minio_client.get_object(FRAME_BUCKET, msg["minio_path"])
+    try:
+        img_bytes = resp.read()
     finally:
-        # ack único e garantido
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        resp.close()
+        resp.release_conn()
+    img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        print(f"❌ Erro ao carregar a imagem: {msg['minio_path']}")
+    return msg, img
+
+# ----------------------------------------
+# Estágio 2 — detecção (uma thread: o MediaPipe não é thread-safe)
+# ----------------------------------------
+def detectar_frames():
+    while True:
+        delivery_tag, download = fila_frames.get()
+        adiado = False
+        try:
+            msg, img = download.result()
+            image_name = os.path.basename(msg["minio_path"])
+            detections = process_image(img, image_name) if img is not None else []
+            if detections and DETECCAO_QUALIDADE != "desligado":
+                detections = filtros(img, detections, image_name)
+            if not detections:
+                salvar_frame_sem_faces(
+                    msg["frame_uuid"],
+                    msg["tag_video"],
+                    msg.get("duracao"),
+                    msg.get("fps")
+                )
+                continue
+
+            # estágio 3: uploads e publicação seguem no pool enquanto o próximo frame é detectado
+            today = datetime.now().strftime("%d-%m-%Y")
+            if DETECCAO_RASTREIO:
+                rastrear(msg, detections, img)
+            frame = FrameEmUpload(msg, delivery_tag, detections)
+            for i, det in enumerate(detections):
+                vagas_upload.acquire()
+                upload_pool.submit(enviar_face, frame, i, det, img, today, image_name)
+            adiado = True
+
+        except Exception as e:
+            print(f"❌ Erro ao processar frame: {e}")
+        finally:
+            if not adiado:
+                concluir_frame(delivery_tag)
+
+# ----------------------------------------
+# Callback RabbitMQ — só agenda o download (o ack vem pelo AcksEmOrdem)
+# ----------------------------------------
+def callback(ch, method, properties, body):
+    acks.registrar(method.delivery_tag)
+    fila_frames.put((method.delivery_tag, download_pool.submit(baixar_frame, body)))
 
 # ----------------------------------------
 # Inicialização do consumer
 # ----------------------------------------
-def main():
-    global channel
+def consumir():
+    global channel, conn
+    conectar()
     conn = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
     channel = conn.channel()
     channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
     channel.queue_declare(queue='deteccoes', durable=True)
+    if DETECCAO_RASTREIO:
+        channel.queue_declare(queue=QUEUE_NAME_BD, durable=True)
+    for shard in range(RECONHECIMENTO_SHARDS):
+        channel.queue_declare(queue=f"deteccoes.{shard}", durable=True, arguments=ARGS_FILA_SHARD)
+    if DETECCAO_QUALIDADE == "marcar":
+        filas = [f"deteccoes.{shard}" for shard in range(RECONHECIMENTO_SHARDS)] or ['deteccoes']
+        for fila in filas:
+            channel.queue_declare(queue=fila_baixa_prioridade(fila), durable=True)
+    channel.basic_qos(prefetch_count=DETECCAO_PREFETCH)
+    threading.Thread(target=detectar_frames, name="detector", daemon=True).start()
     channel.basic_consume(queue=RABBITMQ_QUEUE, on_message_callback=callback)
-    print("📡 Aguardando mensagens...")
+    print(f"📡 Aguardando mensagens (prefetch {DETECCAO_PREFETCH}, {DETECCAO_DOWNLOAD_WORKERS} downloads)...")
     channel.start_consuming()
 
+# ----------------------------------------
+# Modo multiprocesso — supervisor
+# ----------------------------------------
+def executar_processo(indice: int, contadores_compartilhados):
+    """Alvo de cada processo filho: consumidor completo com seu próprio detector."""
+    global contadores, indice_processo
+    contadores, indice_processo = contadores_compartilhados, indice
+    obter_detector()
+    print(f"🔹 Processo de detecção {indice} (pid {os.getpid()}) pronto")
+    consumir()
+
+def supervisionar():
+    """
+    Sobe DETECCAO_PROCESSOS consumidores, reinicia os que morrerem e relata a
+    vazão somada a cada ESTATISTICAS_INTERVALO segundos. Os filhos são criados
+    com 'spawn': cada um abre as próprias conexões (MongoClient não sobrevive a fork).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    compartilhados = ctx.Array('d', DETECCAO_PROCESSOS * CAMPOS_POR_PROCESSO, lock=False)
+    processos = [None] * DETECCAO_PROCESSOS
+
+    def iniciar(indice: int):
+        processo = ctx.Process(
+            target=executar_processo, args=(indice, compartilhados), name=f"deteccao-{indice}"
+        )
+        processo.start()
+        processos[indice] = processo
+
+    for indice in range(DETECCAO_PROCESSOS):
+        iniciar(indice)
+    print(f"🚀 {DETECCAO_PROCESSOS} processos de detecção iniciados")
+
+    anterior, instante = list(compartilhados), time.monotonic()
+    try:
+        while True:
+            time.sleep(ESTATISTICAS_INTERVALO)
+            for indice, processo in enumerate(processos):
+                if not processo.is_alive():
+                    print(f"⚠️ Processo de detecção {indice} (pid {processo.pid}) saiu com código {processo.exitcode}; reiniciando")
+                    iniciar(indice)
+
+            atual, agora = list(compartilhados), time.monotonic()
+            decorrido = agora - instante
+            delta = [a - b for a, b in zip(atual, anterior)]
+            n = CAMPOS_POR_PROCESSO
+            total_frames, total_faces = sum(delta[0::n]), sum(delta[1::n])
+            media_ms = 1000 * sum(delta[2::n]) / total_frames if total_frames else 0.0
+            por_processo = " ".join(f"{delta[i * n] / decorrido:.1f}" for i in range(DETECCAO_PROCESSOS))
+            rejeitadas = " ".join(
+                f"{motivo}={int(sum(atual[3 + k::n]))}" for k, motivo in enumerate(qualidade.MOTIVOS_REJEICAO)
+            )
+            print(
+                f"📊 Detecção: {total_frames / decorrido:.1f} frames/s, {total_faces / decorrido:.1f} faces/s, "
+                f"{media_ms:.1f} ms/frame | frames/s por processo: {por_processo} | "
+                f"total {int(sum(atual[0::n]))} frames | rejeições de qualidade: {rejeitadas}"
+            )
+            anterior, instante = atual, agora
+    except KeyboardInterrupt:
+        print("⏹ Encerrando processos de detecção...")
+        for processo in processos:
+            processo.terminate()
+        for processo in processos:
+            processo.join()
+
+def main():
+    if DETECCAO_PROCESSOS > 1:
+        supervisionar()
+    else:
+        consumir()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,73 @@
+"""
+Nota de qualidade de cada face detectada, antes do upload e do reconhecimento.
+
+Faces minúsculas, borradas ou de perfil geram embeddings que não casam de forma
+confiável e só consomem capacidade do reconhecimento (e criam pessoas
+duplicadas). Cada recorte é avaliado em três critérios:
+  - tamanho: menor lado da caixa, em pixels do frame original
+  - nitidez: variância do Laplaciano do recorte em tons de cinza, reduzido para
+    LADO_NITIDEZ px (comparável entre faces de tamanhos diferentes)
+  - pose: yaw estimado pelos keypoints do MediaPipe — deslocamento horizontal do
+    nariz em relação ao ponto médio dos olhos, dividido pela meia distância entre
+    eles (asin do resultado, em graus)
+
+`avaliar` devolve a nota (0 a 1, usada para ordenar e pelo rastreador) e o
+primeiro motivo de rejeição, ou None se a face passou.
+"""
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+MOTIVOS_REJEICAO = ("tamanho", "nitidez", "pose")
+LADO_NITIDEZ = 64
+
+LimitesQualidade = namedtuple("LimitesQualidade", "lado_minimo nitidez_minima yaw_maximo")
+Avaliacao = namedtuple("Avaliacao", "nota motivo lado nitidez yaw")
+
+
+def nitidez(recorte: np.ndarray) -> float:
+    """Variância do Laplaciano do recorte BGR reduzido para LADO_NITIDEZ px."""
+    cinza = cv2.cvtColor(recorte, cv2.COLOR_BGR2GRAY)
+    escala = LADO_NITIDEZ / max(cinza.shape)
+    if escala < 1.0:
+        cinza = cv2.resize(
+            cinza, (max(1, round(cinza.shape[1] * escala)), max(1, round(cinza.shape[0] * escala))),
+            interpolation=cv2.INTER_AREA
+        )
+    return float(cv2.Laplacian(cinza, cv2.CV_64F).var())
+
+
+def yaw(olho_direito, olho_esquerdo, nariz) -> float:
+    """Yaw aproximado (graus, em módulo) a partir dos keypoints em pixels."""
+    meia_distancia = abs(olho_esquerdo[0] - olho_direito[0]) / 2
+    if meia_distancia < 1:
+        return 90.0  # olhos sobrepostos: perfil
+    meio = (olho_esquerdo[0] + olho_direito[0]) / 2
+    desvio = max(-1.0, min(1.0, (nariz[0] - meio) / meia_distancia))
+    return abs(math.degrees(math.asin(desvio)))
+
+
+def avaliar(img: np.ndarray, facial_area: dict, score: float, limites: LimitesQualidade) -> Avaliacao:
+    x, y, w, h = facial_area["x"], facial_area["y"], facial_area["w"], facial_area["h"]
+    lado = min(w, h)
+    recorte = img[y:y+h, x:x+w]
+    valor_nitidez = nitidez(recorte) if recorte.size else 0.0
+    valor_yaw = yaw(facial_area["right_eye"], facial_area["left_eye"], facial_area["nose"])
+
+    motivo = None
+    if lado < limites.lado_minimo:
+        motivo = "tamanho"
+    elif valor_nitidez < limites.nitidez_minima:
+        motivo = "nitidez"
+    elif valor_yaw > limites.yaw_maximo:
+        motivo = "pose"
+
+    # cada termo satura em 1 com o dobro do mínimo; a pose pesa pelo cosseno do yaw
+    nota = (
+        min(1.0, lado / (2 * limites.lado_minimo)) if limites.lado_minimo else 1.0
+    ) * (
+        min(1.0, valor_nitidez / (2 * limites.nitidez_minima)) if limites.nitidez_minima else 1.0
+    ) * math.cos(math.radians(min(valor_yaw, 90.0))) * score
+    return Avaliacao(nota, motivo, lado, valor_nitidez, valor_yaw)
@@ -0,0 +1,102 @@
+"""
+Rastreamento de faces entre frames consecutivos de uma tag_video.
+
+Numa cena parada a mesma pessoa aparece em centenas de frames seguidos e cada
+recorte passava pelo reconhecimento completo. O rastreador associa as faces de
+um frame às do frame anterior pela sobreposição das caixas (IoU, casamento
+guloso do maior IoU para o menor) e decide, por face, se ela precisa ser
+reconhecida:
+  - início de rastreio (face sem par no frame anterior)
+  - a cada `intervalo` frames do mesmo rastreio (corrige trocas de identidade)
+  - quando a nota de qualidade (qualidade.py) supera a melhor já enviada em
+    mais de `melhora`
+Nos demais frames a face vira uma "continuação" do rastreio, atribuída pelo
+banco de dados à última identidade reconhecida para ele.
+
+Rastreios sem face associada por mais de `intervalo_maximo` segundos (pelo
+timestamp dos frames) são encerrados; a pessoa que reaparece depois abre outro.
+
+Faces que não podem abrir rastreio (`abre`, ex.: reprovadas pelo filtro de
+qualidade, que vão para a fila de baixa prioridade e seriam reconhecidas bem
+depois das continuações) ainda continuam um rastreio existente, mas sem par
+são reconhecidas avulsas, sem rastreio.
+"""
+import uuid
+
+import numpy as np
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Matriz (len(a), len(b)) de IoU entre caixas (x1, y1, x2, y2)."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class Rastreio:
+    def __init__(self, caixa, timestamp: float):
+        self.id = str(uuid.uuid4())
+        self.caixa = caixa
+        self.visto_em = timestamp
+        self.frames = 0
+        self.desde_envio = 0
+        self.melhor_qualidade = 0.0
+
+
+class Rastreador:
+    """Rastreios ativos de uma tag_video."""
+
+    def __init__(self, iou_minimo: float, intervalo: int, melhora: float, intervalo_maximo: float):
+        self.iou_minimo = iou_minimo
+        self.intervalo = intervalo
+        self.melhora = melhora
+        self.intervalo_maximo = intervalo_maximo
+        self.rastreios = []
+
+    def atualizar(self, caixas, qualidades, timestamp: float, abre=None) -> list:
+        """
+        Associa as caixas (x1, y1, x2, y2) do frame aos rastreios ativos.
+        Retorna, por caixa, (id do rastreio, True se a face deve ser reconhecida);
+        o id é None para uma caixa sem par que não pode abrir rastreio (`abre`,
+        por caixa; None = todas podem).
+        """
+        self.rastreios = [r for r in self.rastreios if abs(timestamp - r.visto_em) <= self.intervalo_maximo]
+        caixas = np.asarray(caixas, dtype=np.float64).reshape(-1, 4)
+
+        par = [None] * len(caixas)
+        if len(caixas) and self.rastreios:
+            m = iou(caixas, np.array([r.caixa for r in self.rastreios]))
+            while m.size and m.max() >= self.iou_minimo:
+                i, j = np.unravel_index(np.argmax(m), m.shape)
+                par[i] = self.rastreios[j]
+                m[i, :] = -1
+                m[:, j] = -1
+
+        decisoes = []
+        for n, (caixa, qualidade, rastreio) in enumerate(zip(caixas, qualidades, par)):
+            if rastreio is None and abre is not None and not abre[n]:
+                decisoes.append((None, True))
+                continue
+            if rastreio is None:
+                rastreio = Rastreio(caixa, timestamp)
+                self.rastreios.append(rastreio)
+                reconhecer = True
+            else:
+                rastreio.desde_envio += 1
+                reconhecer = (
+                    rastreio.desde_envio >= self.intervalo
+                    or qualidade > rastreio.melhor_qualidade * (1 + self.melhora)
+                )
+            rastreio.caixa = caixa
+            rastreio.visto_em = timestamp
+            rastreio.frames += 1
+            if reconhecer:
+                rastreio.desde_envio = 0
+                rastreio.melhor_qualidade = max(rastreio.melhor_qualidade, float(qualidade))
+            decisoes.append((rastreio.id, reconhecer))
+        return decisoes
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# os módulos do worker se importam como irmãos (from galeria import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+import qualidade  # noqa: E402
+
+LIMITES = qualidade.LimitesQualidade(lado_minimo=40, nitidez_minima=40.0, yaw_maximo=45.0)
+
+
+def face(x=0, y=0, lado=100, desvio_nariz=0.0):
+    """facial_area no formato do detector, olhos a 1/3 e 2/3 da largura."""
+    olho_direito = (x + lado / 3, y + lado / 3)
+    olho_esquerdo = (x + 2 * lado / 3, y + lado / 3)
+    nariz = (x + lado / 2 + desvio_nariz * lado / 6, y + lado / 2)
+    return {"x": x, "y": y, "w": lado, "h": lado,
+            "right_eye": olho_direito, "left_eye": olho_esquerdo, "nose": nariz}
+
+
+def xadrez(lado=200, casa=4):
+    i, j = np.indices((lado, lado))
+    cinza = (((i // casa) + (j // casa)) % 2 * 255).astype(np.uint8)
+    return np.repeat(cinza[:, :, None], 3, axis=2)
+
+
+def test_yaw():
+    assert qualidade.yaw((0, 0), (20, 0), (10, 5)) == pytest.approx(0.0)
+    assert qualidade.yaw((0, 0), (20, 0), (15, 5)) == pytest.approx(30.0)
+    assert qualidade.yaw((0, 0), (20, 0), (40, 5)) == pytest.approx(90.0)
+    assert qualidade.yaw((10, 0), (10, 0), (10, 5)) == 90.0
+
+
+def test_nitidez_independente_do_tamanho_do_recorte():
+    pequeno = qualidade.nitidez(xadrez(64, casa=4))
+    grande = qualidade.nitidez(xadrez(256, casa=16))
+    assert grande == pytest.approx(pequeno, rel=0.2)
+    assert qualidade.nitidez(np.full((100, 100, 3), 128, dtype=np.uint8)) == 0.0
+
+
+def test_face_boa_passa_com_nota_alta():
+    avaliacao = qualidade.avaliar(xadrez(), face(), 0.9, LIMITES)
+    assert avaliacao.motivo is None
+    assert 0.8 < avaliacao.nota <= 0.9
+    assert avaliacao.lado == 100
+
+
+@pytest.mark.parametrize("imagem, area, motivo", [
+    (xadrez(), face(lado=20), "tamanho"),
+    (np.full((200, 200, 3), 128, dtype=np.uint8), face(), "nitidez"),
+    (xadrez(), face(desvio_nariz=0.9), "pose"),
+])
+def test_motivos_de_rejeicao(imagem, area, motivo):
+    avaliacao = qualidade.avaliar(imagem, area, 0.9, LIMITES)
+    assert avaliacao.motivo == motivo
+    assert 0.0 <= avaliacao.nota < qualidade.avaliar(xadrez(), face(), 0.9, LIMITES).nota
+
+
+def test_recorte_fora_do_frame():
+    avaliacao = qualidade.avaliar(xadrez(), face(x=500, y=500), 0.9, LIMITES)
+    assert avaliacao.nitidez == 0.0 and avaliacao.motivo == "nitidez"
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from rastreador import Rastreador, iou
+
+
+def rastreador(**parametros):
+    padrao = {"iou_minimo": 0.3, "intervalo": 5, "melhora": 0.2, "intervalo_maximo": 2.0}
+    return Rastreador(**{**padrao, **parametros})
+
+
+def test_iou():
+    a = np.array([[0, 0, 10, 10]], dtype=np.float64)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=np.float64)
+    np.testing.assert_allclose(iou(a, b), [[1.0, 50 / 150, 0.0]])
+
+
+def test_continuacao_e_nova_face():
+    r = rastreador()
+    [(id_a, reconhecer)] = r.atualizar([[0, 0, 10, 10]], [0.5], 0.0)
+    assert reconhecer
+
+    decisoes = r.atualizar([[1, 0, 11, 10], [50, 50, 60, 60]], [0.5, 0.5], 0.1)
+    assert decisoes[0] == (id_a, False)
+    assert decisoes[1][0] != id_a and decisoes[1][1]
+
+
+def test_casamento_guloso_pelo_maior_iou():
+    r = rastreador(iou_minimo=0.1)
+    (id_a, _), (id_b, _) = r.atualizar([[0, 0, 10, 10], [8, 0, 18, 10]], [0.5, 0.5], 0.0)
+    # as duas caixas cruzam os dois rastreios; cada uma fica com o de maior sobreposição
+    decisoes = r.atualizar([[7, 0, 17, 10], [1, 0, 11, 10]], [0.5, 0.5], 0.1)
+    assert [d[0] for d in decisoes] == [id_b, id_a]
+
+
+def test_reenvio_por_intervalo_e_por_qualidade():
+    r = rastreador(intervalo=3, melhora=0.2)
+    caixa = [[0, 0, 10, 10]]
+    assert r.atualizar(caixa, [0.5], 0.0)[0][1]
+    assert [r.atualizar(caixa, [0.5], 0.1 * i)[0][1] for i in range(1, 4)] == [False, False, True]
+    # 0.59 não supera 0.5 em mais de 20%; 0.61 supera
+    assert not r.atualizar(caixa, [0.59], 0.5)[0][1]
+    assert r.atualizar(caixa, [0.61], 0.6)[0][1]
+    assert r.rastreios[0].melhor_qualidade == pytest.approx(0.61)
+
+
+def test_rastreio_expira_sem_face():
+    r = rastreador(intervalo_maximo=2.0)
+    [(id_a, _)] = r.atualizar([[0, 0, 10, 10]], [0.5], 0.0)
+    assert r.atualizar([], [], 1.0) == []
+    [(id_b, reconhecer)] = r.atualizar([[0, 0, 10, 10]], [0.5], 3.5)
+    assert id_b != id_a and reconhecer
+    assert len(r.rastreios) == 1
+
+
+def test_face_que_nao_abre_rastreio():
+    r = rastreador()
+    # reprovada sem par: reconhecida avulsa, sem rastreio, e não vira par no frame seguinte
+    assert r.atualizar([[0, 0, 10, 10]], [0.1], 0.0, abre=[False]) == [(None, True)]
+    assert r.rastreios == []
+    [(id_a, reconhecer)] = r.atualizar([[0, 0, 10, 10]], [0.5], 0.1, abre=[True])
+    assert id_a is not None and reconhecer
+
+    # reprovada com par continua o rastreio aberto por uma face boa
+    [(id_b, reconhecer)] = r.atualizar([[1, 0, 11, 10]], [0.1], 0.2, abre=[False])
+    assert id_b == id_a and not reconhecer
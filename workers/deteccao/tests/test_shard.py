@@ -0,0 +1,34 @@
+import pytest
+
+for dependencia in ("cv2", "pika", "mediapipe"):
+    pytest.importorskip(dependencia)
+
+from deteccao import shard_da_tag  # noqa: E402
+
+TAGS = [f"camera-{i:04d}" for i in range(4000)]
+
+
+def test_shard_deterministico_e_no_intervalo():
+    for n in (1, 2, 7, 32):
+        shards = [shard_da_tag(tag, n) for tag in TAGS]
+        assert shards == [shard_da_tag(tag, n) for tag in TAGS]
+        assert min(shards) >= 0 and max(shards) < n
+    assert {shard_da_tag(tag, 1) for tag in TAGS} == {0}
+
+
+@pytest.mark.parametrize("n", [1, 3, 8, 16])
+def test_mais_um_shard_so_move_tags_para_o_novo(n):
+    antes = [shard_da_tag(tag, n) for tag in TAGS]
+    depois = [shard_da_tag(tag, n + 1) for tag in TAGS]
+    movidas = [d for a, d in zip(antes, depois) if a != d]
+    # quem muda de fila vai para o shard novo, e só ~1/(n+1) das tags muda
+    assert set(movidas) <= {n}
+    assert len(movidas) / len(TAGS) == pytest.approx(1 / (n + 1), abs=0.03)
+
+
+def test_distribuicao_equilibrada():
+    n = 8
+    contagem = [0] * n
+    for tag in TAGS:
+        contagem[shard_da_tag(tag, n)] += 1
+    assert max(contagem) < 1.25 * len(TAGS) / n
@@ -1,5 +1,9 @@
 import subprocess
 import os
+from dotenv import load_dotenv
+
+# as configurações ficam no .env, como nos próprios workers
+load_dotenv()
 
 # Caminhos para os diretórios dos workers
 WORKERS = {
@@ -9,6 +13,10 @@ WORKERS = {
     "banco_de_dados": "banco_de_dados/banco_de_dados.py"
 }
 
+# Serviço local de embeddings (opcional): sobe antes dos workers que o usam
+if os.getenv("EMBEDDING_SERVICE_URL"):
+    WORKERS = {"servico_embeddings": "reconhecimento/servico_embeddings.py", **WORKERS}
+
 # Lista para armazenar os processos em execução
 processes = []
 
@@ -0,0 +1,242 @@
+"""
+Armazém de embeddings em disco, mapeado em memória, por tag_video e modelo.
+
+Um worker reiniciado precisava remontar cada galeria a partir dos documentos
+do MongoDB. Aqui cada galeria também existe em disco, em arquivos só de anexar:
+
+    <base>.f32      linhas float32 normalizadas, (N, D)
+    <base>.donos    int32 (N,): índice da pessoa dona de cada linha
+    <base>.tempos   float64 (N,): criado_em de cada linha (janela de sincronização)
+    <base>.ids      12 bytes (N,): _id do documento em `embeddings`
+    <base>.pessoas  um uuid por linha de texto, na ordem da primeira aparição
+    <base>.json     dim, linhas, pessoas e geração que os arquivos refletem
+
+Os processos abrem os arquivos com np.memmap (sem cópia, páginas compartilhadas
+pelo cache do sistema operacional) e só mapeiam as `linhas` registradas no
+.json, então uma anexação em andamento nunca é vista pela metade. Escritas e
+aberturas acontecem sob flock no <base>.lock; a reconstrução troca os arquivos
+por novos (os mapas já abertos continuam no arquivo antigo).
+
+O MongoDB continua sendo a fonte da verdade. Ao carregar, o armazém se
+sincroniza: anexa os documentos gravados desde a última linha (janela de alguns
+segundos pelo _id, ignorando os que já estão no arquivo) e, no máximo a cada
+INTERVALO_CONTAGEM segundos, confere a contagem com o banco. Geração diferente
+(jobs que reescrevem embeddings, como a consolidação) ou contagem divergente
+reconstroem os arquivos a partir do MongoDB.
+
+Só vale para galerias sem compactação: slots reescritos no lugar não mudam a
+contagem e não seriam detectados. Também exige flock e troca de arquivos
+mapeados (POSIX): no Windows o armazém fica indisponível (MMAP_SUPORTADO).
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+
+from galeria import Galeria, normalize_rows
+from repositorio_embeddings import JANELA_SINCRONIZACAO, LinhasEmbeddings, Marco, marco_de
+
+try:
+    import fcntl
+    MMAP_SUPORTADO = True
+except ImportError:  # Windows: sem flock, e arquivos mapeados não podem ser trocados
+    fcntl = None
+    MMAP_SUPORTADO = False
+
+# Segundos entre duas conferências da contagem com o MongoDB (count_documents)
+INTERVALO_CONTAGEM = 60.0
+
+_EXTENSOES = (".f32", ".donos", ".tempos", ".ids", ".pessoas")
+
+
+class ArmazemMmap:
+    """Arquivos de uma tag_video; uma instância por galeria e processo (mantém a trava aberta)."""
+
+    def __init__(self, diretorio: str, tag_video: str):
+        if not MMAP_SUPORTADO:
+            raise RuntimeError("Armazém mapeado em memória indisponível nesta plataforma (requer POSIX)")
+        os.makedirs(diretorio, exist_ok=True)
+        # nome legível + hash curto para que tag_videos parecidas não colidam
+        nome = re.sub(r"[^\w.-]", "_", tag_video)
+        sufixo = hashlib.md5(tag_video.encode()).hexdigest()[:8]
+        self.base = os.path.join(diretorio, f"{nome}_{sufixo}")
+        self._arquivo_trava = None
+        self._contado_em = float("-inf")
+
+    @contextmanager
+    def _trava(self):
+        if self._arquivo_trava is None:
+            self._arquivo_trava = open(f"{self.base}.lock", "a")
+        fcntl.flock(self._arquivo_trava, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._arquivo_trava, fcntl.LOCK_UN)
+
+    def fechar(self):
+        if self._arquivo_trava is not None:
+            self._arquivo_trava.close()
+            self._arquivo_trava = None
+
+    def _meta(self):
+        try:
+            with open(f"{self.base}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _gravar_meta(self, meta: dict):
+        tmp = f"{self.base}.json.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, f"{self.base}.json")
+
+    def _mapa(self, extensao: str, dtype, linhas: int, colunas: int = None):
+        forma = (linhas, colunas) if colunas else (linhas,)
+        if linhas == 0:
+            return np.empty(forma, dtype=dtype)
+        return np.memmap(f"{self.base}{extensao}", dtype=dtype, mode="r", shape=forma)
+
+    def _pessoas(self, meta: dict) -> list:
+        if not meta["pessoas"]:
+            return []
+        with open(f"{self.base}.pessoas") as f:
+            return [next(f).rstrip("\n") for _ in range(meta["pessoas"])]
+
+    def _ids_recentes(self, meta: dict, desde: float) -> set:
+        """
+        _ids (bytes) das linhas do arquivo com _id de `desde` em diante. As linhas
+        estão quase em ordem de _id, então lê de trás para frente e para ao achar
+        um bloco inteiro mais antigo que a janela.
+        """
+        ids = self._mapa(".ids", np.uint8, meta["linhas"], 12)
+        encontrados, fim, passo = set(), len(ids), 1024
+        while fim > 0:
+            inicio = max(0, fim - passo)
+            bloco = ids[inicio:fim]
+            segundos = bloco[:, :4].astype(np.uint32) @ np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.uint32)
+            encontrados.update(bytes(bloco[i]) for i in np.flatnonzero(segundos >= int(desde)))
+            if segundos.max() < desde - JANELA_SINCRONIZACAO:
+                break
+            fim, passo = inicio, passo * 2
+        return encontrados
+
+    def _anexar(self, meta: dict, linhas: LinhasEmbeddings) -> dict:
+        """Anexa as linhas ainda ausentes do arquivo; chamar sob a trava."""
+        if not linhas.ids:
+            return meta
+        pessoas = self._pessoas(meta)
+        posicao = {u: i for i, u in enumerate(pessoas)}
+        novas_pessoas = []
+        donos = np.empty(len(linhas.ids), dtype=np.int32)
+        for n, uuid_str in enumerate(linhas.pessoas):
+            if uuid_str not in posicao:
+                posicao[uuid_str] = len(posicao)
+                novas_pessoas.append(uuid_str)
+            donos[n] = posicao[uuid_str]
+
+        with open(f"{self.base}.f32", "ab") as f:
+            f.write(np.ascontiguousarray(linhas.matrix, dtype=np.float32).tobytes())
+        with open(f"{self.base}.donos", "ab") as f:
+            f.write(donos.tobytes())
+        with open(f"{self.base}.tempos", "ab") as f:
+            f.write(np.asarray(linhas.tempos, dtype=np.float64).tobytes())
+        with open(f"{self.base}.ids", "ab") as f:
+            f.write(b"".join(i.binary for i in linhas.ids))
+        if novas_pessoas:
+            with open(f"{self.base}.pessoas", "a") as f:
+                f.write("".join(f"{u}\n" for u in novas_pessoas))
+
+        ultimo_id = max(linhas.ids)
+        if meta.get("ultimo_id") is not None:
+            ultimo_id = max(ultimo_id, ObjectId(meta["ultimo_id"]))
+        meta = {
+            **meta,
+            "dim": meta["dim"] or int(linhas.matrix.shape[1]),
+            "linhas": meta["linhas"] + len(linhas.ids),
+            "pessoas": len(posicao),
+            "ultimo": ultimo_id.generation_time.timestamp(),
+            "ultimo_id": str(ultimo_id),
+        }
+        self._gravar_meta(meta)
+        return meta
+
+    def _reconstruir(self, repositorio, tag_video: str, geracao: int) -> dict:
+        """Regrava todos os arquivos a partir do MongoDB; chamar sob a trava."""
+        # metadados inválidos primeiro: uma queda no meio força outra reconstrução
+        self._gravar_meta({"dim": None, "linhas": 0, "pessoas": 0, "geracao": None, "ultimo": 0.0})
+        for extensao in _EXTENSOES:
+            # arquivo novo (outro inode): quem já mapeou o antigo continua lendo dele
+            tmp = f"{self.base}{extensao}.{os.getpid()}.tmp"
+            open(tmp, "wb").close()
+            os.replace(tmp, f"{self.base}{extensao}")
+        meta = {"dim": None, "linhas": 0, "pessoas": 0, "geracao": geracao, "ultimo": 0.0}
+        self._gravar_meta(meta)
+        self._contado_em = time.monotonic()  # o arquivo acabou de ser montado com tudo o que há no banco
+        return self._anexar(meta, repositorio.ler_linhas(tag_video))
+
+    def _sincronizar(self, repositorio, tag_video: str, geracao: int) -> dict:
+        meta = self._meta()
+        if meta is None or meta.get("geracao") != geracao or (meta["linhas"] and "ultimo_id" not in meta):
+            # sem arquivo, geração nova ou arquivo de antes do `ultimo_id`
+            return self._reconstruir(repositorio, tag_video, geracao)
+
+        # documentos gravados desde a última linha anexada, menos os que já estão no arquivo
+        inicio_janela = meta.get("ultimo", 0.0) - JANELA_SINCRONIZACAO
+        desde = ObjectId.from_datetime(datetime.fromtimestamp(max(inicio_janela, 0.0), tz=timezone.utc))
+        existentes = self._ids_recentes(meta, inicio_janela)
+        faltantes = [i for i in repositorio.ids_desde(tag_video, desde) if i.binary not in existentes]
+        if faltantes:
+            novas = repositorio.ler_linhas(tag_video, faltantes)
+            if meta["dim"] is not None and novas.ids and novas.matrix.shape[1] != meta["dim"]:
+                return self._reconstruir(repositorio, tag_video, geracao)
+            meta = self._anexar(meta, novas)
+
+        if time.monotonic() - self._contado_em >= INTERVALO_CONTAGEM:
+            self._contado_em = time.monotonic()
+            if meta["linhas"] != repositorio.contar(tag_video):
+                # remoções ou documentos fora da janela
+                return self._reconstruir(repositorio, tag_video, geracao)
+        return meta
+
+    def carregar_galeria(self, repositorio, tag_video: str, geracao: int, classe_galeria=Galeria,
+                         parametros_galeria: dict = None) -> tuple:
+        """
+        Sincroniza com o MongoDB e devolve (galeria sobre os arquivos mapeados,
+        sem copiar a matriz, e o Marco das linhas do arquivo).
+        """
+        with self._trava():
+            meta = self._sincronizar(repositorio, tag_video, geracao)
+            if not meta["linhas"]:
+                return classe_galeria.from_people([], **(parametros_galeria or {})), Marco(0.0, {})
+            matrix = self._mapa(".f32", np.float32, meta["linhas"], meta["dim"])
+            donos = self._mapa(".donos", np.int32, meta["linhas"])
+            tempos = self._mapa(".tempos", np.float64, meta["linhas"])
+            ids = self._mapa(".ids", np.uint8, meta["linhas"], 12)
+            pessoas = self._pessoas(meta)
+        recencia = np.zeros(len(pessoas), dtype=np.float64)
+        np.maximum.at(recencia, donos, tempos)
+        recencia = repositorio.recencia(tag_video, pessoas, recencia)
+        galeria = classe_galeria(pessoas, matrix, donos, recencia, **(parametros_galeria or {}))
+        return galeria, marco_de(tempos, lambda i: ObjectId(bytes(ids[i])))
+
+    def anexar(self, doc_id, uuid_str: str, embedding, criado_em: float):
+        """Anexa um embedding recém-gravado no MongoDB (se o armazém já existe e a dimensão bate)."""
+        linha = normalize_rows(np.asarray(embedding, dtype=np.float32))[None, :]
+        with self._trava():
+            meta = self._meta()
+            if meta is None or meta.get("geracao") is None:
+                return
+            if meta["dim"] is not None and meta["dim"] != linha.shape[1]:
+                return
+            # só um _id que não é mais novo que o fim do arquivo pode já estar nele
+            ja_sincronizado = meta.get("ultimo_id") is None or doc_id <= ObjectId(meta["ultimo_id"])
+            if ja_sincronizado and doc_id.binary in self._ids_recentes(meta, doc_id.generation_time.timestamp()):
+                return  # outro processo já trouxe este documento na sincronização
+            self._anexar(meta, LinhasEmbeddings([doc_id], [uuid_str], linha, np.array([criado_em])))
@@ -0,0 +1,94 @@
+"""
+Benchmark: busca exata x índice IVF sobre uma galeria gravada.
+
+A galeria vem do MongoDB (--tag-video) ou de um arquivo .npz gravado pelo
+cache de galerias (--arquivo). As consultas são embeddings sorteados da
+própria galeria com ruído gaussiano opcional. Para cada nprobe mede:
+  - concordância: fração de consultas em que o IVF decide igual à busca exata
+    (mesma pessoa ou "nenhuma"), que é o recall que importa para o worker
+  - latência média e p95 por consulta
+
+Uso:
+    python benchmark_ann.py --tag-video A09 --nprobe 1 4 8 16 32
+    python benchmark_ann.py --arquivo ./ann/Facenet512/A09_1a2b3c4d.npz --threshold 0.30
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from galeria import Galeria
+from indice_ann import GaleriaIVF
+
+
+def carregar_galeria(args) -> Galeria:
+    if args.arquivo:
+        galeria, _ = Galeria.carregar(args.arquivo)
+        return galeria
+
+    from pymongo import MongoClient
+    from repositorio_embeddings import RepositorioEmbeddings
+    client = MongoClient(os.getenv("MONGO_URI"))
+    repositorio = RepositorioEmbeddings(client[os.getenv("MONGO_DB_NAME")]["embeddings"], os.getenv("MODEL_NAME"))
+    return repositorio.carregar_galeria(args.tag_video)
+
+
+def medir(galeria: Galeria, consultas: np.ndarray, threshold: float):
+    resultados, tempos = [], []
+    for q in consultas:
+        inicio = time.perf_counter()
+        resultados.append(galeria.match(q, threshold)[0])
+        tempos.append(time.perf_counter() - inicio)
+    return resultados, np.array(tempos) * 1000
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Compara busca exata e IVF em uma galeria gravada.")
+    origem = parser.add_mutually_exclusive_group(required=True)
+    origem.add_argument("--tag-video")
+    origem.add_argument("--arquivo", help=".npz gravado pelo cache de galerias")
+    parser.add_argument("--threshold", type=float, help="padrão: limiar de cosseno do MODEL_NAME")
+    parser.add_argument("--consultas", type=int, default=500)
+    parser.add_argument("--ruido", type=float, default=0.0, help="desvio do ruído somado às consultas")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    threshold = args.threshold
+    if threshold is None:
+        from deepface.modules.verification import find_threshold
+        threshold = find_threshold(os.getenv("MODEL_NAME"), "cosine")
+
+    exata = carregar_galeria(args)
+    if not len(exata):
+        print("🚫 Galeria vazia.")
+        return
+    print(f"📦 Galeria: {len(exata)} pessoas, {len(exata.matrix)} embeddings, dim {exata.dim}")
+
+    rng = np.random.default_rng(0)
+    consultas = exata.matrix[rng.choice(len(exata.matrix), size=args.consultas)]
+    if args.ruido:
+        consultas = consultas + rng.normal(scale=args.ruido, size=consultas.shape).astype(np.float32)
+
+    referencia, tempos = medir(exata, consultas, threshold)
+    print(f"🎯 Exata:      média {tempos.mean():.3f} ms | p95 {np.percentile(tempos, 95):.3f} ms")
+
+    inicio = time.perf_counter()
+    # mesma recência da exata: o desempate da votação (e a concordância) depende dela
+    ivf = GaleriaIVF(exata.uuids, exata.matrix, exata.owners, exata.recencia, min_treino=0)
+    print(f"🗂️ Treino IVF: {(time.perf_counter() - inicio):.2f}s ({ivf.n_celulas} células)")
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        resultados, tempos = medir(ivf, consultas, threshold)
+        concordancia = np.mean([a == b for a, b in zip(resultados, referencia)])
+        print(
+            f"⚡ nprobe={nprobe:<4} concordância {concordancia:.3f} | "
+            f"média {tempos.mean():.3f} ms | p95 {np.percentile(tempos, 95):.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Memoização de embeddings pelo conteúdo do recorte.
+
+Recortes repetidos são comuns (vídeos de teste em loop, cenas estáticas,
+mensagens reentregues pelo RabbitMQ). A chave é o hash MD5 dos pixels do
+recorte; cada instância (e seu diretório em disco) é de um único modelo, então
+o par (hash, MODEL_NAME) identifica o embedding. Um acerto devolve o embedding
+sem passar pelo modelo.
+
+Dois níveis:
+  - memória: LRU limitado a `max_itens`, com expiração por `ttl` segundos
+  - disco (opcional): um .npy float32 por chave em `dir_disco/<modelo>/`,
+    compartilhado entre os processos do pool e mantido entre reinícios; entradas
+    expiram pelo mtime e a limpeza remove as mais antigas acima de `max_disco`
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEmbeddings:
+    def __init__(self, modelo: str, max_itens: int = 10000, ttl: float = 3600,
+                 dir_disco: str = None, max_disco: int = 100000, intervalo_relatorio: float = 60):
+        self.modelo = modelo
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.dir_disco = os.path.join(dir_disco, modelo) if dir_disco else None
+        self.max_disco = max_disco
+        self.intervalo_relatorio = intervalo_relatorio
+        self._itens = OrderedDict()  # chave -> (embedding, gravado_em)
+        self._gravacoes_disco = 0
+        self._zerar_contadores()
+        if self.dir_disco:
+            os.makedirs(self.dir_disco, exist_ok=True)
+
+    def _zerar_contadores(self):
+        self.acertos_memoria = 0
+        self.acertos_disco = 0
+        self.faltas = 0
+        self._ultimo_relatorio = time.monotonic()
+
+    def _arquivo(self, chave: str) -> str:
+        return os.path.join(self.dir_disco, f"{chave}.npy")
+
+    def _ler_disco(self, chave: str):
+        caminho = self._arquivo(chave)
+        try:
+            if time.time() - os.path.getmtime(caminho) > self.ttl:
+                os.remove(caminho)
+                return None
+            return np.load(caminho).tolist()
+        except (OSError, ValueError):
+            return None
+
+    def _gravar_disco(self, chave: str, embedding):
+        caminho = self._arquivo(chave)
+        tmp = f"{caminho}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, np.asarray(embedding, dtype=np.float32))
+            os.replace(tmp, caminho)
+        except OSError as e:
+            logger.warning(f"⚠️ Não foi possível gravar embedding em disco: {e}")
+            return
+        self._gravacoes_disco += 1
+        if self._gravacoes_disco % 1000 == 0:
+            self.limpar_disco()
+
+    def limpar_disco(self):
+        """Remove entradas expiradas e, acima de `max_disco`, as mais antigas."""
+        agora = time.time()
+        arquivos = []
+        for entrada in os.scandir(self.dir_disco):
+            if not entrada.name.endswith(".npy"):
+                continue
+            try:
+                mtime = entrada.stat().st_mtime
+                if agora - mtime > self.ttl:
+                    os.remove(entrada.path)
+                else:
+                    arquivos.append((mtime, entrada.path))
+            except OSError:
+                continue
+        arquivos.sort()
+        for _, caminho in arquivos[:max(len(arquivos) - self.max_disco, 0)]:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+    def get(self, chave: str):
+        """Embedding memoizado ou None."""
+        item = self._itens.get(chave)
+        if item is not None:
+            embedding, gravado_em = item
+            if time.monotonic() - gravado_em <= self.ttl:
+                self._itens.move_to_end(chave)
+                self.acertos_memoria += 1
+                return embedding
+            del self._itens[chave]
+
+        if self.dir_disco:
+            embedding = self._ler_disco(chave)
+            if embedding is not None:
+                self._guardar_memoria(chave, embedding)
+                self.acertos_disco += 1
+                return embedding
+
+        self.faltas += 1
+        return None
+
+    def _guardar_memoria(self, chave: str, embedding):
+        self._itens[chave] = (embedding, time.monotonic())
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+
+    def put(self, chave: str, embedding):
+        if embedding is None:
+            return
+        self._guardar_memoria(chave, embedding)
+        if self.dir_disco:
+            self._gravar_disco(chave, embedding)
+
+    def talvez_relatar(self):
+        """Registra a taxa de acertos da janela a cada `intervalo_relatorio` segundos."""
+        if time.monotonic() - self._ultimo_relatorio < self.intervalo_relatorio:
+            return
+        consultas = self.acertos_memoria + self.acertos_disco + self.faltas
+        if consultas:
+            acertos = self.acertos_memoria + self.acertos_disco
+            logger.info(
+                f"🧠 Cache de embeddings (pid {os.getpid()}): {acertos}/{consultas} acertos "
+                f"({acertos / consultas:.1%}; memória {self.acertos_memoria}, disco {self.acertos_disco}) | "
+                f"{len(self._itens)} em memória"
+            )
+        self._zerar_contadores()
@@ -0,0 +1,408 @@
+"""
+Cache residente de galerias de embeddings, uma por tag_video.
+
+Cada escrita de embedding incrementa um contador de versão por tag_video na
+coleção `galerias`. O processo que escreveu aplica a mudança na sua galeria
+em memória; os demais percebem a versão nova na próxima consulta e trazem do
+MongoDB só os embeddings gravados desde o último que carregaram (pelo
+`criado_em`, com uma janela para gravações fora de ordem). Assim cada face
+custa uma leitura de um documento pequeno em vez de trazer todos os
+embeddings da tag_video pela rede.
+
+Jobs que reescrevem ou apagam embeddings (consolidação, compactação offline,
+migração, remoção de pessoas) incrementam também a `geracao` da tag_video:
+uma geração nova recarrega a galeria inteira (e retreina o índice, se houver).
+
+Criar uma pessoa nova exige mais cuidado: dois processos que não encontraram
+a mesma face criariam duas pessoas. Antes de criar, o processo reserva a
+criação com um compare-and-swap na versão que usou no casamento (e marca
+`criando` no documento da galeria); se alguém escreveu nesse meio tempo, espera
+a criação pendente terminar, recarrega e casa de novo.
+
+Cada modelo tem sua própria galeria e seu próprio contador: o modelo principal
+(MODEL_NAME) usa o campo `versao` e os demais (ex.: o modelo rápido da cascata)
+usam `versao_<modelo>` no mesmo documento.
+
+Opcionalmente as galerias são gravadas em disco (com a versão, a geração e o
+marco de sincronização que refletem), a cada `salvar_a_cada` inserções, ao
+sair do cache e no encerramento do processo (`salvar_todas`). Um worker
+reiniciado retoma a galeria, e um índice já treinado, sem recarregar do
+MongoDB: um arquivo da mesma geração mas de versão anterior recebe só os
+embeddings gravados depois dele.
+
+Com `dir_mmap`, as galerias são montadas sobre o armazém mapeado em memória
+(armazem_mmap.py): recarregar traz do MongoDB só os embeddings que faltam no
+arquivo e cada escrita também é anexada a ele.
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.collection import Collection
+
+from armazem_mmap import INTERVALO_CONTAGEM, ArmazemMmap
+from galeria import Galeria
+from repositorio_embeddings import JANELA_SINCRONIZACAO, Marco, RepositorioEmbeddings, desempacotar
+
+logger = logging.getLogger(__name__)
+
+
+def campo_versao(modelo: str) -> str:
+    """Campo do contador de versão de um modelo que não é o principal."""
+    return f"versao_{modelo}"
+
+
+class _Entrada:
+    __slots__ = ("galeria", "versao", "geracao", "marco", "ultimo_uso", "contado_em", "pendentes")
+
+    def __init__(self, galeria: Galeria, versao: int, geracao: int = 0, marco: Marco = None):
+        self.galeria = galeria
+        self.versao = versao
+        self.geracao = geracao
+        self.marco = marco  # None: sem marco conhecido, a próxima versão recarrega tudo
+        self.ultimo_uso = time.monotonic()
+        self.contado_em = time.monotonic()  # última conferência da contagem com o MongoDB
+        self.pendentes = 0  # inserções ainda não gravadas em disco
+
+
+class CacheGalerias:
+    """
+    Mantém as galerias mais usadas em memória, com despejo LRU.
+
+    - max_galerias: quantidade máxima de tag_videos residentes
+    - ttl_ocioso: segundos sem uso após os quais a galeria é descartada
+    - classe_galeria: Galeria (busca exata) ou uma subclasse com índice
+    - parametros_galeria: argumentos do construtor da classe (ex.: nprobe do IVF)
+    - dir_persistencia: diretório onde as galerias são gravadas (None desativa)
+    - salvar_a_cada: inserções em memória entre duas gravações em disco
+    - campo_versao: campo do contador em `galerias` (um por modelo)
+    - dir_mmap: diretório do armazém mapeado em memória (None desativa)
+    """
+
+    def __init__(self, repositorio: RepositorioEmbeddings, galerias: Collection,
+                 max_galerias: int = 8, ttl_ocioso: float = 600.0,
+                 classe_galeria=Galeria, dir_persistencia: str = None, salvar_a_cada: int = 1000,
+                 prazo_criacao: float = 2.0, campo_versao: str = "versao", dir_mmap: str = None,
+                 parametros_galeria: dict = None):
+        self.repositorio = repositorio
+        self.galerias = galerias
+        self.max_galerias = max_galerias
+        self.ttl_ocioso = ttl_ocioso
+        self.classe_galeria = classe_galeria
+        self.parametros_galeria = parametros_galeria or {}
+        self.dir_persistencia = dir_persistencia
+        self.salvar_a_cada = salvar_a_cada
+        self.prazo_criacao = prazo_criacao  # segundos até uma reserva de criação ser considerada abandonada
+        self.campo_versao = campo_versao
+        self.campo_criacao = campo_versao.replace("versao", "criando", 1)
+        self.dir_mmap = dir_mmap
+        if dir_persistencia:
+            os.makedirs(dir_persistencia, exist_ok=True)
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._armazens = {}  # tag_video -> ArmazemMmap, um por galeria residente
+        self.hits = 0
+        self.recargas = 0
+        self.atualizacoes = 0  # versões novas aplicadas sem recarregar a galeria
+
+    def _estado_remoto(self, tag_video: str) -> tuple:
+        """(versão, geração) da tag_video em `galerias`."""
+        doc = self.galerias.find_one({"_id": tag_video}, {self.campo_versao: 1, "geracao": 1}) or {}
+        return doc.get(self.campo_versao, 0), doc.get("geracao", 0)
+
+    def _arquivo(self, tag_video: str):
+        if not self.dir_persistencia:
+            return None
+        # nome legível + hash curto para que tag_videos parecidas não colidam
+        nome = re.sub(r"[^\w.-]", "_", tag_video)
+        sufixo = hashlib.md5(tag_video.encode()).hexdigest()[:8]
+        return os.path.join(self.dir_persistencia, f"{nome}_{sufixo}.npz")
+
+    def _salvar(self, tag_video: str, entrada: _Entrada):
+        path = self._arquivo(tag_video)
+        if not path:
+            return
+        extras = {"geracao": np.int64(entrada.geracao)}
+        if entrada.marco is not None:
+            # _ids da janela: ObjectId, ou str no centróide das pessoas compactadas
+            ids = list(entrada.marco.vistos)
+            extras.update(
+                marco_ate=np.float64(entrada.marco.ate),
+                marco_ids=np.array([str(i) for i in ids], dtype=str),
+                marco_oid=np.array([isinstance(i, ObjectId) for i in ids], dtype=bool),
+                marco_tempos=np.array(list(entrada.marco.vistos.values()), dtype=np.float64),
+            )
+        try:
+            entrada.galeria.salvar(path, entrada.versao, **extras)
+            entrada.pendentes = 0
+        except OSError as e:
+            logger.error(f"❌ Erro ao gravar galeria {tag_video} em disco: {e}")
+
+    def salvar_todas(self):
+        """Grava em disco as galerias residentes com inserções pendentes (encerramento do processo)."""
+        for tag_video, entrada in list(self._entradas.items()):
+            if entrada.pendentes:
+                self._salvar(tag_video, entrada)
+
+    def _carregar_do_disco(self, tag_video: str, versao: int, geracao: int):
+        """
+        Entrada a partir da galeria gravada em disco, ou None se o arquivo não
+        serve. Um arquivo da versão atual é usado como está; um de versão
+        anterior, da mesma geração e com marco, é completado com os embeddings
+        gravados depois dele.
+        """
+        path = self._arquivo(tag_video)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            galeria, versao_arquivo = self.classe_galeria.carregar(path, **self.parametros_galeria)
+            with np.load(path, allow_pickle=False) as data:
+                # arquivos de antes da geração e do marco só servem na versão exata
+                geracao_arquivo = int(data["geracao"]) if "geracao" in data.files else None
+                marco = None
+                if "marco_ate" in data.files:
+                    ids = [
+                        ObjectId(i) if oid else i
+                        for i, oid in zip(data["marco_ids"].tolist(), data["marco_oid"].tolist())
+                    ]
+                    marco = Marco(float(data["marco_ate"]), dict(zip(ids, data["marco_tempos"].tolist())))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"❌ Galeria em disco ilegível ({path}): {e}")
+            return None
+
+        entrada = _Entrada(galeria, versao_arquivo, geracao, marco)
+        if versao_arquivo == versao and geracao_arquivo in (geracao, None):
+            return entrada
+        if marco is None or geracao_arquivo != geracao or versao_arquivo > versao:
+            return None
+        entrada.contado_em = float("-inf")  # arquivo antigo: confere a contagem já nesta atualização
+        return entrada if self._atualizar(tag_video, entrada, versao) else None
+
+    def _armazem(self, tag_video: str) -> ArmazemMmap:
+        armazem = self._armazens.get(tag_video)
+        if armazem is None:
+            armazem = self._armazens[tag_video] = ArmazemMmap(self.dir_mmap, tag_video)
+        return armazem
+
+    def _descartar(self, tag_video: str):
+        armazem = self._armazens.pop(tag_video, None)
+        if armazem is not None:
+            armazem.fechar()
+
+    def _carregar(self, tag_video: str, geracao: int) -> tuple:
+        """(galeria, Marco) da tag_video inteira."""
+        if self.dir_mmap:
+            # geração: incrementada pelos jobs que reescrevem embeddings (o arquivo é refeito)
+            return self._armazem(tag_video).carregar_galeria(
+                self.repositorio, tag_video, geracao, self.classe_galeria, self.parametros_galeria
+            )
+        return self.repositorio.carregar_sincronizado(tag_video, self.classe_galeria, self.parametros_galeria)
+
+    def _atualizar(self, tag_video: str, entrada: _Entrada, versao: int) -> bool:
+        """
+        Aplica na galeria residente os embeddings gravados por outros processos
+        desde o marco da entrada. Retorna False se a mudança não pode ser
+        aplicada no lugar (quem chamou recarrega a galeria inteira).
+        """
+        marco = entrada.marco
+        if marco is None:
+            return False
+        docs = self.repositorio.alteracoes_desde(tag_video, marco.ate - JANELA_SINCRONIZACAO)
+        # embeddings avulsos entram pelo _id; slots da compactação também quando regravados
+        novos = [
+            d for d in docs
+            if d["_id"] not in marco.vistos or (d.get("slot") is not None and marco.vistos[d["_id"]] != d["criado_em"])
+        ]
+        galeria = entrada.galeria
+        avulsos = [d for d in novos if d.get("slot") is None]
+        for doc, vetor in zip(avulsos, desempacotar(avulsos)):
+            if not galeria.add_embedding(doc["pessoa"], vetor):
+                return False
+        # pessoa compactada: relê exemplares e centróide e troca as linhas dela
+        for pessoa in dict.fromkeys(d["pessoa"] for d in novos if d.get("slot") is not None):
+            estado = self.repositorio.ler_pessoa(pessoa)
+            linhas = list(estado.exemplares) + ([estado.centroide] if estado.centroide is not None else [])
+            if not galeria.substituir_embeddings(pessoa, linhas):
+                return False
+        for doc in novos:
+            galeria.marcar_aparicao(doc["pessoa"], doc["criado_em"])
+
+        if time.monotonic() - entrada.contado_em >= INTERVALO_CONTAGEM:
+            # remoções ou documentos fora da janela passariam despercebidos
+            entrada.contado_em = time.monotonic()
+            if len(galeria.owners) != self.repositorio.contar(tag_video):
+                return False
+
+        ate = max([marco.ate] + [d["criado_em"] for d in docs])
+        vistos = {i: t for i, t in marco.vistos.items() if t >= ate - JANELA_SINCRONIZACAO}
+        vistos.update((d["_id"], d["criado_em"]) for d in docs if d["criado_em"] >= ate - JANELA_SINCRONIZACAO)
+        entrada.marco = Marco(ate, vistos)
+        entrada.versao = versao
+        entrada.pendentes += len(novos)
+        return True
+
+    def _despejar_ociosas(self):
+        agora = time.monotonic()
+        for tag_video in [t for t, e in self._entradas.items() if agora - e.ultimo_uso > self.ttl_ocioso]:
+            entrada = self._entradas.pop(tag_video)
+            if entrada.pendentes:
+                self._salvar(tag_video, entrada)
+            self._descartar(tag_video)
+            logger.info(f"🧹 Galeria ociosa descartada do cache: {tag_video}")
+        while len(self._entradas) > self.max_galerias:
+            tag_video, entrada = self._entradas.popitem(last=False)
+            if entrada.pendentes:
+                self._salvar(tag_video, entrada)
+            self._descartar(tag_video)
+            logger.info(f"🧹 Galeria descartada do cache (LRU): {tag_video}")
+
+    def get(self, tag_video: str) -> Galeria:
+        """
+        Retorna a galeria da tag_video. Uma versão nova traz só os embeddings
+        gravados desde a última leitura; uma geração nova recarrega tudo.
+        """
+        self._despejar_ociosas()
+        versao, geracao = self._estado_remoto(tag_video)
+        entrada = self._entradas.get(tag_video)
+
+        if entrada is not None and entrada.versao == versao:
+            self.hits += 1
+        elif entrada is not None and entrada.geracao == geracao and self._atualizar(tag_video, entrada, versao):
+            self.atualizacoes += 1
+            if entrada.pendentes >= self.salvar_a_cada:
+                self._salvar(tag_video, entrada)
+        else:
+            entrada = self._carregar_do_disco(tag_video, versao, geracao)
+            if entrada is not None:
+                logger.info(
+                    f"💽 Galeria carregada do disco: {tag_video} ({len(entrada.galeria)} pessoas, versão {versao})"
+                )
+            else:
+                # lê a versão antes dos documentos: se alguém escrever no meio,
+                # a próxima consulta vê versão maior e traz o que faltou
+                galeria, marco = self._carregar(tag_video, geracao)
+                entrada = _Entrada(galeria, versao, geracao, marco)
+                self._salvar(tag_video, entrada)
+                logger.info(f"📥 Galeria carregada do MongoDB: {tag_video} ({len(entrada.galeria)} pessoas, versão {versao})")
+            self._entradas[tag_video] = entrada
+            self.recargas += 1
+
+        entrada.ultimo_uso = time.monotonic()
+        self._entradas.move_to_end(tag_video)
+        self._despejar_ociosas()
+        return entrada.galeria
+
+    def versao(self, tag_video: str) -> int:
+        """Versão refletida pela galeria residente (a usada no último `get`)."""
+        entrada = self._entradas.get(tag_video)
+        return entrada.versao if entrada is not None else 0
+
+    def reservar_criacao(self, tag_video: str, versao: int, uuid_str: str) -> bool:
+        """
+        Compare-and-swap: incrementa a versão e marca a criação de `uuid_str` só se
+        a galeria ainda está na `versao` usada no casamento e não há outra criação
+        pendente. Retorna False se houve escrita concorrente (recarregar e casar de novo).
+        """
+        criando = self.campo_criacao
+        filtro = {
+            "_id": tag_video,
+            "$and": [
+                # versão 0 também casa com o campo ainda inexistente
+                {self.campo_versao: versao} if versao else {self.campo_versao: {"$in": [0, None]}},
+                {"$or": [{criando: None}, {f"{criando}.desde": {"$lt": time.time() - self.prazo_criacao}}]},
+            ],
+        }
+        try:
+            doc = self.galerias.find_one_and_update(
+                filtro,
+                {"$inc": {self.campo_versao: 1}, "$set": {criando: {"pessoa": uuid_str, "desde": time.time()}}},
+                upsert=versao == 0,  # primeira escrita da tag_video
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False
+        if doc is None:
+            return False
+
+        entrada = self._entradas.get(tag_video)
+        if entrada is not None and entrada.versao == versao:
+            entrada.versao = doc[self.campo_versao]  # a reserva não muda o conteúdo da galeria
+        return True
+
+    def aguardar_criacao(self, tag_video: str):
+        """Espera (até `prazo_criacao`) a criação pendente de outro processo ser gravada."""
+        limite = time.monotonic() + self.prazo_criacao
+        while time.monotonic() < limite:
+            doc = self.galerias.find_one({"_id": tag_video}, {self.campo_criacao: 1})
+            criando = (doc or {}).get(self.campo_criacao)
+            if not criando or time.time() - criando["desde"] > self.prazo_criacao:
+                return
+            time.sleep(0.01)
+
+    def _registrar(self, tag_video: str, uuid_str: str, aplicar, criacao: bool = False, doc_id=None):
+        doc = None
+        if criacao:
+            # conclui a criação reservada: publica a versão e libera a reserva juntos
+            doc = self.galerias.find_one_and_update(
+                {"_id": tag_video, f"{self.campo_criacao}.pessoa": uuid_str},
+                {"$inc": {self.campo_versao: 1}, "$unset": {self.campo_criacao: ""}},
+                return_document=ReturnDocument.AFTER
+            )
+        if doc is None:
+            doc = self.galerias.find_one_and_update(
+                {"_id": tag_video},
+                {"$inc": {self.campo_versao: 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        entrada = self._entradas.get(tag_video)
+        if entrada is None:
+            return
+
+        if aplicar is None or doc[self.campo_versao] != entrada.versao + 1:
+            # houve escrita concorrente de outro processo: a galeria fica na versão
+            # anterior e a próxima consulta traz do MongoDB o que falta (esta escrita inclusive)
+            return
+        if not aplicar(entrada.galeria):
+            # a mudança não cabe no lugar (ex.: dimensão diferente): recarrega na próxima consulta
+            del self._entradas[tag_video]
+            return
+        entrada.versao = doc[self.campo_versao]
+        entrada.galeria.marcar_aparicao(uuid_str, time.time())
+        if doc_id is not None and entrada.marco is not None:
+            entrada.marco.vistos[doc_id] = time.time()  # já aplicado: a atualização incremental o ignora
+        entrada.pendentes += 1
+        if entrada.pendentes >= self.salvar_a_cada:
+            self._salvar(tag_video, entrada)
+
+    def registrar_embedding(self, tag_video: str, uuid_str: str, embedding, criacao: bool = False, doc_id=None):
+        """
+        Deve ser chamado depois de gravar o embedding no MongoDB: incrementa a
+        versão e aplica a mudança no lugar se ninguém mais escreveu nesse meio tempo.
+        Com `embedding=None` apenas publica a nova versão (a galeria residente traz
+        o documento do MongoDB na próxima consulta).
+        Com `criacao`, também libera a reserva feita em `reservar_criacao`.
+        `doc_id` (o _id gravado) anexa o embedding ao armazém mapeado em memória.
+        """
+        if self.dir_mmap and doc_id is not None and embedding is not None:
+            self._armazem(tag_video).anexar(doc_id, uuid_str, embedding, time.time())
+        aplicar = None if embedding is None else (lambda galeria: galeria.add_embedding(uuid_str, embedding))
+        self._registrar(tag_video, uuid_str, aplicar, criacao, doc_id)
+
+    def registrar_pessoa(self, tag_video: str, uuid_str: str, linhas, criacao: bool = False):
+        """Como `registrar_embedding`, mas troca todas as linhas da pessoa (galeria compactada)."""
+        aplicar = None if linhas is None else (lambda galeria: galeria.substituir_embeddings(uuid_str, linhas))
+        self._registrar(tag_video, uuid_str, aplicar, criacao)
+
+    def invalidar(self, tag_video: str = None):
+        """Descarta uma galeria (ou todas) do cache."""
+        if tag_video is None:
+            self._entradas.clear()
+        else:
+            self._entradas.pop(tag_video, None)
@@ -0,0 +1,96 @@
+"""
+Reconhecimento em cascata: modelo rápido primeiro, modelo pesado só nas faces ambíguas.
+
+O modelo rápido (embedding pequeno, CASCATA_MODELO_RAPIDO) decide sozinho os
+casos claros:
+  - casa abaixo de limiar_rapido * (1 - faixa)            -> mesma pessoa
+  - não casa nem com limiar_rapido * (1 + faixa)          -> pessoa nova
+Só as faces que caem na faixa de incerteza entre os dois recebem o embedding
+do modelo pesado (MODEL_NAME), casado contra a galeria desse modelo.
+
+A galeria pesada só tem as pessoas que já passaram por uma decisão ambígua,
+então "nenhum candidato no modelo pesado" não é prova de pessoa nova: nesse
+caso a identidade é resolvida pela galeria rápida no limiar normal, e só vira
+pessoa nova se também não casar lá.
+
+O embedding pesado é gerado por quem chama, entre `triagem` (estágio rápido)
+e `decidir_pesado`, para poder ser reaproveitado entre tentativas.
+
+A triagem compara a face com a galeria rápida uma vez só e vota os três
+limiares (estrito, frouxo e normal) sobre as mesmas distâncias; o resultado no
+limiar normal fica na `Triagem` para o fallback de `decidir_pesado`.
+"""
+import time
+from collections import namedtuple
+
+# uuid/distância da decisão, {modelo: embedding} calculados e o registro por estágio
+Decisao = namedtuple("Decisao", "uuid distancia embeddings cascata")
+# decisão do estágio rápido (None se a face é ambígua), o tempo gasto nele e o
+# (uuid, distância) da galeria rápida no limiar normal
+Triagem = namedtuple("Triagem", "decisao tempo_rapido normal")
+
+
+class Cascata:
+    def __init__(self, modelo_rapido: str, modelo_pesado: str, faixa: float = 0.15):
+        self.modelo_rapido = modelo_rapido
+        self.modelo_pesado = modelo_pesado
+        self.faixa = faixa
+
+    def _registro(self, estagio: str, resultado: str, tempo_rapido: float, tempo_pesado: float = 0.0) -> dict:
+        return {
+            "modelo_rapido": self.modelo_rapido,
+            "modelo_pesado": self.modelo_pesado,
+            "estagio_decisao": estagio,
+            "resultado": resultado,
+            "tempo_estagio_rapido": tempo_rapido,
+            "tempo_estagio_pesado": tempo_pesado,
+        }
+
+    def triagem(self, galeria_rapida, embedding_rapido, limiar_rapido: float,
+                quentes_desde: float = None, tempo_embedding_rapido: float = 0.0) -> Triagem:
+        """
+        Estágio rápido. `decisao` vem preenchida nos casos claros e None nas faces
+        ambíguas, que seguem para `decidir_pesado`.
+        `tempo_embedding_rapido` é a parcela desta face na inferência do lote.
+        """
+        inicio = time.perf_counter()
+        embeddings = {self.modelo_rapido: embedding_rapido}
+
+        limiares = [limiar_rapido * (1 - self.faixa), limiar_rapido * (1 + self.faixa), limiar_rapido]
+        (uuid_str, distancia), (candidato, _), normal = galeria_rapida.match_varios(
+            embedding_rapido, limiares, quentes_desde=quentes_desde
+        )
+        tempo = tempo_embedding_rapido + time.perf_counter() - inicio
+        if uuid_str is not None:
+            return Triagem(Decisao(uuid_str, distancia, embeddings, self._registro("rapido", "casou", tempo)),
+                           tempo, normal)
+        if candidato is None:
+            return Triagem(Decisao(None, None, embeddings, self._registro("rapido", "nova", tempo)), tempo, normal)
+        return Triagem(None, tempo, normal)
+
+    def decidir_pesado(self, triagem: Triagem, embedding_rapido, galeria_pesada, pesado: tuple, limiar_pesado: float,
+                       quentes_desde: float = None, tempo_pesado: float = 0.0) -> Decisao:
+        """
+        Segunda opinião para uma face ambígua. `pesado` é (embedding ou None, modelo);
+        `tempo_pesado` é o tempo gasto gerando o embedding pesado.
+        """
+        inicio = time.perf_counter()
+        embedding_pesado, modelo_pesado = pesado
+        embeddings = {self.modelo_rapido: embedding_rapido}
+
+        uuid_str = None
+        if embedding_pesado is None:
+            resultado = "falha_pesado"
+        else:
+            embeddings[modelo_pesado] = embedding_pesado
+            uuid_str, distancia = galeria_pesada.match(embedding_pesado, limiar_pesado, quentes_desde=quentes_desde)
+            resultado = "casou"
+        if uuid_str is None:
+            # sem candidato no modelo pesado: a identidade vem da galeria rápida no
+            # limiar normal, já votado na triagem
+            uuid_str, distancia = triagem.normal
+            if embedding_pesado is not None:
+                resultado = "sem_candidato_pesado" if uuid_str is not None else "nova"
+        estagio = "pesado" if embedding_pesado is not None else "rapido"
+        registro = self._registro(estagio, resultado, triagem.tempo_rapido, tempo_pesado + time.perf_counter() - inicio)
+        return Decisao(uuid_str, distancia, embeddings, registro)
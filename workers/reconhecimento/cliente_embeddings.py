@@ -0,0 +1,91 @@
+"""
+Cliente do serviço local de embeddings (servico_embeddings.py).
+
+EMBEDDING_SERVICE_URL aceita HTTP local ou socket Unix:
+    http://127.0.0.1:8765
+    unix:///tmp/embeddings.sock
+
+As imagens vão como bytes (PNG/JPEG) codificados em base64; cada thread mantém
+sua própria conexão keep-alive com o serviço.
+"""
+import base64
+import http.client
+import json
+import logging
+import socket
+import threading
+import time
+from urllib.parse import quote, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class _ConexaoUnix(http.client.HTTPConnection):
+    """HTTPConnection sobre socket Unix."""
+
+    def __init__(self, caminho: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.caminho = caminho
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.caminho)
+
+
+class ClienteEmbeddings:
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = urlparse(url)
+        if self.url.scheme not in ("http", "unix"):
+            raise ValueError(f"EMBEDDING_SERVICE_URL inválida: {url}")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _nova_conexao(self) -> http.client.HTTPConnection:
+        if self.url.scheme == "unix":
+            return _ConexaoUnix(self.url.path, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+    def _requisicao(self, metodo: str, caminho: str, corpo: dict = None) -> dict:
+        dados = json.dumps(corpo).encode() if corpo is not None else None
+        headers = {"Content-Type": "application/json"} if dados is not None else {}
+        for tentativa in range(2):
+            conexao = getattr(self._local, "conexao", None) or self._nova_conexao()
+            self._local.conexao = conexao
+            try:
+                conexao.request(metodo, caminho, body=dados, headers=headers)
+                resposta = conexao.getresponse()
+                conteudo = resposta.read()
+            except (OSError, http.client.HTTPException):
+                # conexão keep-alive fechada pelo serviço: reconecta uma vez
+                conexao.close()
+                self._local.conexao = None
+                if tentativa:
+                    raise
+                continue
+            if resposta.status != 200:
+                raise RuntimeError(f"Serviço de embeddings respondeu {resposta.status}: {conteudo[:200]!r}")
+            return json.loads(conteudo)
+
+    def info(self, modelo: str = None, espera_max: float = 60.0) -> dict:
+        """
+        Modelo e limiar do serviço (ou de `modelo`); aguarda o serviço subir por
+        até `espera_max` segundos.
+        """
+        caminho = f"/info?modelo={quote(modelo)}" if modelo else "/info"
+        limite = time.monotonic() + espera_max
+        while True:
+            try:
+                return self._requisicao("GET", caminho)
+            except OSError as e:
+                if time.monotonic() > limite:
+                    raise
+                logger.info(f"⏳ Aguardando serviço de embeddings: {e}")
+                time.sleep(1)
+
+    def gerar(self, imagens: list, modelo: str = None) -> list:
+        """Embeddings (ou None) das imagens, na mesma ordem; `modelo` padrão: o do serviço."""
+        corpo = {"imagens": [base64.b64encode(img).decode() for img in imagens]}
+        if modelo:
+            corpo["modelo"] = modelo
+        return self._requisicao("POST", "/embeddings", corpo)["embeddings"]
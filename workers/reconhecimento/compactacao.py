@@ -0,0 +1,197 @@
+"""
+Compactação da galeria: centróide + reservatório de exemplares por pessoa.
+
+Sem compactação, cada reconhecimento faz `$push` de mais um embedding e a
+pessoa cresce sem limite. Com a política de reservatório cada pessoa guarda:
+  - no máximo K exemplares (slots 0..K-1 na coleção `embeddings`), escolhidos
+    para manter diversidade: ao chegar um novo, sai o mais redundante — o de
+    maior similaridade com o vizinho mais próximo, que pode ser o próprio novo
+  - o centróide (slot -1, com `total`): média corrente de todos os embeddings
+    (normalizados) já vistos
+
+Na galeria o centróide entra como mais uma linha da pessoa, então a votação
+passa a ser "≥ 20% de K exemplares + centróide" e custa O(K) por pessoa,
+independente de quanto tempo ela ficou na câmera.
+
+Executado diretamente, compacta as pessoas já gravadas sem slots:
+    python compactacao.py --max-exemplares 20 [--tag-video A09] [--dry-run]
+"""
+import argparse
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from galeria import normalize_rows
+
+
+def selecionar_exemplares(embeddings: np.ndarray, k: int) -> np.ndarray:
+    """
+    Índices de até k exemplares diversos (seleção gulosa do ponto mais distante),
+    começando pelo embedding mais próximo do centróide.
+    """
+    rows = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    if len(rows) <= k:
+        return np.arange(len(rows))
+
+    centro = normalize_rows(rows.mean(axis=0))
+    escolhidos = [int(np.argmax(rows @ centro))]
+    max_sim = rows @ rows[escolhidos[0]]
+    for _ in range(k - 1):
+        max_sim[escolhidos] = np.inf
+        proximo = int(np.argmin(max_sim))
+        escolhidos.append(proximo)
+        max_sim = np.maximum(max_sim, rows @ rows[proximo])
+    return np.sort(np.array(escolhidos))
+
+
+def mais_redundante(exemplares: np.ndarray, novo: np.ndarray) -> int:
+    """
+    Índice (em exemplares + [novo]) do vetor com maior similaridade ao seu
+    vizinho mais próximo. Retorna len(exemplares) se o redundante for o novo.
+    """
+    rows = normalize_rows(np.vstack([exemplares, novo]).astype(np.float32))
+    sims = rows @ rows.T
+    np.fill_diagonal(sims, -np.inf)
+    return int(np.argmax(sims.max(axis=1)))
+
+
+Atualizacao = namedtuple("Atualizacao", "slots exemplares centroide total reescrever")
+
+
+class PoliticaReservatorio:
+    """Mantém até `max_exemplares` embeddings e o centróide corrente de cada pessoa."""
+
+    def __init__(self, max_exemplares: int):
+        self.max_exemplares = max_exemplares
+
+    def atualizar(self, exemplares: np.ndarray, centroide, total: int, novo) -> Atualizacao:
+        """
+        Calcula o novo estado da pessoa com o embedding novo.
+
+        - slots: {slot: vetor} alterados (gravar só esses)
+        - exemplares / centroide / total: estado completo depois da atualização
+        - reescrever: True se todos os exemplares foram reselecionados
+        """
+        novo = np.asarray(novo, dtype=np.float32)
+        exemplares = np.asarray(exemplares, dtype=np.float32).reshape(-1, len(novo))
+
+        if centroide is None or len(centroide) != len(novo):
+            # pessoa anterior à compactação: começa pela média dos exemplares atuais
+            total = len(exemplares)
+            centroide = normalize_rows(exemplares).mean(axis=0) if total else np.zeros_like(novo)
+        centroide = (np.asarray(centroide, dtype=np.float32) * total + normalize_rows(novo)) / (total + 1)
+
+        slots, reescrever = {}, False
+        if len(exemplares) < self.max_exemplares:
+            slots[len(exemplares)] = novo
+            exemplares = np.vstack([exemplares, novo])
+        elif len(exemplares) == self.max_exemplares:
+            idx = mais_redundante(exemplares, novo)
+            if idx < len(exemplares):
+                exemplares = exemplares.copy()
+                exemplares[idx] = novo
+                slots[idx] = novo
+        else:
+            # pessoa acima do limite (política mudou): reseleciona tudo
+            candidatos = np.vstack([exemplares, novo])
+            exemplares = candidatos[selecionar_exemplares(candidatos, self.max_exemplares)]
+            reescrever = True
+
+        return Atualizacao(slots, exemplares, centroide, total + 1, reescrever)
+
+    def compactar(self, embeddings: np.ndarray):
+        """
+        Compactação em lote de uma pessoa já gravada: Atualizacao com todos os
+        exemplares reselecionados, ou None se ela já está dentro da política.
+        """
+        if len(embeddings) <= self.max_exemplares:
+            return None
+        return Atualizacao(
+            slots={},
+            exemplares=embeddings[selecionar_exemplares(embeddings, self.max_exemplares)],
+            centroide=normalize_rows(embeddings).mean(axis=0),
+            total=len(embeddings),
+            reescrever=True,
+        )
+
+    def mesclar(self, estados: list) -> Atualizacao:
+        """
+        Estado único de várias pessoas que são a mesma (consolidação): exemplares
+        reselecionados entre todos e centróide ponderado pelo total de cada uma.
+        """
+        exemplares, soma, total = [], 0.0, 0
+        for estado in estados:
+            linhas = np.asarray(estado.exemplares, dtype=np.float32)
+            if len(linhas):
+                exemplares.append(linhas)
+            if estado.centroide is not None and estado.total:
+                soma = soma + np.asarray(estado.centroide, dtype=np.float32) * estado.total
+                total += estado.total
+            elif len(linhas):
+                soma = soma + normalize_rows(linhas).sum(axis=0)
+                total += len(linhas)
+        centroide = soma / max(total, 1)
+        exemplares = np.vstack(exemplares) if exemplares else centroide[None, :]
+        return Atualizacao(
+            slots={},
+            exemplares=exemplares[selecionar_exemplares(exemplares, self.max_exemplares)],
+            centroide=centroide,
+            total=total,
+            reescrever=True,
+        )
+
+    @staticmethod
+    def linhas(atualizacao: Atualizacao) -> np.ndarray:
+        """Linhas da pessoa na galeria: exemplares + centróide."""
+        return np.vstack([atualizacao.exemplares, atualizacao.centroide])
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from cache_galerias import campo_versao
+    from repositorio_embeddings import RepositorioEmbeddings
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Compacta as pessoas gravadas em centróide + K exemplares.")
+    parser.add_argument("--max-exemplares", type=int, default=int(os.getenv("GALERIA_MAX_EXEMPLARES") or 20))
+    parser.add_argument("--modelo", default=os.getenv("MODEL_NAME"))
+    parser.add_argument("--tag-video")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB_NAME")]
+    repositorio = RepositorioEmbeddings(db["embeddings"], args.modelo, os.getenv("EMBEDDINGS_FORMATO", "float32"))
+    politica = PoliticaReservatorio(args.max_exemplares)
+
+    tag_videos = [args.tag_video] if args.tag_video else db["embeddings"].distinct("tag_video", {"modelo": args.modelo})
+    compactadas, antes, depois = 0, 0, 0
+    for tag_video in tag_videos:
+        alteradas = 0
+        for pessoa, embeddings in repositorio.carregar_por_pessoa({"tag_video": tag_video, "slot": {"$exists": False}}).items():
+            atualizacao = politica.compactar(embeddings)
+            if atualizacao is None:
+                continue
+            alteradas += 1
+            antes += len(embeddings)
+            depois += len(atualizacao.exemplares)
+            if not args.dry_run:
+                repositorio.gravar_pessoa(pessoa, tag_video, atualizacao, reescrever=True)
+
+        compactadas += alteradas
+        if alteradas and not args.dry_run:
+            # invalida as galerias em memória dos workers (o modelo pode ser o principal
+            # ou o rápido da cascata, então incrementa os dois contadores); a geração
+            # nova faz os armazéns mapeados em memória serem refeitos
+            db["galerias"].update_one(
+                {"_id": tag_video}, {"$inc": {"versao": 1, "geracao": 1, campo_versao(args.modelo): 1}}, upsert=True
+            )
+
+    modo = "🔎 [dry-run] " if args.dry_run else "✅ "
+    print(f"{modo}{compactadas} pessoas compactadas: {antes} → {depois} embeddings")
+
+
+if __name__ == "__main__":
+    main()
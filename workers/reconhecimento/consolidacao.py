@@ -0,0 +1,203 @@
+"""
+Consolidação de identidades duplicadas.
+
+Toda face que não casa vira um uuid novo, então a mesma pessoa real acaba
+dividida em vários documentos de `pessoas` — a galeria cresce, cada face paga
+mais comparações e as métricas de cluster de /fontes/{id}/recalcular pioram.
+
+Por tag_video, o job calcula o centróide de cada pessoa, liga as pessoas cujos
+centróides ficam a menos de `--limiar` (distância de cosseno, calculada em
+blocos de uma multiplicação de matrizes) e junta os componentes conexos
+(union-find). Em cada grupo sobrevive a pessoa cadastrada primeiro; as demais
+são mescladas nela:
+  - `embeddings`: passam para a sobrevivente (pessoas compactadas são
+    recompactadas em centróide + K exemplares, um modelo por vez)
+  - `presencas` e `rastreios` (identidade dos rastreios da detecção): `pessoa`
+    reescrito para a sobrevivente e `tags` trocadas pelas tags somadas, em lote
+  - `pessoas`: image_paths e tags somados na sobrevivente, que guarda os uuids
+    absorvidos em `uuids_mesclados`; os documentos absorvidos são apagados
+As imagens ficam onde estão no MinIO: os caminhos antigos continuam válidos.
+
+Depois de gravar, a versão das galerias é incrementada para os workers
+recarregarem. Rode com o reconhecimento da tag_video parado.
+
+    python consolidacao.py --tag-video A09 --dry-run
+    python consolidacao.py --tag-video A09 --limiar 0.25
+"""
+import argparse
+import os
+
+import numpy as np
+
+from galeria import normalize_rows
+
+
+def centroides(por_pessoa: dict) -> tuple:
+    """(uuids, matriz (N, D) de centróides normalizados) de {uuid: linhas}."""
+    uuids = list(por_pessoa)
+    if not uuids:
+        return uuids, np.empty((0, 0), dtype=np.float32)
+    matrix = np.vstack([normalize_rows(linhas).mean(axis=0) for linhas in por_pessoa.values()])
+    return uuids, normalize_rows(matrix.astype(np.float32))
+
+
+def agrupar(centros: np.ndarray, limiar: float, bloco: int = 2048) -> list:
+    """
+    Componentes conexos do grafo "distância de cosseno < limiar" entre centróides
+    normalizados. Retorna listas de índices com mais de um elemento, cada uma
+    acompanhada da menor distância que a uniu: [(indices, distancia)].
+    """
+    n = len(centros)
+    pai = np.arange(n)
+
+    def raiz(i):
+        while pai[i] != i:
+            pai[i] = pai[pai[i]]
+            i = pai[i]
+        return i
+
+    arestas = []
+    for inicio in range(0, n, bloco):
+        distancias = 1 - centros[inicio:inicio + bloco] @ centros.T
+        linhas, colunas = np.nonzero(distancias < limiar)
+        for i, j in zip(linhas + inicio, colunas):
+            if j <= i:
+                continue  # cada par uma vez, sem a diagonal
+            a, b = raiz(i), raiz(j)
+            if a != b:
+                pai[max(a, b)] = min(a, b)
+            arestas.append((i, float(distancias[i - inicio, j])))
+
+    grupos, menor = {}, {}
+    for i in range(n):
+        grupos.setdefault(raiz(i), []).append(i)
+    for i, distancia in arestas:
+        r = raiz(i)
+        menor[r] = min(menor.get(r, distancia), distancia)
+    return [(membros, menor[r]) for r, membros in grupos.items() if len(membros) > 1]
+
+
+def mesclar_grupo(db, sobrevivente: dict, absorvidas: list, max_exemplares: int, formato: str):
+    """Grava a mescla de um grupo: embeddings, presenças, rastreios e pessoas."""
+    from compactacao import PoliticaReservatorio
+    from repositorio_embeddings import RepositorioEmbeddings
+
+    uuid_sobrevivente = sobrevivente["uuid"]
+    uuids_absorvidos = [p["uuid"] for p in absorvidas]
+    todos = [uuid_sobrevivente] + uuids_absorvidos
+
+    # embeddings de todos os modelos passam para a sobrevivente
+    for modelo in db["embeddings"].distinct("modelo", {"pessoa": {"$in": todos}}):
+        compactada = db["embeddings"].count_documents(
+            {"pessoa": {"$in": todos}, "modelo": modelo, "slot": {"$exists": True}}, limit=1
+        )
+        if compactada:
+            # slots e centróides de várias pessoas não se somam: recompacta o grupo
+            repositorio = RepositorioEmbeddings(db["embeddings"], modelo, formato)
+            politica = PoliticaReservatorio(max_exemplares)
+            atualizacao = politica.mesclar([repositorio.ler_pessoa(u) for u in todos])
+            repositorio.gravar_pessoa(uuid_sobrevivente, sobrevivente.get("tag_video"), atualizacao, reescrever=True)
+            db["embeddings"].delete_many({"pessoa": {"$in": uuids_absorvidos}, "modelo": modelo})
+        else:
+            db["embeddings"].update_many(
+                {"pessoa": {"$in": uuids_absorvidos}, "modelo": modelo},
+                {"$set": {"pessoa": uuid_sobrevivente}}
+            )
+
+    # tags somadas, sem repetição, na ordem: sobrevivente primeiro
+    tags = list(dict.fromkeys(tag for p in [sobrevivente] + absorvidas for tag in p.get("tags", [])))
+    image_paths = [path for p in absorvidas for path in p.get("image_paths", [])]
+    ultima = max([p.get("last_appearance") or 0 for p in absorvidas + [sobrevivente]])
+
+    # presenças e rastreios guardam uma cópia da identidade: aponta tudo para a sobrevivente
+    identidade = {"$set": {"pessoa": uuid_sobrevivente, "tags": tags}}
+    db["presencas"].update_many({"pessoa": {"$in": todos}}, identidade)
+    db["rastreios"].update_many({"pessoa": {"$in": todos}}, identidade)
+
+    db["pessoas"].update_one(
+        {"uuid": uuid_sobrevivente},
+        {
+            "$push": {"image_paths": {"$each": image_paths}},
+            "$addToSet": {"tags": {"$each": tags}, "uuids_mesclados": {"$each": uuids_absorvidos}},
+            "$max": {"last_appearance": ultima},
+        }
+    )
+    db["pessoas"].delete_many({"uuid": {"$in": uuids_absorvidos}})
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from cache_galerias import campo_versao
+    from repositorio_embeddings import RepositorioEmbeddings
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Mescla pessoas duplicadas de uma tag_video.")
+    parser.add_argument("--tag-video", help="padrão: todas as tag_videos com embeddings do modelo")
+    parser.add_argument("--modelo", default=os.getenv("MODEL_NAME"))
+    parser.add_argument("--limiar", type=float,
+                        help="distância de cosseno entre centróides para mesclar (padrão: 80%% do limiar do modelo)")
+    parser.add_argument("--max-exemplares", type=int, default=int(os.getenv("GALERIA_MAX_EXEMPLARES") or 20),
+                        help="exemplares por pessoa ao recompactar pessoas compactadas")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.limiar is None:
+        from deepface.modules.verification import find_threshold
+        args.limiar = 0.8 * find_threshold(args.modelo, "cosine")
+
+    formato = os.getenv("EMBEDDINGS_FORMATO", "float32")
+    db = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB_NAME")]
+    repositorio = RepositorioEmbeddings(db["embeddings"], args.modelo, formato)
+
+    tag_videos = [args.tag_video] if args.tag_video else db["embeddings"].distinct("tag_video", {"modelo": args.modelo})
+    total_antes, total_mescladas = 0, 0
+    for tag_video in tag_videos:
+        uuids, centros = centroides(repositorio.carregar_por_pessoa({"tag_video": tag_video}))
+        grupos = agrupar(centros, args.limiar)
+        total_antes += len(uuids)
+        if not grupos:
+            print(f"✅ {tag_video}: {len(uuids)} pessoas, nenhuma duplicada abaixo de {args.limiar:.3f}")
+            continue
+
+        docs = {
+            p["uuid"]: p for p in db["pessoas"].find(
+                {"uuid": {"$in": uuids}},
+                {"uuid": 1, "tags": 1, "image_paths": 1, "last_appearance": 1, "tag_video": 1}
+            )
+        }
+        mescladas = 0
+        for membros, distancia in grupos:
+            # sobrevive a pessoa cadastrada primeiro (menor _id); pessoas sem documento vão para o fim
+            grupo = [docs.get(uuids[i]) or {"uuid": uuids[i], "tag_video": tag_video} for i in membros]
+            grupo.sort(key=lambda p: (p.get("_id") is None, str(p.get("_id", ""))))
+            sobrevivente, absorvidas = grupo[0], grupo[1:]
+            presencas = db["presencas"].count_documents({"pessoa": {"$in": [p["uuid"] for p in absorvidas]}})
+            print(
+                f"🔗 {tag_video}: {sobrevivente['uuid']} ← {', '.join(p['uuid'] for p in absorvidas)} "
+                f"(distância mínima {distancia:.3f}, {presencas} presenças, "
+                f"{sum(len(p.get('image_paths', [])) for p in absorvidas)} imagens)"
+            )
+            if not args.dry_run:
+                sobrevivente.setdefault("tag_video", tag_video)
+                mesclar_grupo(db, sobrevivente, absorvidas, args.max_exemplares, formato)
+            mescladas += len(absorvidas)
+
+        total_mescladas += mescladas
+        if not args.dry_run:
+            # invalida as galerias em memória dos workers de todos os modelos (e refaz os armazéns mapeados)
+            modelos = db["embeddings"].distinct("modelo", {"tag_video": tag_video})
+            db["galerias"].update_one(
+                {"_id": tag_video},
+                {"$inc": {"versao": 1, "geracao": 1, **{campo_versao(m): 1 for m in modelos}}},
+                upsert=True
+            )
+        print(f"📉 {tag_video}: {len(uuids)} → {len(uuids) - mescladas} pessoas")
+
+    modo = "🔎 [dry-run] " if args.dry_run else "✅ "
+    print(f"{modo}{total_mescladas} pessoas mescladas: {total_antes} → {total_antes - total_mescladas}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Galeria vetorizada de embeddings para o reconhecimento facial.
+
+Empilha os embeddings de todas as pessoas de uma tag_video em uma única
+matriz float32 (linhas normalizadas em L2), de modo que as distâncias de
+cosseno contra uma face nova saiam de um único produto matriz-vetor e a
+votação ("≥ 20% dos embeddings abaixo do limiar") vire reduções de array.
+"""
+import os
+
+import numpy as np
+
+# Fração mínima dos embeddings de uma pessoa que precisam ficar abaixo do
+# limiar para que ela seja considerada a mesma pessoa
+MIN_MATCH_RATIO = 0.2
+# Pessoas no primeiro bloco da varredura por recência (os seguintes dobram)
+BLOCO_RECENCIA = 64
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Normaliza cada linha em L2 (linhas nulas permanecem nulas)."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def cosine_distances(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Distância de cosseno (1 - similaridade) entre cada linha já normalizada e a consulta."""
+    q = normalize_rows(np.asarray(query, dtype=np.float32))
+    return 1.0 - matrix @ q
+
+
+class Galeria:
+    """
+    Embeddings de um conjunto de pessoas em uma única matriz.
+
+    - matrix: (N, D) float32, linhas normalizadas
+    - owners: (N,) índice da pessoa dona de cada linha em `uuids`
+    - counts: (P,) quantidade de embeddings de cada pessoa
+
+    - recencia: (P,) timestamp da última aparição de cada pessoa
+
+    Em caso de mais de uma pessoa atingir a votação, vence a vista mais
+    recentemente (empate: a primeira na ordem de `uuids`). A busca exata
+    percorre as pessoas nessa mesma ordem, em blocos, e para no primeiro bloco
+    em que alguém atinge a votação: o vencedor é o mesmo, e as pessoas antigas
+    só são comparadas quando as recentes não casam. Com `quentes_desde`, o
+    primeiro bloco são as pessoas vistas depois desse instante.
+
+    Pessoas compactadas (ver compactacao.py) têm o `centroide` como última
+    linha, participando da votação como mais um embedding.
+
+    Novos embeddings podem ser anexados no lugar (`add_embedding`); os buffers
+    crescem por dobramento, então manter a galeria residente custa O(1)
+    amortizado por face.
+
+    Uma `matrix` somente leitura (ex.: np.memmap do armazém em disco) vira a
+    base da galeria e nunca é copiada: as linhas anexadas depois ficam em um
+    bloco à parte em memória, e a busca percorre os dois.
+    """
+
+    def __init__(self, uuids: list, matrix: np.ndarray, owners: np.ndarray, recencia: np.ndarray = None):
+        self.uuids = list(uuids)
+        self._pos = {u: i for i, u in enumerate(self.uuids)}
+        if isinstance(matrix, np.memmap) or not matrix.flags.writeable:
+            # base somente leitura; `_matrix` guarda só as linhas anexadas depois dela
+            self._base = matrix
+            self._matrix = np.empty((0, matrix.shape[1]), dtype=np.float32)
+        else:
+            self._base = None
+            self._matrix = matrix
+        self._n_base = len(self._base) if self._base is not None else 0
+        self._owners = owners
+        self._size = len(owners)
+        self._counts = np.bincount(owners, minlength=len(self.uuids)).astype(np.int64)
+        self._recencia = np.zeros(len(self._counts), dtype=np.float64)
+        if recencia is not None:
+            self._recencia[:len(recencia)] = recencia
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Todas as linhas; com base somente leitura, concatena (cópia) a base e o bloco anexado."""
+        if self._base is None:
+            return self._matrix[:self._size]
+        if self._size == self._n_base:
+            return self._base
+        return np.concatenate(self._partes())
+
+    def _partes(self) -> list:
+        """Blocos de linhas na ordem global: a base (se houver) e as linhas em memória."""
+        anexadas = self._matrix[:self._size - self._n_base]
+        return [self._base, anexadas] if self._base is not None else [anexadas]
+
+    def _linhas(self, rows) -> np.ndarray:
+        """Linhas pelos índices globais, lidas da base ou do bloco em memória."""
+        rows = np.asarray(rows)
+        if not self._n_base:
+            return self._matrix[rows]
+        na_base = rows < self._n_base
+        if na_base.all():
+            return self._base[rows]
+        if not na_base.any():
+            return self._matrix[rows - self._n_base]
+        linhas = np.empty((len(rows), self.dim), dtype=np.float32)
+        linhas[na_base] = self._base[rows[na_base]]
+        linhas[~na_base] = self._matrix[rows[~na_base] - self._n_base]
+        return linhas
+
+    def _distancias(self, query: np.ndarray, rows=None) -> np.ndarray:
+        """Distâncias de cosseno da consulta às linhas `rows` (None = todas), bloco a bloco."""
+        if rows is not None:
+            return cosine_distances(self._linhas(rows), query)
+        partes = self._partes()
+        if len(partes) == 1:
+            return cosine_distances(partes[0], query)
+        return np.concatenate([cosine_distances(parte, query) for parte in partes])
+
+    @property
+    def owners(self) -> np.ndarray:
+        return self._owners[:self._size]
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self._counts[:len(self.uuids)]
+
+    @property
+    def recencia(self) -> np.ndarray:
+        return self._recencia[:len(self.uuids)]
+
+    @property
+    def dim(self):
+        return self._matrix.shape[1] if self._matrix.ndim == 2 and self._matrix.shape[1] else None
+
+    def __len__(self):
+        return len(self.uuids)
+
+    def __contains__(self, uuid_str):
+        return uuid_str in self._pos
+
+    @classmethod
+    def from_people(cls, people, **parametros) -> "Galeria":
+        """
+        Monta a galeria a partir dos documentos de `pessoas` (campos `embeddings` e `centroide`).
+        `parametros` vão para o construtor (ex.: nprobe de uma subclasse com índice).
+        """
+        uuids, blocks, owners = [], [], []
+        dim = None
+        for pessoa in people:
+            linhas = pessoa.get("embeddings") or []
+            if linhas and pessoa.get("centroide") is not None:
+                linhas = linhas + [pessoa["centroide"]]
+            try:
+                embs = np.asarray(linhas, dtype=np.float32)
+            except ValueError:
+                # embeddings com tamanhos diferentes dentro da mesma pessoa
+                continue
+            if embs.ndim != 2 or embs.shape[0] == 0:
+                continue
+            if dim is None:
+                dim = embs.shape[1]
+            elif embs.shape[1] != dim:
+                continue
+            owners.append(np.full(embs.shape[0], len(uuids), dtype=np.int32))
+            uuids.append(pessoa["uuid"])
+            blocks.append(embs)
+
+        if not blocks:
+            return cls([], np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int32), **parametros)
+
+        matrix = normalize_rows(np.concatenate(blocks))
+        return cls(uuids, matrix, np.concatenate(owners), **parametros)
+
+    def _arrays(self) -> dict:
+        return {
+            "uuids": np.array(self.uuids, dtype=str),
+            "matrix": self.matrix,
+            "owners": self.owners,
+            "recencia": self.recencia,
+        }
+
+    def salvar(self, path: str, versao: int, **extras):
+        """
+        Grava a galeria em disco (.npz) junto com a versão da tag_video que ela
+        reflete; `extras` são arrays gravados no mesmo arquivo.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, versao=np.int64(versao), **extras, **self._arrays())
+        os.replace(tmp_path, path)  # troca atômica: outros processos nunca leem arquivo pela metade
+
+    @staticmethod
+    def _recencia_de(data):
+        # arquivos gravados antes da recência não têm o array
+        return data["recencia"] if "recencia" in data.files else None
+
+    @classmethod
+    def _from_arrays(cls, data, **parametros) -> "Galeria":
+        return cls(data["uuids"].tolist(), data["matrix"], data["owners"], cls._recencia_de(data), **parametros)
+
+    @classmethod
+    def carregar(cls, path: str, **parametros):
+        """Lê uma galeria gravada por `salvar`. Retorna (galeria, versão)."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls._from_arrays(data, **parametros), int(data["versao"])
+
+    def add_embedding(self, uuid_str: str, embedding) -> bool:
+        """
+        Anexa um embedding à pessoa (criando-a no fim da ordem de busca se for nova).
+        Retorna False se a dimensão não bater com a da galeria.
+        """
+        row = normalize_rows(np.asarray(embedding, dtype=np.float32))
+        if row.ndim != 1:
+            return False
+        if self.dim is None:
+            self._matrix = np.empty((16, row.shape[0]), dtype=np.float32)
+            self._owners = np.empty(16, dtype=np.int32)
+        elif row.shape[0] != self.dim:
+            return False
+
+        person = self._pos.get(uuid_str)
+        if person is None:
+            person = len(self.uuids)
+            self._pos[uuid_str] = person
+            self.uuids.append(uuid_str)
+            if person >= len(self._counts):
+                self._counts = np.concatenate([self._counts, np.zeros(max(16, person), dtype=np.int64)])
+                self._recencia = np.concatenate([self._recencia, np.zeros(max(16, person), dtype=np.float64)])
+
+        anexadas = self._size - self._n_base
+        if anexadas >= len(self._matrix):
+            matrix = np.empty((max(16, 2 * len(self._matrix)), self.dim), dtype=np.float32)
+            matrix[:anexadas] = self._matrix[:anexadas]
+            self._matrix = matrix
+        if self._size >= len(self._owners) or not self._owners.flags.writeable:
+            owners = np.empty(max(16, 2 * len(self._owners)), dtype=np.int32)
+            owners[:self._size] = self.owners
+            self._owners = owners
+
+        self._matrix[anexadas] = row
+        self._owners[self._size] = person
+        self._counts[person] += 1
+        self._size += 1
+        return True
+
+    def marcar_aparicao(self, uuid_str: str, instante: float):
+        """Atualiza a última aparição da pessoa (usada na ordem de busca)."""
+        person = self._pos.get(uuid_str)
+        if person is not None:
+            self._recencia[person] = max(self._recencia[person], instante)
+
+    def rows_of(self, uuid_str: str) -> np.ndarray:
+        """Índices das linhas da pessoa, na ordem em que foram gravadas."""
+        person = self._pos.get(uuid_str)
+        if person is None:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.owners == person)
+
+    def _linhas_alteradas(self, rows: np.ndarray):
+        """Gancho para índices: linhas existentes tiveram o conteúdo trocado."""
+
+    def substituir_embeddings(self, uuid_str: str, embeddings) -> bool:
+        """
+        Troca as linhas da pessoa pelas informadas (usado pela compactação, que
+        substitui exemplares e o centróide no lugar). A pessoa só pode crescer;
+        retorna False se a nova lista for menor ou tiver dimensão diferente, ou
+        se alguma linha da pessoa estiver na base somente leitura.
+        """
+        novas = np.asarray(embeddings, dtype=np.float32)
+        if novas.ndim != 2 or (self.dim is not None and novas.shape[1] != self.dim):
+            return False
+        rows = self.rows_of(uuid_str)
+        if len(novas) < len(rows) or (len(rows) and rows[0] < self._n_base):
+            return False
+
+        if len(rows):
+            self._matrix[rows - self._n_base] = normalize_rows(novas[:len(rows)])
+            self._linhas_alteradas(rows)
+        for embedding in novas[len(rows):]:
+            self.add_embedding(uuid_str, embedding)
+        return True
+
+    def _aproximada(self) -> bool:
+        """Gancho para índices: True quando `_candidatos` não devolve todas as linhas."""
+        return False
+
+    def _candidatos(self, query: np.ndarray):
+        """
+        Linhas a comparar com a consulta e suas distâncias. A busca exata
+        devolve (None, distâncias de todas as linhas); índices aproximados
+        devolvem só as linhas candidatas.
+        """
+        return None, self._distancias(query)
+
+    def _votar(self, rows, distances: np.ndarray, threshold: float, min_ratio: float):
+        """Votação sobre as linhas comparadas (`rows=None` = todas)."""
+        owners = self.owners if rows is None else self.owners[rows]
+        hits = distances < threshold
+
+        # linhas fora dos candidatos contam como "não casou" na votação
+        hit_counts = np.bincount(owners, weights=hits, minlength=len(self.uuids))
+        votes = np.flatnonzero((hit_counts / self.counts) >= min_ratio)
+        if not len(votes):
+            return None, None
+
+        # mais de uma pessoa na votação: vence a vista mais recentemente
+        person = int(votes[np.argmax(self.recencia[votes])])
+        sel = np.flatnonzero(owners == person)
+        if rows is not None:
+            sel = sel[np.argsort(rows[sel], kind="stable")]
+        running = np.cumsum(hits[sel])
+        trigger = hits[sel] & ((running / self.counts[person]) >= min_ratio)
+        pos = sel[int(np.argmax(trigger))]
+        return self.uuids[person], float(distances[pos])
+
+    def _votar_limiares(self, rows, distances: np.ndarray, thresholds, min_ratio: float, resultados: list):
+        """Vota, sobre as mesmas distâncias, cada limiar que ainda não tem vencedor em `resultados`."""
+        for i, threshold in enumerate(thresholds):
+            if resultados[i][0] is None:
+                resultados[i] = self._votar(rows, distances, threshold, min_ratio)
+
+    def _varrer(self, query: np.ndarray, thresholds, min_ratio: float, quentes_desde: float = None) -> list:
+        """
+        Busca exata da pessoa mais recente para a mais antiga, em blocos de
+        pessoas que dobram de tamanho. Os blocos seguem a ordem de desempate da
+        votação (recência decrescente, depois a ordem de `uuids`), então o
+        primeiro bloco com alguém na votação contém o vencedor da galeria inteira.
+        A varredura segue até todos os limiares terem vencedor (ou a galeria acabar).
+        """
+        total = len(self.uuids)
+        ordem = np.argsort(-self.recencia, kind="stable")
+        posto = np.empty(total, dtype=np.int64)
+        posto[ordem] = np.arange(total)
+        posto_linhas = posto[self.owners]
+
+        resultados = [(None, None)] * len(thresholds)
+        fim = int(np.count_nonzero(self.recencia >= quentes_desde)) if quentes_desde is not None else 0
+        fim = fim or min(BLOCO_RECENCIA, total)
+        inicio = 0
+        while inicio < total and any(uuid_str is None for uuid_str, _ in resultados):
+            if inicio == 0 and fim >= total:
+                rows, distances = None, self._distancias(query)
+            else:
+                rows = np.flatnonzero((posto_linhas >= inicio) & (posto_linhas < fim))
+                distances = self._distancias(query, rows)
+            self._votar_limiares(rows, distances, thresholds, min_ratio, resultados)
+            inicio, fim = fim, min(total, max(fim + BLOCO_RECENCIA, 2 * fim))
+        return resultados
+
+    def match(self, embedding, threshold: float, min_ratio: float = MIN_MATCH_RATIO, quentes_desde: float = None):
+        """
+        Procura a pessoa correspondente ao embedding.
+
+        Retorna (uuid, distância) ou (None, None). A distância é a do embedding
+        armazenado que completou a votação, na ordem em que foram gravados,
+        reproduzindo o valor que o laço com DeepFace.verify devolvia.
+
+        Com `quentes_desde`, compara primeiro só as pessoas vistas depois desse
+        instante e para ali se alguma atingir a votação.
+        """
+        return self.match_varios(embedding, [threshold], min_ratio, quentes_desde)[0]
+
+    def match_varios(self, embedding, thresholds, min_ratio: float = MIN_MATCH_RATIO,
+                     quentes_desde: float = None) -> list:
+        """
+        `match` para vários limiares de uma vez (ex.: as faixas da cascata): as
+        distâncias são calculadas uma vez só e cada limiar tem a sua votação.
+        Retorna um (uuid, distância) por limiar, na ordem dada.
+        """
+        resultados = [(None, None)] * len(thresholds)
+        query = np.asarray(embedding, dtype=np.float32)
+        if not len(self.uuids) or query.shape[-1] != self.dim:
+            return resultados
+
+        if not self._aproximada():
+            return self._varrer(query, thresholds, min_ratio, quentes_desde)
+
+        if quentes_desde is not None:
+            quentes = self.recencia >= quentes_desde
+            if quentes.any() and not quentes.all():
+                rows = np.flatnonzero(quentes[self.owners])
+                self._votar_limiares(rows, self._distancias(query, rows), thresholds, min_ratio, resultados)
+                if all(uuid_str is not None for uuid_str, _ in resultados):
+                    return resultados
+
+        rows, distances = self._candidatos(query)
+        self._votar_limiares(rows, distances, thresholds, min_ratio, resultados)
+        return resultados
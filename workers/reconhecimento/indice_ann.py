@@ -0,0 +1,185 @@
+"""
+Índice aproximado (IVF) para galerias grandes.
+
+A busca exata compara a face nova com todos os embeddings da tag_video. Aqui
+os embeddings são particionados em células por um k-means esférico; a busca
+compara a consulta com os centróides e só examina as `nprobe` células mais
+próximas. Embeddings fora dessas células contam como "não casou" na votação,
+que é a aproximação do índice.
+
+Galerias menores que `min_treino` embeddings continuam na busca exata.
+"""
+import logging
+import time
+
+import numpy as np
+
+from galeria import Galeria, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+def _atribuir(rows: np.ndarray, centroids: np.ndarray, bloco: int = 8192) -> np.ndarray:
+    """Índice do centróide mais próximo (maior produto interno) de cada linha, em blocos."""
+    cells = np.empty(len(rows), dtype=np.int32)
+    for ini in range(0, len(rows), bloco):
+        cells[ini:ini + bloco] = np.argmax(rows[ini:ini + bloco] @ centroids.T, axis=1)
+    return cells
+
+
+def kmeans_esferico(rows: np.ndarray, n_celulas: int, iteracoes: int = 10, seed: int = 0) -> np.ndarray:
+    """Centróides normalizados de um k-means por similaridade de cosseno."""
+    rng = np.random.default_rng(seed)
+    centroids = rows[rng.choice(len(rows), n_celulas, replace=False)].copy()
+    for _ in range(iteracoes):
+        cells = _atribuir(rows, centroids)
+        order = np.argsort(cells, kind="stable")
+        sizes = np.bincount(cells, minlength=n_celulas)
+        ocupadas = np.flatnonzero(sizes)
+        starts = np.concatenate([[0], np.cumsum(sizes[ocupadas])[:-1]])
+        centroids[ocupadas] = normalize_rows(np.add.reduceat(rows[order], starts, axis=0))
+        vazias = np.flatnonzero(sizes == 0)
+        if len(vazias):
+            centroids[vazias] = rows[rng.choice(len(rows), len(vazias), replace=False)]
+    return centroids
+
+
+class GaleriaIVF(Galeria):
+    """
+    Galeria com índice de arquivos invertidos.
+
+    Inserções incrementais vão para a célula do centróide mais próximo; quando
+    a galeria cresce `fator_retreino` vezes desde o último treino, os centróides
+    são recalculados.
+
+    - nprobe: células examinadas por consulta
+    - min_treino: abaixo desse total de embeddings, busca exata
+    """
+
+    def __init__(self, uuids: list, matrix: np.ndarray, owners: np.ndarray, recencia: np.ndarray = None,
+                 treinar: bool = True, nprobe: int = 8, min_treino: int = 20000, fator_retreino: int = 4):
+        super().__init__(uuids, matrix, owners, recencia)
+        self.nprobe = nprobe
+        self.min_treino = min_treino
+        self.fator_retreino = fator_retreino
+        self._centroids = None
+        self._cells = np.empty(len(self._owners), dtype=np.int32)
+        self._listas = []
+        self._tam_listas = None
+        self._treinado_com = 0
+        if treinar and self._size >= self.min_treino:
+            self.treinar()
+
+    @property
+    def treinado(self) -> bool:
+        return self._centroids is not None
+
+    @property
+    def n_celulas(self) -> int:
+        """Quantidade de células do índice (0 antes do treino)."""
+        return len(self._centroids) if self.treinado else 0
+
+    def _indexar(self, centroids: np.ndarray, cells: np.ndarray = None):
+        """Monta as listas invertidas a partir dos centróides (e das células, se já conhecidas)."""
+        if cells is None:
+            # bloco a bloco: uma base mapeada em memória não é copiada
+            cells = np.concatenate([_atribuir(parte, centroids) for parte in self._partes()])
+        self._centroids = centroids
+        self._cells = np.empty(len(self._owners), dtype=np.int32)
+        self._cells[:self._size] = cells
+
+        order = np.argsort(cells, kind="stable").astype(np.int32)
+        sizes = np.bincount(cells, minlength=len(centroids))
+        self._listas = [lista.copy() for lista in np.split(order, np.cumsum(sizes)[:-1])]
+        self._tam_listas = sizes.astype(np.int64)
+        self._treinado_com = self._size
+
+    def treinar(self):
+        """(Re)treina os centróides sobre uma amostra e redistribui todas as linhas."""
+        inicio = time.perf_counter()
+        n_celulas = min(int(np.clip(np.sqrt(self._size), 16, 4096)), self._size)
+        rng = np.random.default_rng(0)
+        amostra = self._linhas(np.sort(rng.choice(self._size, size=min(self._size, 64 * n_celulas), replace=False)))
+        self._indexar(kmeans_esferico(amostra, n_celulas))
+        logger.info(
+            f"🗂️ Índice IVF treinado: {self._size} embeddings em {n_celulas} células "
+            f"({(time.perf_counter() - inicio):.2f}s)"
+        )
+
+    def add_embedding(self, uuid_str: str, embedding) -> bool:
+        if not super().add_embedding(uuid_str, embedding):
+            return False
+        row = self._size - 1
+
+        if not self.treinado:
+            if self._size >= self.min_treino:
+                self.treinar()
+            return True
+        if self._size >= self.fator_retreino * self._treinado_com:
+            self.treinar()
+            return True
+
+        if len(self._cells) < len(self._owners):
+            cells = np.empty(len(self._owners), dtype=np.int32)
+            cells[:row] = self._cells[:row]
+            self._cells = cells
+        self._anexar(int(np.argmax(self._centroids @ self._linhas([row])[0])), row)
+        return True
+
+    def _anexar(self, cell: int, row: int):
+        self._cells[row] = cell
+        tam = self._tam_listas[cell]
+        if tam >= len(self._listas[cell]):
+            lista = np.empty(max(16, 2 * len(self._listas[cell])), dtype=np.int32)
+            lista[:tam] = self._listas[cell][:tam]
+            self._listas[cell] = lista
+        self._listas[cell][tam] = row
+        self._tam_listas[cell] += 1
+
+    def _remover(self, cell: int, row: int):
+        # a ordem dentro da lista não importa: troca pelo último
+        tam = self._tam_listas[cell]
+        lista = self._listas[cell]
+        pos = int(np.flatnonzero(lista[:tam] == row)[0])
+        lista[pos] = lista[tam - 1]
+        self._tam_listas[cell] -= 1
+
+    def _linhas_alteradas(self, rows: np.ndarray):
+        if not self.treinado:
+            return
+        novas = np.argmax(self._linhas(rows) @ self._centroids.T, axis=1)
+        for row, cell in zip(rows, novas):
+            if self._cells[row] != cell:
+                self._remover(int(self._cells[row]), int(row))
+                self._anexar(int(cell), int(row))
+
+    def _aproximada(self) -> bool:
+        return self.treinado
+
+    def _candidatos(self, query: np.ndarray):
+        if not self.treinado:
+            return super()._candidatos(query)
+
+        q = normalize_rows(query)
+        centroid_dist = 1.0 - self._centroids @ q
+        nprobe = min(self.nprobe, len(self._centroids))
+        probe = np.argpartition(centroid_dist, nprobe - 1)[:nprobe]
+        rows = np.concatenate([self._listas[c][:self._tam_listas[c]] for c in probe])
+        return rows, self._distancias(q, rows)
+
+    def _arrays(self) -> dict:
+        arrays = super()._arrays()
+        if self.treinado:
+            arrays["centroids"] = self._centroids
+            arrays["cells"] = self._cells[:self._size]
+        return arrays
+
+    @classmethod
+    def _from_arrays(cls, data, **parametros) -> "GaleriaIVF":
+        galeria = cls(data["uuids"].tolist(), data["matrix"], data["owners"], cls._recencia_de(data),
+                      treinar=False, **parametros)
+        if "centroids" in data.files:
+            galeria._indexar(data["centroids"], data["cells"])
+        elif galeria._size >= galeria.min_treino:
+            galeria.treinar()
+        return galeria
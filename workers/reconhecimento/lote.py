@@ -0,0 +1,155 @@
+"""
+Inferência de embeddings em micro-lotes.
+
+`DeepFace.represent` processa uma face por chamada e, em CPU, o custo fixo de
+cada chamada ao modelo domina. Aqui o pré-processamento continua por imagem,
+igual ao do `represent` (detecção com enforce_detection=False, alinhamento,
+redimensionamento e normalização "base"), mas o forward do modelo roda uma
+única vez para o lote inteiro.
+
+`EstatisticasLote` acumula, no processo principal, o tamanho dos lotes, a
+espera para formá-los, o tempo de inferência e a latência por mensagem, e
+registra um resumo periódico para ajustar RECONHECIMENTO_LOTE_MAX /
+RECONHECIMENTO_LOTE_ESPERA_MS conforme a carga de cada câmera.
+"""
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_modelos = {}
+
+
+def carregar_modelo(model_name: str):
+    """
+    Modelo do DeepFace carregado uma vez por processo. O DeepFace só é importado
+    aqui, para que processos que usam o serviço de embeddings não carreguem o
+    TensorFlow.
+    """
+    if model_name not in _modelos:
+        from deepface import DeepFace
+        _modelos[model_name] = DeepFace.build_model(model_name)
+    return _modelos[model_name]
+
+
+def aquecer_modelo(model_name: str, tamanhos_lote=(1,)) -> float:
+    """
+    Carrega o modelo e roda inferências de teste (uma por tamanho de lote), para
+    que a construção do grafo e a leitura dos pesos não caiam nas primeiras faces.
+    Retorna os segundos gastos.
+    """
+    inicio = time.monotonic()
+    carregar_modelo(model_name)
+    for tamanho in tamanhos_lote:
+        gerar_embeddings_lote([imagem_aquecimento()] * tamanho, model_name)
+    return time.monotonic() - inicio
+
+
+def imagem_aquecimento() -> np.ndarray:
+    """Recorte sintético (cinza uniforme) usado só para aquecer o modelo."""
+    return np.full((160, 160, 3), 128, dtype=np.uint8)
+
+
+def preparar_face(image_np: np.ndarray, model_name: str) -> np.ndarray:
+    """Mesmo pré-processamento do DeepFace.represent; retorna (1, h, w, 3)."""
+    from deepface.modules import detection, preprocessing
+
+    model = carregar_modelo(model_name)
+    img_objs = detection.extract_faces(
+        img_path=image_np,
+        detector_backend="opencv",
+        grayscale=False,
+        enforce_detection=False,
+        align=True,
+    )
+    img = img_objs[0]["face"][:, :, ::-1]  # rgb para bgr, como no represent
+    target_size = model.input_shape
+    img = preprocessing.resize_image(img=img, target_size=(target_size[1], target_size[0]))
+    return preprocessing.normalize_input(img=img, normalization="base")
+
+
+def gerar_embeddings_lote(images: list, model_name: str) -> list:
+    """
+    Embeddings de várias imagens (arrays NumPy) com um único forward do modelo.
+    Imagens que falham no pré-processamento recebem None.
+    """
+    model = carregar_modelo(model_name)
+    entradas, indices = [], []
+    for i, image_np in enumerate(images):
+        try:
+            entradas.append(preparar_face(image_np, model_name))
+            indices.append(i)
+        except Exception as e:
+            logger.error(f"❌ Erro ao preparar face para o lote: {e}")
+
+    embeddings = [None] * len(images)
+    if not entradas:
+        return embeddings
+
+    batch = np.concatenate(entradas, axis=0)
+    if hasattr(model, "model") and callable(model.model):
+        # modelos Keras: um forward para o lote inteiro
+        saida = np.asarray(model.model(batch, training=False))
+        vetores = [v.tolist() for v in saida.reshape(len(entradas), -1)]
+    else:
+        # modelos sem grafo Keras (ex.: Dlib, SFace) seguem face a face
+        vetores = [model.forward(e) for e in entradas]
+
+    for i, vetor in zip(indices, vetores):
+        embeddings[i] = vetor
+    return embeddings
+
+
+class EstatisticasLote:
+    """Contadores de vazão e latência do reconhecimento em lotes."""
+
+    def __init__(self, intervalo: float = 30.0):
+        self.intervalo = intervalo
+        self._zerar()
+
+    def _zerar(self):
+        self.inicio_janela = time.monotonic()
+        self.lotes = 0
+        self.faces = 0
+        self.espera_formacao = 0.0
+        self.inferencia = 0.0
+        self.latencias = []
+
+    def registrar(self, tamanho: int, espera_formacao: float, inferencia: float, latencias: list):
+        self.lotes += 1
+        self.faces += tamanho
+        self.espera_formacao += espera_formacao
+        self.inferencia += inferencia
+        self.latencias.extend(latencias)
+
+    def resumo(self) -> dict:
+        decorrido = max(time.monotonic() - self.inicio_janela, 1e-9)
+        lotes = max(self.lotes, 1)
+        latencias = np.array(self.latencias or [0.0]) * 1000
+        return {
+            "lotes": self.lotes,
+            "faces": self.faces,
+            "tamanho_medio_lote": self.faces / lotes,
+            "espera_formacao_ms": self.espera_formacao / lotes * 1000,
+            "inferencia_ms_lote": self.inferencia / lotes * 1000,
+            "inferencia_ms_face": self.inferencia / max(self.faces, 1) * 1000,
+            "latencia_media_ms": float(latencias.mean()),
+            "latencia_p95_ms": float(np.percentile(latencias, 95)),
+            "faces_por_segundo": self.faces / decorrido,
+        }
+
+    def talvez_relatar(self):
+        """Registra o resumo da janela a cada `intervalo` segundos e recomeça."""
+        if time.monotonic() - self.inicio_janela < self.intervalo or not self.lotes:
+            return
+        r = self.resumo()
+        logger.info(
+            f"📊 Lotes: {r['lotes']} | tamanho médio {r['tamanho_medio_lote']:.1f} | "
+            f"formação {r['espera_formacao_ms']:.1f} ms | "
+            f"inferência {r['inferencia_ms_lote']:.1f} ms/lote ({r['inferencia_ms_face']:.1f} ms/face) | "
+            f"latência média {r['latencia_media_ms']:.0f} ms, p95 {r['latencia_p95_ms']:.0f} ms | "
+            f"{r['faces_por_segundo']:.1f} faces/s"
+        )
+        self._zerar()
@@ -0,0 +1,97 @@
+"""
+Migração: move os embeddings dos documentos de `pessoas` para a coleção
+binária `embeddings` (ver repositorio_embeddings.py).
+
+Para cada pessoa com o campo `embeddings`, grava um documento por vetor no
+formato escolhido e remove `embeddings`/`centroide`/`total_embeddings` do
+documento da pessoa. Pessoas compactadas levam o centróide junto. Ao final
+incrementa a versão e a geração das galerias afetadas para que os workers
+recarreguem do zero (os embeddings das pessoas foram apagados e regravados).
+
+Uso:
+    python migrar_embeddings.py [--formato float16] [--tag-video A09] [--manter] [--dry-run]
+"""
+import argparse
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from cache_galerias import campo_versao
+from compactacao import Atualizacao
+from repositorio_embeddings import FORMATOS, RepositorioEmbeddings
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Migra embeddings de 'pessoas' para a coleção 'embeddings'.")
+    parser.add_argument("--formato", choices=FORMATOS, default=os.getenv("EMBEDDINGS_FORMATO", "float32"))
+    parser.add_argument("--modelo", default=os.getenv("MODEL_NAME"))
+    parser.add_argument("--tag-video")
+    parser.add_argument("--manter", action="store_true", help="não remove os campos antigos de 'pessoas'")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB_NAME")]
+    pessoas = db["pessoas"]
+    repositorio = RepositorioEmbeddings(db["embeddings"], args.modelo, args.formato)
+    repositorio.criar_indices()
+
+    filtro = {"embeddings": {"$exists": True, "$ne": []}}
+    if args.tag_video:
+        filtro["tag_video"] = args.tag_video
+
+    migradas, vetores, bytes_antes, bytes_depois = 0, 0, 0, 0
+    tag_videos = set()
+    cursor = pessoas.find(filtro, {"uuid": 1, "tag_video": 1, "embeddings": 1, "centroide": 1, "total_embeddings": 1})
+    for pessoa in cursor:
+        try:
+            embs = np.asarray(pessoa["embeddings"], dtype=np.float32)
+        except ValueError:
+            print(f"⚠️ Pessoa {pessoa['uuid']} ignorada: embeddings com tamanhos diferentes")
+            continue
+
+        migradas += 1
+        vetores += len(embs)
+        bytes_antes += embs.size * 12  # ~12 bytes por double em um array BSON
+        bytes_depois += embs.size * np.dtype(args.formato).itemsize
+        tag_videos.add(pessoa.get("tag_video"))
+        if args.dry_run:
+            continue
+
+        # reexecutar a migração não duplica vetores
+        repositorio.colecao.delete_many({"pessoa": pessoa["uuid"], "modelo": args.modelo})
+        if pessoa.get("centroide") is not None:
+            repositorio.gravar_pessoa(pessoa["uuid"], pessoa.get("tag_video"), Atualizacao(
+                slots={},
+                exemplares=embs,
+                centroide=np.asarray(pessoa["centroide"], dtype=np.float32),
+                total=pessoa.get("total_embeddings") or len(embs),
+                reescrever=True,
+            ), reescrever=True)
+        else:
+            repositorio.adicionar_varios(pessoa["uuid"], pessoa.get("tag_video"), embs)
+
+        if not args.manter:
+            pessoas.update_one(
+                {"_id": pessoa["_id"]},
+                {"$unset": {"embeddings": "", "centroide": "", "total_embeddings": ""}}
+            )
+
+    if not args.dry_run:
+        # contador do modelo como principal e como modelo rápido da cascata
+        for tag_video in tag_videos:
+            db["galerias"].update_one(
+                {"_id": tag_video}, {"$inc": {"versao": 1, "geracao": 1, campo_versao(args.modelo): 1}}, upsert=True
+            )
+
+    modo = "🔎 [dry-run] " if args.dry_run else "✅ "
+    print(
+        f"{modo}{migradas} pessoas, {vetores} embeddings migrados para '{args.formato}' "
+        f"(~{bytes_antes / 1e6:.1f} MB → ~{bytes_depois / 1e6:.1f} MB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
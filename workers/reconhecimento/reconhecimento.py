@@ -7,16 +7,30 @@ import cv2
 import numpy as np
 from PIL import Image
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from minio import Minio
-from deepface import DeepFace
+from minio.commonconfig import CopySource
 from minio.error import S3Error
 import hashlib
 import logging
+import queue
+import signal
 from dotenv import load_dotenv
-from concurrent.futures import ProcessPoolExecutor
-from multiprocessing import freeze_support
-from deepface.modules.verification import find_threshold
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from multiprocessing import Queue, freeze_support
+from multiprocessing.util import Finalize
+from armazem_mmap import MMAP_SUPORTADO
+from cache_embeddings import CacheEmbeddings
+from cache_galerias import CacheGalerias, campo_versao
+from cascata import Cascata, Decisao
+from compactacao import PoliticaReservatorio
+from galeria import Galeria
+from indice_ann import GaleriaIVF
+from lote import EstatisticasLote, aquecer_modelo, gerar_embeddings_lote, imagem_aquecimento
+from repositorio_embeddings import ConflitoGravacao, EstadoPessoa, RepositorioEmbeddings
 
 
 # -------------------------------
@@ -24,6 +38,8 @@ from deepface.modules.verification import find_threshold
 # -------------------------------
 load_dotenv()
 
+INICIO_WORKER = datetime.now().timestamp()  # base do tempo até o primeiro resultado
+
 TEMP_DIR = os.getenv("TEMP_DIR")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
@@ -40,8 +56,96 @@ QUEUE_NAME = os.getenv("QUEUE_NAME")
 MONGO_URI = os.getenv('MONGO_URI')
 MONGO_DB_NAME = os.getenv('MONGO_DB_NAME')
 MODEL_NAME = os.getenv('MODEL_NAME')
-#SIMILARITY_THRESHOLD = 0.30
-SIMILARITY_THRESHOLD = find_threshold(MODEL_NAME,  "cosine")
+
+# Serviço local de embeddings (servico_embeddings.py): quando configurado, o modelo
+# fica só no serviço e este worker não importa o DeepFace/TensorFlow
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+if EMBEDDING_SERVICE_URL:
+    from cliente_embeddings import ClienteEmbeddings
+    cliente_embeddings = ClienteEmbeddings(EMBEDDING_SERVICE_URL)
+    info_servico = cliente_embeddings.info()
+    if info_servico["modelo"] != MODEL_NAME:
+        raise RuntimeError(f"Serviço de embeddings usa {info_servico['modelo']}, worker espera {MODEL_NAME}")
+else:
+    from deepface.modules.verification import find_threshold
+    cliente_embeddings = None
+
+# Cascata (opcional): um modelo rápido decide os casos claros e MODEL_NAME só é
+# consultado quando a distância cai na faixa de incerteza em torno do limiar
+CASCATA_MODELO_RAPIDO = os.getenv("CASCATA_MODELO_RAPIDO")
+CASCATA_FAIXA = float(os.getenv("CASCATA_FAIXA", "0.15"))  # fração do limiar do modelo rápido
+GALERIA_CACHE_MAX = int(os.getenv("GALERIA_CACHE_MAX", "8"))  # tag_videos residentes por processo
+GALERIA_CACHE_TTL_OCIOSO = float(os.getenv("GALERIA_CACHE_TTL_OCIOSO", "600"))  # segundos
+
+# Índice aproximado (IVF) para galerias grandes — desligado por padrão
+ANN_ATIVO = os.getenv("ANN_ATIVO", "false").lower() in ("1", "true", "sim")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))  # células examinadas por consulta
+ANN_MIN_EMBEDDINGS = int(os.getenv("ANN_MIN_EMBEDDINGS", "20000"))  # abaixo disso, busca exata
+ANN_DIR = os.getenv("ANN_DIR")  # onde gravar/recarregar os índices (opcional)
+
+# Armazém de embeddings mapeado em memória (um diretório por modelo); só sem compactação
+GALERIA_MMAP_DIR = os.getenv("GALERIA_MMAP_DIR")
+if GALERIA_MMAP_DIR and not MMAP_SUPORTADO:
+    logger.warning("⚠️ GALERIA_MMAP_DIR ignorado: o armazém mapeado em memória requer POSIX (flock)")
+    GALERIA_MMAP_DIR = None
+
+# Pessoas vistas nos últimos N segundos são comparadas antes do resto da galeria (0 = desligado)
+GALERIA_JANELA_QUENTE = float(os.getenv("GALERIA_JANELA_QUENTE", "0"))
+
+# Tentativas de reservar a criação de uma pessoa nova antes de criar sem reserva
+MAX_TENTATIVAS_CRIACAO = int(os.getenv("MAX_TENTATIVAS_CRIACAO", "5"))
+
+# Formato dos vetores na coleção `embeddings`: float32, float16 ou int8
+EMBEDDINGS_FORMATO = os.getenv("EMBEDDINGS_FORMATO", "float32")
+
+# Compactação: até K exemplares + centróide por pessoa (0 = guarda todos os embeddings)
+GALERIA_MAX_EXEMPLARES = int(os.getenv("GALERIA_MAX_EXEMPLARES", "0"))
+
+# Memoização de embeddings por hash do recorte (0 = desligada); EMBEDDING_CACHE_DIR ativa o nível em disco
+EMBEDDING_CACHE_MAX = int(os.getenv("EMBEDDING_CACHE_MAX", "10000"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "3600"))  # segundos
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+
+# Micro-lotes: até B faces ou T ms de espera por forward do modelo
+RECONHECIMENTO_LOTE_MAX = int(os.getenv("RECONHECIMENTO_LOTE_MAX", "8"))
+RECONHECIMENTO_LOTE_ESPERA_MS = float(os.getenv("RECONHECIMENTO_LOTE_ESPERA_MS", "20"))
+ESTATISTICAS_INTERVALO = float(os.getenv("ESTATISTICAS_INTERVALO", "30"))  # segundos entre resumos
+
+# Paralelismo: processos do pool e mensagens em voo (prefetch) — por padrão um lote cheio por processo
+RECONHECIMENTO_WORKERS = int(os.getenv("RECONHECIMENTO_WORKERS", "4"))
+RECONHECIMENTO_PREFETCH = int(os.getenv(
+    "RECONHECIMENTO_PREFETCH", str(RECONHECIMENTO_WORKERS * RECONHECIMENTO_LOTE_MAX)
+))
+
+# Sharding por tag_video: o worker de detecção publica as faces de cada tag_video
+# sempre na mesma fila '<QUEUE_NAME>.<shard>' e cada worker de reconhecimento
+# consome um subconjunto fixo de shards, mantendo quentes só essas galerias
+RECONHECIMENTO_SHARDS = int(os.getenv("RECONHECIMENTO_SHARDS", "0"))  # 0 = fila única QUEUE_NAME
+RECONHECIMENTO_SHARD_IDS = os.getenv("RECONHECIMENTO_SHARD_IDS")  # ex.: "0,2"; padrão: todos os shards
+if RECONHECIMENTO_SHARDS > 0:
+    shards_proprios = (
+        sorted({int(s) for s in RECONHECIMENTO_SHARD_IDS.split(",") if s.strip()})
+        if RECONHECIMENTO_SHARD_IDS else list(range(RECONHECIMENTO_SHARDS))
+    )
+    if any(not 0 <= s < RECONHECIMENTO_SHARDS for s in shards_proprios):
+        raise ValueError(f"RECONHECIMENTO_SHARD_IDS fora de 0..{RECONHECIMENTO_SHARDS - 1}: {RECONHECIMENTO_SHARD_IDS}")
+    FILAS_ENTRADA = [f"{QUEUE_NAME}.{s}" for s in shards_proprios]
+else:
+    FILAS_ENTRADA = [QUEUE_NAME]
+# um consumidor ativo por shard (os demais ficam de reserva): duas instâncias nunca
+# criam identidades na mesma galeria ao mesmo tempo
+ARGS_FILA_SHARD = {"x-single-active-consumer": True}
+
+# Faces marcadas pelo filtro de qualidade da detecção (DETECCAO_QUALIDADE=marcar)
+# chegam em '<fila>.baixa'. Não há consumidor nessas filas: a cada intervalo, se
+# nada estiver em voo nem em formação, o worker puxa um lote delas com basic_get.
+FILAS_BAIXA_PRIORIDADE = [f"{fila}.baixa" for fila in FILAS_ENTRADA]
+BAIXA_PRIORIDADE_INTERVALO_MS = float(os.getenv("RECONHECIMENTO_BAIXA_PRIORIDADE_INTERVALO_MS", "500"))
+
+# Aquecimento: cada processo do pool carrega os modelos e roda uma inferência de
+# teste antes de o worker começar a consumir
+RECONHECIMENTO_AQUECER = os.getenv("RECONHECIMENTO_AQUECER", "true").lower() in ("1", "true", "sim")
+AQUECIMENTO_TIMEOUT = float(os.getenv("AQUECIMENTO_TIMEOUT", "300"))  # segundos
 
 print(MODEL_NAME)
 
@@ -50,6 +154,7 @@ client = MongoClient(MONGO_URI)
 db = client[MONGO_DB_NAME]
 pessoas = db["pessoas"]
 presencas = db["presencas"]
+galerias = db["galerias"]  # contador de versão da galeria de cada tag_video
 
 
 # -------------------------------
@@ -63,6 +168,11 @@ try:
         background=True  # cria em background, sem travar o banco
     )
     logger.info("✅ Índice 'idx_tag_video_lastappearance' verificado/criado com sucesso.")
+    RepositorioEmbeddings(db["embeddings"], MODEL_NAME, EMBEDDINGS_FORMATO).criar_indices()
+    logger.info("✅ Índices da coleção 'embeddings' verificados/criados com sucesso.")
+    # uuid único: upserts concorrentes da mesma pessoa não geram documentos duplicados
+    pessoas.create_index("uuid", name="idx_uuid", unique=True, background=True)
+    logger.info("✅ Índice 'idx_uuid' verificado/criado com sucesso.")
 except Exception as e:
     logger.error(f"❌ Erro ao criar índice MongoDB: {e}")
 
@@ -81,36 +191,127 @@ if not minio_client.bucket_exists(BUCKET_RECONHECIMENTO):
 # Conexão ao RabbitMQ
 connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
 channel = connection.channel()
-channel.queue_declare(queue=QUEUE_NAME, durable=True)
+for fila in FILAS_ENTRADA:
+    channel.queue_declare(queue=fila, durable=True, arguments=ARGS_FILA_SHARD if RECONHECIMENTO_SHARDS > 0 else None)
+for fila in FILAS_BAIXA_PRIORIDADE:
+    channel.queue_declare(queue=fila, durable=True)
 channel.queue_declare(queue="reconhecimentos", durable=True)  # Fila de saída
 
+
+def limiar_do_modelo(modelo: str) -> float:
+    if cliente_embeddings is not None:
+        return cliente_embeddings.info(modelo)["threshold"]
+    #return 0.30
+    return find_threshold(modelo, "cosine")
+
+
+class RecursosModelo:
+    """Limiar, embeddings gravados, galerias residentes e memoização de um modelo."""
+
+    def __init__(self, modelo: str, campo_versao_galeria: str = "versao"):
+        self.modelo = modelo
+        self.threshold = limiar_do_modelo(modelo)
+        self.repositorio = RepositorioEmbeddings(db["embeddings"], modelo, EMBEDDINGS_FORMATO, pessoas)
+        # Galerias de embeddings residentes (uma instância por processo do pool)
+        self.cache_galerias = CacheGalerias(
+            self.repositorio,
+            galerias,
+            GALERIA_CACHE_MAX,
+            GALERIA_CACHE_TTL_OCIOSO,
+            classe_galeria=GaleriaIVF if ANN_ATIVO else Galeria,
+            parametros_galeria={"nprobe": ANN_NPROBE, "min_treino": ANN_MIN_EMBEDDINGS} if ANN_ATIVO else None,
+            dir_persistencia=os.path.join(ANN_DIR, modelo) if ANN_DIR else None,
+            campo_versao=campo_versao_galeria,
+            dir_mmap=os.path.join(GALERIA_MMAP_DIR, modelo) if GALERIA_MMAP_DIR and not GALERIA_MAX_EXEMPLARES else None,
+        )
+        self.cache_embeddings = CacheEmbeddings(
+            modelo,
+            EMBEDDING_CACHE_MAX,
+            EMBEDDING_CACHE_TTL,
+            dir_disco=EMBEDDING_CACHE_DIR,
+            intervalo_relatorio=ESTATISTICAS_INTERVALO,
+        ) if EMBEDDING_CACHE_MAX > 0 else None
+
+
+# MODEL_NAME é sempre o modelo da identidade; com a cascata, o modelo rápido
+# é o primeiro estágio (micro-lotes, reserva de criação) e tem galeria própria
+recursos_pesado = RecursosModelo(MODEL_NAME)
+recursos_rapido = RecursosModelo(CASCATA_MODELO_RAPIDO, campo_versao(CASCATA_MODELO_RAPIDO)) if CASCATA_MODELO_RAPIDO else None
+recursos_primeiro = recursos_rapido or recursos_pesado
+recursos_por_modelo = {r.modelo: r for r in (recursos_pesado, recursos_rapido) if r is not None}
+cascata = Cascata(CASCATA_MODELO_RAPIDO, MODEL_NAME, CASCATA_FAIXA) if CASCATA_MODELO_RAPIDO else None
+print(f"Limiar {MODEL_NAME}: {recursos_pesado.threshold:.3f}")
+if cascata is not None:
+    print(f"Cascata: {CASCATA_MODELO_RAPIDO} (limiar {recursos_rapido.threshold:.3f}, faixa ±{CASCATA_FAIXA:.0%}) → {MODEL_NAME}")
+
+politica_compactacao = PoliticaReservatorio(GALERIA_MAX_EXEMPLARES) if GALERIA_MAX_EXEMPLARES > 0 else None
+if GALERIA_MMAP_DIR and politica_compactacao is not None:
+    logger.warning("⚠️ GALERIA_MMAP_DIR ignorado: o armazém mapeado em memória não suporta compactação")
+
 # Executor global (será inicializado na função main)
 executor = None
+# Nos processos do pool: grava a imagem e o documento da pessoa enquanto os
+# embeddings são gravados (coleções diferentes, sem dependência entre si).
+# As threads só nascem no primeiro submit, já dentro do processo filho.
+escritas_pessoa = ThreadPoolExecutor(max_workers=1)
+em_voo = 0  # mensagens entregues e ainda sem ack
+primeiro_resultado = None  # instante do primeiro lote concluído
+
+# Lote em formação no processo principal: [(delivery_tag, msg, inicio, espera)]
+lote_atual = []
+lote_iniciado_em = 0.0
+lote_timer = None
+estatisticas_lote = EstatisticasLote(ESTATISTICAS_INTERVALO)
 
 # -------------------------------
 # Funções Auxiliares
 # -------------------------------
 
-def cosine_distance(a: np.ndarray, b: np.ndarray) -> float:
-    # similaridade de cosseno: (a·b) / (||a|| * ||b||)
-    sim = np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-    # distância de cosseno = 1 - similaridade
-    return 1.0 - sim
-
-def generate_embedding(image: Image.Image):
-    """Gera o embedding facial usando DeepFace."""
+def generate_embedding(image: Image.Image, recursos: RecursosModelo = None):
+    """
+    Gera o embedding facial usando DeepFace (ou o serviço de embeddings),
+    reaproveitando o embedding memoizado quando o mesmo recorte já foi visto.
+    Por padrão usa o modelo do primeiro estágio.
+    """
+    recursos = recursos or recursos_primeiro
+    cache_embeddings = recursos.cache_embeddings
+    chave = None
+    if cache_embeddings is not None:
+        chave = get_face_hash(image)
+        embedding = cache_embeddings.get(chave)
+        cache_embeddings.talvez_relatar()
+        if embedding is not None:
+            return embedding
+
+    embedding = _generate_embedding(image, recursos.modelo)
+    if chave is not None:
+        cache_embeddings.put(chave, embedding)
+    return embedding
+
+def _generate_embedding(image: Image.Image, modelo: str):
     try:
+        if cliente_embeddings is not None:
+            image_bytes = BytesIO()
+            image.save(image_bytes, format="PNG")
+            return cliente_embeddings.gerar([image_bytes.getvalue()], modelo)[0]
+
+        from deepface import DeepFace
         image_np = np.array(image)
-        embeddings = DeepFace.represent(img_path=image_np, model_name=MODEL_NAME, enforce_detection=False)
+        embeddings = DeepFace.represent(img_path=image_np, model_name=modelo, enforce_detection=False)
         return embeddings[0]['embedding'] if embeddings else None
     except Exception as e:
-        logger.error(f"❌ Erro ao gerar embedding: {e}")
+        logger.error(f"❌ Erro ao gerar embedding ({modelo}): {e}")
         return None
 
 def get_image_hash(image_bytes):
     """Calcula o hash MD5 de uma imagem."""
     return hashlib.md5(image_bytes).hexdigest()
 
+def get_face_hash(image: Image.Image) -> str:
+    """Hash dos pixels do recorte (independe da codificação do arquivo)."""
+    cabecalho = f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode()
+    return get_image_hash(cabecalho + image.tobytes())
+
 def upload_image_to_minio(image: Image.Image, uuid_str: str) -> str:
     """Salva a imagem no MinIO e retorna seu caminho."""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S%f")
@@ -135,109 +336,205 @@ def upload_image_to_minio(image: Image.Image, uuid_str: str) -> str:
         logger.error(f"❌ Erro ao salvar no MinIO: {e}")
         return None
 
+def copy_face_in_minio(origem_path: str, uuid_str: str) -> str:
+    """
+    Copia o recorte de BUCKET_DETECCOES para BUCKET_RECONHECIMENTO no próprio MinIO
+    (cópia no servidor): os pixels são os mesmos, então não há reencode nem upload.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S%f")
+    extensao = os.path.splitext(origem_path)[1] or ".png"
+    minio_path = f"{uuid_str}/face_{timestamp}{extensao}"
+
+    try:
+        minio_client.copy_object(
+            BUCKET_RECONHECIMENTO,
+            minio_path,
+            CopySource(BUCKET_DETECCOES, origem_path)
+        )
+        logger.info(f"✅ Imagem copiada no MinIO: {origem_path} → {minio_path}")
+        return minio_path
+    except S3Error as e:
+        logger.error(f"❌ Erro ao copiar no MinIO: {e}")
+        return None
+
+def upsert_pessoa(uuid_str: str, tag_video: str, minio_path: str) -> dict:
+    """
+    Cria a pessoa (se ainda não existe), anexa o caminho da imagem e atualiza
+    `last_appearance` numa única operação atômica; retorna só as tags e a primeira foto.
+    """
+    atualizacao = {
+        "$setOnInsert": {"tags": [uuid_str], "tag_video": tag_video, "modelo_utilizado": MODEL_NAME},
+        "$max": {"last_appearance": datetime.now().timestamp()},
+    }
+    if minio_path:
+        atualizacao["$push"] = {"image_paths": minio_path}
+    else:
+        atualizacao["$setOnInsert"]["image_paths"] = []
+
+    for tentativa in range(2):
+        try:
+            return pessoas.find_one_and_update(
+                {"uuid": uuid_str},
+                atualizacao,
+                projection={"_id": 0, "tags": 1, "image_paths": {"$slice": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # dois upserts simultâneos da mesma pessoa nova: o segundo vira update
+            if tentativa:
+                raise
+
+def gravar_embedding(recursos: RecursosModelo, uuid_str: str, tag_video: str, embedding,
+                     pessoa_existente: bool, criacao: bool = False):
+    """Grava o embedding na coleção `embeddings` e publica a nova versão da galeria do modelo."""
+    # Embeddings ficam na coleção binária `embeddings`, fora do documento da pessoa
+    if politica_compactacao is None:
+        doc_id = recursos.repositorio.adicionar(uuid_str, tag_video, embedding)
+        recursos.cache_galerias.registrar_embedding(tag_video, uuid_str, embedding, criacao=criacao, doc_id=doc_id)
+        return
+
+    # Leitura + gravação condicional: se outro processo gravou a mesma pessoa no
+    # meio, a gravação é recusada inteira e a atualização é recalculada
+    for tentativa in range(MAX_TENTATIVAS_CRIACAO):
+        estado = recursos.repositorio.ler_pessoa(uuid_str) if pessoa_existente or tentativa else None
+        if estado is None:
+            # pessoa nova (ou ainda sem embeddings deste modelo)
+            estado = EstadoPessoa(np.empty((0, len(embedding)), dtype=np.float32), None, 0, True, None)
+        elif len(estado.exemplares) == 0 and estado.centroide is None:
+            estado = estado._replace(exemplares=np.empty((0, len(embedding)), dtype=np.float32), com_slots=True)
+        atualizacao = politica_compactacao.atualizar(estado.exemplares, estado.centroide, estado.total, embedding)
+        try:
+            recursos.repositorio.gravar_pessoa(
+                uuid_str, tag_video, atualizacao,
+                reescrever=atualizacao.reescrever or not estado.com_slots,
+                anterior=estado
+            )
+            break
+        except ConflitoGravacao:
+            logger.info(f"🔁 Pessoa {uuid_str} gravada por outro processo; recalculando a compactação")
+    else:
+        raise RuntimeError(f"Pessoa {uuid_str} muito disputada; embedding não gravado")
+    recursos.cache_galerias.registrar_pessoa(tag_video, uuid_str, PoliticaReservatorio.linhas(atualizacao), criacao=criacao)
+
+def gravar_face(image: Image.Image, origem_path: str, uuid_str: str, tag_video: str) -> tuple:
+    """Guarda o recorte no BUCKET_RECONHECIMENTO e faz o upsert da pessoa: (minio_path, pessoa)."""
+    # Copia o recorte dentro do MinIO (ou envia a imagem, se não houver origem)
+    minio_path = copy_face_in_minio(origem_path, uuid_str) if origem_path else None
+    if minio_path is None:
+        minio_path = upload_image_to_minio(image, uuid_str)
+
+    # Uma única ida ao MongoDB: cria a pessoa se preciso, anexa o caminho da imagem
+    # e devolve os campos da mensagem de saída
+    pessoa = upsert_pessoa(uuid_str, tag_video, minio_path)
+    logger.info("✅ Pessoa atualizada no MongoDB")
+    return minio_path, pessoa
+
 # -------------------------------
 # Processamento da Face com Embeddings
 # -------------------------------
-def process_face(image: Image.Image, tag_video: str) -> dict:
-    """Processa a imagem da face e realiza o reconhecimento."""
-    start_time = datetime.now().timestamp()
+def gerar_embedding_pesado(image: Image.Image) -> tuple:
+    """Embedding do modelo pesado da cascata para uma face ambígua: (embedding ou None, modelo)."""
+    return generate_embedding(image, recursos_pesado), recursos_pesado.modelo
+
+def casar_face(image: Image.Image, tag_video: str, embedding, quentes_desde: float = None,
+               tempo_embedding: float = 0.0, pesado: tuple = None) -> tuple:
+    """
+    Casa a face contra a galeria da tag_video. Retorna (Decisao, pesado): `pesado`
+    é o (embedding, modelo) do modelo pesado quando a cascata precisou dele, e deve
+    ser repassado se o casamento se repetir, para não gerar o embedding de novo.
+    """
+    # Casamento vetorizado: todas as distâncias de cosseno em uma única operação,
+    # começando pelas pessoas vistas há poucos segundos (conjunto quente)
+    galeria = recursos_primeiro.cache_galerias.get(tag_video)
+    if cascata is None:
+        uuid_str, distancia = galeria.match(embedding, recursos_primeiro.threshold, quentes_desde=quentes_desde)
+        return Decisao(uuid_str, distancia, {recursos_primeiro.modelo: embedding}, None), pesado
+
+    triagem = cascata.triagem(galeria, embedding, recursos_primeiro.threshold, quentes_desde, tempo_embedding)
+    if triagem.decisao is not None:
+        return triagem.decisao, pesado
+
+    # faixa de incerteza: segunda opinião do modelo pesado
+    inicio = datetime.now().timestamp()
+    if pesado is None:
+        pesado = gerar_embedding_pesado(image)
+    galeria_pesada = recursos_pesado.cache_galerias.get(tag_video) if pesado[0] is not None else None
+    decisao = cascata.decidir_pesado(
+        triagem, embedding, galeria_pesada, pesado, recursos_pesado.threshold,
+        quentes_desde, datetime.now().timestamp() - inicio
+    )
+    return decisao, pesado
+
+def process_face(image: Image.Image, tag_video: str, new_embedding=None, start_time=None,
+                 origem_path: str = None, tempo_embedding: float = 0.0) -> dict:
+    """
+    Processa a imagem da face e realiza o reconhecimento. Quando o embedding já
+    veio de um lote, `start_time` é o início do lote (o tempo inclui a inferência)
+    e `tempo_embedding` é a parcela desta face no forward.
+    Com `origem_path` (recorte em BUCKET_DETECCOES) a imagem é copiada no servidor
+    em vez de reenviada.
+    `new_embedding` é sempre do modelo do primeiro estágio (o rápido, com cascata).
+    """
+    start_time = start_time or datetime.now().timestamp()
     logger.info(f"Iniciando processamento da face em {start_time}")
 
-    new_embedding = generate_embedding(image)
+    if new_embedding is None:
+        inicio_embedding = datetime.now().timestamp()
+        new_embedding = generate_embedding(image)
+        tempo_embedding = datetime.now().timestamp() - inicio_embedding
     if new_embedding is None:
         logger.error("❌ Falha ao gerar o embedding da face.")
         return {"error": "Falha na geração do embedding"}
 
-    # Busca pessoas já cadastradas com imagens e embeddings
-    #known_people = list(pessoas.find({
-    #     "image_paths": {"$exists": True, "$ne": []},
-    #     "embeddings": {"$exists": True, "$ne": None, "$ne": []}
-    # }))
-
-    #known_people = list(
-    #pessoas.find({
-     #   "embeddings": {"$exists": True, "$ne": []}
-    #}).sort("last_appearance", -1)  # do mais recente para o mais antigo
-    #)
-
-    known_people = list(
-        pessoas.find({
-            "tag_video": tag_video,
-            "image_paths": {"$exists": True, "$ne": []},
-            "embeddings": {"$exists": True, "$ne": []}
-        })
-    )
-
-    match_found = False
-    matched_uuid = None
-    matched_distance = None
-
-    for pessoa in known_people:
-        person_uuid = pessoa["uuid"]
-        stored_embeddings = pessoa.get("embeddings", [])
-        total_imagens = len(stored_embeddings)
-        match_count = 0
-
-        for stored_embedding in stored_embeddings:
-            try:
-                result = DeepFace.verify(
-                    img1_path=new_embedding,
-                    img2_path=stored_embedding,
-                    enforce_detection=False,
-                    model_name=MODEL_NAME
-                )
-                
-                #dist_cos = cosine_distance(new_embedding, stored_embedding)
-                if result["distance"] < SIMILARITY_THRESHOLD:
-                #if dist_cos < SIMILARITY_THRESHOLD:
-                    match_count += 1
-                    logger.info(f"Match {match_count} encontrado para UUID: {person_uuid}")
-                    if (match_count / total_imagens) >= 0.2:
-                        match_found = True
-                        matched_uuid = person_uuid
-                        matched_distance = result["distance"]
-                        logger.info(f"✅ Face reconhecida - UUID: {matched_uuid}")
-                        break
-            except Exception as e:
-                logger.error(f"❌ Erro ao verificar embedding: {e}")
-
-        if match_found:
+    cache_galerias = recursos_primeiro.cache_galerias
+    quentes_desde = datetime.now().timestamp() - GALERIA_JANELA_QUENTE if GALERIA_JANELA_QUENTE > 0 else None
+
+    # Galeria da tag_video mantida em memória; só recarrega do MongoDB quando
+    # outro processo gravou embeddings desde a última consulta
+    decisao, pesado = casar_face(image, tag_video, new_embedding, quentes_desde, tempo_embedding)
+    matched_uuid, matched_distance = decisao.uuid, decisao.distancia
+    match_found = matched_uuid is not None
+
+    # Se não houver correspondência, reserva a criação de um novo usuário. A reserva
+    # falha se outro processo escreveu na galeria desde o casamento (ex.: criou a
+    # mesma pessoa); nesse caso recarrega e casa de novo antes de criar.
+    criacao = False
+    tentativas = 0
+    while not match_found:
+        novo_uuid = str(uuid.uuid4())
+        if cache_galerias.reservar_criacao(tag_video, cache_galerias.versao(tag_video), novo_uuid):
+            matched_uuid, criacao = novo_uuid, True
             break
+        tentativas += 1
+        if tentativas >= MAX_TENTATIVAS_CRIACAO:
+            logger.warning(f"⚠️ Galeria {tag_video} muito disputada; criando pessoa sem reserva")
+            matched_uuid = novo_uuid
+            break
+        cache_galerias.aguardar_criacao(tag_video)
+        decisao, pesado = casar_face(image, tag_video, new_embedding, quentes_desde, tempo_embedding, pesado)
+        matched_uuid, matched_distance = decisao.uuid, decisao.distancia
+        match_found = matched_uuid is not None
 
-    # Se não houver correspondência, cria um novo usuário
-    if not match_found:
-        matched_uuid = str(uuid.uuid4())
-        pessoas.insert_one({
-            "uuid": matched_uuid,
-            "image_paths": [],
-            "embeddings": [],
-            "tags": [matched_uuid],
-            "tag_video": tag_video
-        })
+    if match_found:
+        logger.info(f"✅ Face reconhecida - UUID: {matched_uuid}")
+    else:
         logger.info(f"🆕 Nova face cadastrada - UUID: {matched_uuid}")
 
-    # Envia a imagem para o MinIO e atualiza o MongoDB
-    minio_path = upload_image_to_minio(image, matched_uuid)
-    if minio_path:
-        pessoas.update_one(
-            {"uuid": matched_uuid},
-            {"$push": {"image_paths": minio_path}}
-           
-        )
-        logger.info("✅ Imagem atualizada no MongoDB")
-
-    #embedding = generate_embedding(image)
-    #if embedding:
-    pessoas.update_one(
-    {"uuid": matched_uuid},
-        {
-            "$push": {"embeddings": new_embedding}
-        }
-    )   
+    # Imagem e pessoa seguem em paralelo com os embeddings: o caminho crítico da
+    # face é o mais lento dos dois ramos, não a soma das idas ao MongoDB
+    face_gravada = escritas_pessoa.submit(gravar_face, image, origem_path, matched_uuid, tag_video)
+
+    # Um embedding por modelo consultado; o do primeiro estágio vai primeiro para
+    # liberar logo a reserva de criação
+    for modelo, embedding in decisao.embeddings.items():
+        recursos = recursos_por_modelo[modelo]
+        gravar_embedding(recursos, matched_uuid, tag_video, embedding, match_found,
+                         criacao=criacao and recursos is recursos_primeiro)
     logger.info("✅ Embedding atualizado no MongoDB")
 
-    pessoa = pessoas.find_one({"uuid": matched_uuid})
-    primary_photo = pessoa["image_paths"][0] if pessoa and pessoa.get("image_paths") else None
+    minio_path, pessoa = face_gravada.result()
+    primary_photo = pessoa["image_paths"][0] if pessoa.get("image_paths") else None
 
     finish_time = datetime.now().timestamp()
     processing_time = finish_time - start_time
@@ -250,7 +547,7 @@ def process_face(image: Image.Image, tag_video: str) -> dict:
         except Exception:
             similarity_value = None
 
-    return {
+    result = {
         "uuid": matched_uuid,
         "tags": pessoa.get("tags", []),
         "primary_photo": primary_photo,
@@ -260,14 +557,297 @@ def process_face(image: Image.Image, tag_video: str) -> dict:
         "tempo_processamento": processing_time,
         "similarity_value":  similarity_value
     }
+    if decisao.cascata is not None:
+        result["cascata"] = decisao.cascata
+    return result
+
+def baixar_face(minio_path: str) -> tuple:
+    """Bytes do recorte no MinIO e a imagem aberta pelo PIL."""
+    response = minio_client.get_object(BUCKET_DETECCOES, minio_path)
+    try:
+        dados = response.read()
+        return dados, Image.open(BytesIO(dados))
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def process_faces_minio(itens: list) -> tuple:
+    """
+    Executado no pool: baixa os recortes do lote dentro do próprio processo (só os
+    caminhos atravessam a fronteira entre processos), gera todos os embeddings com
+    um único forward do modelo e reconhece cada face.
+
+    Retorna (resultados na ordem dos itens, segundos gastos na inferência).
+    """
+    start_time = datetime.now().timestamp()
+    resultados = [None] * len(itens)
+    images = [None] * len(itens)
+    dados = [None] * len(itens)
+    for i, (minio_path, _) in enumerate(itens):
+        try:
+            dados[i], images[i] = baixar_face(minio_path)
+        except Exception as e:
+            logger.error(f"❌ Erro ao baixar {minio_path}: {e}")
+            resultados[i] = {"error": f"Falha ao baixar a imagem: {e}"}
+
+    validos = [i for i, image in enumerate(images) if image is not None]
+    embeddings = dict.fromkeys(validos)
+
+    # Recortes já vistos não passam pelo modelo (o do primeiro estágio)
+    modelo = recursos_primeiro.modelo
+    cache_embeddings = recursos_primeiro.cache_embeddings
+    chaves = {}
+    if cache_embeddings is not None:
+        for i in validos:
+            chaves[i] = get_face_hash(images[i])
+            embeddings[i] = cache_embeddings.get(chaves[i])
+        cache_embeddings.talvez_relatar()
+    faltantes = [i for i in validos if embeddings[i] is None]
+
+    inicio_inferencia = datetime.now().timestamp()
+    if faltantes:
+        try:
+            if cliente_embeddings is not None:
+                # o serviço junta este lote com os pedidos dos outros processos
+                gerados = cliente_embeddings.gerar([dados[i] for i in faltantes], modelo)
+            else:
+                gerados = gerar_embeddings_lote([np.array(images[i]) for i in faltantes], modelo)
+        except Exception as e:
+            logger.error(f"❌ Erro ao gerar embeddings do lote: {e}")
+            gerados = [None] * len(faltantes)
+        for i, embedding in zip(faltantes, gerados):
+            embeddings[i] = embedding
+            if i in chaves:
+                cache_embeddings.put(chaves[i], embedding)
+    tempo_inferencia = datetime.now().timestamp() - inicio_inferencia
+    tempo_por_face = tempo_inferencia / len(faltantes) if faltantes else 0.0
+
+    for i, embedding in embeddings.items():
+        if embedding is None:
+            resultados[i] = {"error": "Falha na geração do embedding"}
+            continue
+        try:
+            resultados[i] = process_face(
+                images[i], itens[i][1], embedding, start_time, origem_path=itens[i][0],
+                tempo_embedding=tempo_por_face if i in faltantes else 0.0
+            )
+        except Exception as e:
+            logger.error(f"❌ Erro no processamento: {e}")
+            resultados[i] = {"error": str(e)}
+    return resultados, tempo_inferencia
+
+# -------------------------------
+# Inicialização e Aquecimento do Pool
+# -------------------------------
+def salvar_galerias():
+    """Grava em disco as galerias residentes deste processo com inserções pendentes."""
+    for recursos in recursos_por_modelo.values():
+        recursos.cache_galerias.salvar_todas()
+
+
+def inicializar_processo(prontos: Queue = None):
+    """
+    Inicializador do pool. Os processos do pool saem sem rodar o atexit; um
+    Finalize com prioridade roda na saída normal (o executor encerrado pelo
+    processo principal), e grava as galerias. O SIGTERM é ignorado aqui: quem
+    coordena o encerramento é o processo principal. Com `prontos`, aquece.
+    """
+    Finalize(None, salvar_galerias, exitpriority=10)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if prontos is not None:
+        aquecer_processo(prontos)
+
+
+def aquecer_processo(prontos: Queue):
+    """
+    Inicializador do pool: constrói os modelos deste processo e roda uma inferência
+    de teste pelo mesmo caminho das faces reais (local em lote ou pelo serviço de
+    embeddings), depois avisa o processo principal em `prontos`.
+    """
+    inicio = datetime.now().timestamp()
+    erro = None
+    try:
+        for recursos in recursos_por_modelo.values():
+            if cliente_embeddings is not None:
+                # o serviço já sobe aquecido; isto carrega modelos extras (ex.: o da
+                # cascata) e abre a conexão keep-alive deste processo
+                image_bytes = BytesIO()
+                Image.fromarray(imagem_aquecimento()).save(image_bytes, format="PNG")
+                cliente_embeddings.gerar([image_bytes.getvalue()], recursos.modelo)
+            else:
+                aquecer_modelo(recursos.modelo, sorted({1, RECONHECIMENTO_LOTE_MAX}))
+    except Exception as e:
+        erro = str(e)
+    prontos.put((os.getpid(), datetime.now().timestamp() - inicio, erro))
+
+
+def aguardar_aquecimento(prontos: Queue):
+    """Sobe todos os processos do pool e espera cada um terminar o aquecimento."""
+    inicio = datetime.now().timestamp()
+    # tarefas vazias forçam a criação dos processos (o pool os cria sob demanda)
+    for _ in range(RECONHECIMENTO_WORKERS):
+        executor.submit(os.getpid)
+
+    for n in range(RECONHECIMENTO_WORKERS):
+        try:
+            pid, tempo, erro = prontos.get(timeout=AQUECIMENTO_TIMEOUT)
+        except queue.Empty:
+            logger.warning(
+                f"⚠️ Só {n} de {RECONHECIMENTO_WORKERS} processos aquecidos em {AQUECIMENTO_TIMEOUT:.0f}s; "
+                f"começando a consumir assim mesmo"
+            )
+            return
+        if erro:
+            logger.error(f"❌ Falha no aquecimento do processo {pid} ({tempo:.1f}s): {erro}")
+        else:
+            logger.info(f"🔥 Processo {pid} aquecido em {tempo:.1f}s")
+    logger.info(
+        f"✅ {RECONHECIMENTO_WORKERS} processos prontos em {datetime.now().timestamp() - inicio:.1f}s "
+        f"({datetime.now().timestamp() - INICIO_WORKER:.1f}s desde a subida do worker)"
+    )
 
 # -------------------------------
 # Consumidor de Mensagens com Paralelismo
 # -------------------------------
+def montar_mensagem_saida(msg: dict, result: dict, inicio_reconhecimento: float,
+                          tempo_espera_deteccao_reconhecimento: float) -> str:
+    """Mensagem publicada em 'reconhecimentos' a partir da entrada e do resultado."""
+    saida = {
+        "data_captura_frame": msg.get("data_captura_frame"),
+        "reconhecimento_path": result["reconhecimento_path"],
+        "uuid": result["uuid"],
+        "tags": result["tags"],
+        "inicio_processamento": msg.get("inicio_processamento"),
+        "tempo_captura_frame": msg.get("tempo_captura_frame"),
+        "tempo_deteccao": msg.get("tempo_deteccao"),
+        "tempo_reconhecimento": result["tempo_processamento"],
+        "tag_video": msg.get("tag_video"),
+        "timestamp": msg.get("timestamp"),
+        "frame_uuid": msg.get("frame_uuid"),
+        "frame_total_faces": msg.get("frame_total_faces"),
+        "fps": msg.get("fps"),
+        "duracao": msg.get("duracao"),
+        "tempo_espera_captura_deteccao": msg.get("tempo_espera_captura_deteccao", 0),
+        "tempo_espera_deteccao_reconhecimento": tempo_espera_deteccao_reconhecimento,
+        "inicio_reconhecimento": inicio_reconhecimento,
+        "fim_reconhecimento": datetime.now().timestamp(),
+        "similarity_value": result["similarity_value"],
+        "modelo": MODEL_NAME,  # modelo da identidade: chave da fonte no banco
+    }
+    if "cascata" in result:
+        # estágio que decidiu e tempo de cada estágio (só com a cascata ligada)
+        saida["cascata"] = result["cascata"]
+    if msg.get("qualidade"):
+        # avaliação de qualidade feita na detecção (se o filtro estiver ligado)
+        saida["qualidade"] = msg["qualidade"]
+    if msg.get("track_id"):
+        # rastreio da detecção: o banco atribui as continuações a esta identidade
+        saida["track_id"] = msg["track_id"]
+    return json.dumps(saida)
+
+
+def concluir(ch, delivery_tag, msg: dict, inicio_reconhecimento: float,
+             tempo_espera_deteccao_reconhecimento: float, result: dict):
+    """Publica o resultado de uma face e só então dá ack, mantendo at-least-once."""
+    minio_path = msg.get("minio_path")
+    try:
+        if "error" in result:
+            logger.error(f"❌ {result['error']}: {minio_path}")
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            return
+
+        output_msg = montar_mensagem_saida(msg, result, inicio_reconhecimento, tempo_espera_deteccao_reconhecimento)
+
+        # Envia para a fila "reconhecimentos"
+        ch.basic_publish(
+            exchange="",
+            routing_key="reconhecimentos",
+            body=output_msg,
+            properties=pika.BasicProperties(delivery_mode=2),
+        )
+        logger.info(f"✅ Reconhecimento enviado para fila 'reconhecimentos': {output_msg}")
+
+        ch.basic_ack(delivery_tag=delivery_tag)
+
+    except Exception as e:
+        logger.error(f"❌ Erro no processamento: {e}")
+        ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+
+
+def concluir_lote(ch, lote: list, espera_formacao: float, future):
+    """
+    Roda na thread da conexão (via add_callback_threadsafe) quando o pool termina
+    um lote: distribui os resultados para as mensagens e atualiza as estatísticas.
+    """
+    global em_voo, primeiro_resultado
+    em_voo -= len(lote)
+    try:
+        resultados, tempo_inferencia = future.result()
+    except BrokenProcessPool as e:
+        # Pool quebrado (processo morto): devolve as mensagens e encerra o consumo
+        logger.error(f"❌ Pool de processos quebrado, devolvendo {len(lote)} mensagens para a fila: {e}")
+        for delivery_tag, _, _, _ in lote:
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        ch.stop_consuming()
+        return
+    except Exception as e:
+        logger.error(f"❌ Erro no processamento do lote: {e}")
+        for delivery_tag, _, _, _ in lote:
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+        return
+
+    for (delivery_tag, msg, inicio, espera), result in zip(lote, resultados):
+        concluir(ch, delivery_tag, msg, inicio, espera, result)
+
+    if primeiro_resultado is None:
+        primeiro_resultado = datetime.now().timestamp()
+        logger.info(f"⏱ Primeiro resultado {primeiro_resultado - INICIO_WORKER:.1f}s após a subida do worker")
+
+    agora = datetime.now().timestamp()
+    estatisticas_lote.registrar(
+        len(lote), espera_formacao, tempo_inferencia,
+        [agora - inicio for _, _, inicio, _ in lote]
+    )
+    estatisticas_lote.talvez_relatar()
+
+
+def despachar_lote():
+    """Envia o lote em formação para o pool (lote cheio ou espera máxima atingida)."""
+    global lote_atual, lote_timer, em_voo
+    if lote_timer is not None:
+        connection.remove_timeout(lote_timer)
+        lote_timer = None
+    if not lote_atual:
+        return
+
+    lote, lote_atual = lote_atual, []
+    espera_formacao = datetime.now().timestamp() - lote_iniciado_em
+    try:
+        future = executor.submit(process_faces_minio, [(msg["minio_path"], msg.get("tag_video")) for _, msg, _, _ in lote])
+    except Exception as e:
+        logger.error(f"❌ Erro ao enviar lote para o pool: {e}")
+        for delivery_tag, _, _, _ in lote:
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        channel.stop_consuming()
+        return
+
+    em_voo += len(lote)
+    pronto = partial(concluir_lote, channel, lote, espera_formacao)
+    # O future conclui na thread do executor; pika só pode ser usado na thread da conexão
+    future.add_done_callback(lambda f: connection.add_callback_threadsafe(partial(pronto, f)))
+
+
 def callback(ch, method, properties, body):
+    """
+    Não bloqueia: valida a mensagem e a coloca no lote em formação. O lote vai para
+    o pool ao chegar a RECONHECIMENTO_LOTE_MAX faces ou após RECONHECIMENTO_LOTE_ESPERA_MS;
+    o prefetch limita quantas mensagens ficam em voo, e ack e publicação acontecem
+    em `concluir_lote`, na ordem em que os lotes ficam prontos.
+    """
+    global lote_iniciado_em, lote_timer
     try:
         msg = json.loads(body)
-        tempo_espera_captura_deteccao = msg.get("tempo_espera_captura_deteccao", 0)
         fim_deteccao = msg.get("fim_deteccao", datetime.now().timestamp())
         inicio_reconhecimento = datetime.now().timestamp()
         tempo_espera_deteccao_reconhecimento = inicio_reconhecimento - float(fim_deteccao or inicio_reconhecimento)
@@ -277,76 +857,62 @@ def callback(ch, method, properties, body):
             ch.basic_ack(delivery_tag=method.delivery_tag)
             return
 
-        logger.info(f"📩 Processando: {minio_path}")
-
-        # Baixar imagem do MinIO
-        response = minio_client.get_object(BUCKET_DETECCOES, minio_path)
-        image = Image.open(BytesIO(response.read()))
-
-        # Recupera outros dados da mensagem
-        inicio_processamento = msg.get("inicio_processamento")
-        tempo_captura_frame = msg.get("tempo_captura_frame")
-        tempo_deteccao = msg.get("tempo_deteccao")
-        data_captura_frame = msg.get("data_captura_frame")
-        timestamp = msg.get("timestamp")
-        tag_video = msg.get("tag_video")
-        frame_uuid = msg.get("frame_uuid")
-        frame_total_faces = msg.get("frame_total_faces")
-        fps = msg.get("fps")
-        duracao = msg.get("duracao")
-
-
-        # Envia o processamento da face para o pool de processos
-        future = executor.submit(process_face, image, tag_video)
-        result = future.result()
-
-        # Cria a mensagem de saída com os dados processados
-        output_msg = json.dumps({
-            "data_captura_frame": data_captura_frame,
-            "reconhecimento_path": result["reconhecimento_path"],
-            "uuid": result["uuid"],
-            "tags": result["tags"],
-            "inicio_processamento": inicio_processamento,
-            "tempo_captura_frame": tempo_captura_frame,
-            "tempo_deteccao": tempo_deteccao,
-            "tempo_reconhecimento": result["tempo_processamento"],
-            "tag_video": tag_video,
-            "timestamp": timestamp,
-            "frame_uuid": frame_uuid,
-            "frame_total_faces": frame_total_faces,
-            "fps": fps,
-            "duracao": duracao,
-            "tempo_espera_captura_deteccao": tempo_espera_captura_deteccao,
-            "tempo_espera_deteccao_reconhecimento": tempo_espera_deteccao_reconhecimento,
-            "inicio_reconhecimento": inicio_reconhecimento,
-            "fim_reconhecimento": datetime.now().timestamp(),
-            "similarity_value": result["similarity_value"]
-        })
+        logger.info(f"📩 Processando: {minio_path} ({em_voo + len(lote_atual) + 1} em voo)")
 
-        # Envia para a fila "reconhecimentos"
-        channel.basic_publish(
-            exchange="",
-            routing_key="reconhecimentos",
-            body=output_msg,
-            properties=pika.BasicProperties(delivery_mode=2),
-        )
-        logger.info(f"✅ Reconhecimento enviado para fila 'reconhecimentos': {output_msg}")
-
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if not lote_atual:
+            lote_iniciado_em = inicio_reconhecimento
+            lote_timer = connection.call_later(RECONHECIMENTO_LOTE_ESPERA_MS / 1000, despachar_lote)
+        lote_atual.append((method.delivery_tag, msg, inicio_reconhecimento, tempo_espera_deteccao_reconhecimento))
+        if len(lote_atual) >= RECONHECIMENTO_LOTE_MAX:
+            despachar_lote()
 
     except Exception as e:
         logger.error(f"❌ Erro no processamento: {e}")
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
+def buscar_baixa_prioridade():
+    """Com o worker ocioso, puxa até um lote das filas de baixa prioridade e reagenda."""
+    if em_voo == 0 and not lote_atual:
+        try:
+            for fila in FILAS_BAIXA_PRIORIDADE:
+                while em_voo == 0 and len(lote_atual) < RECONHECIMENTO_LOTE_MAX:
+                    method, properties, body = channel.basic_get(queue=fila)
+                    if method is None:
+                        break
+                    callback(channel, method, properties, body)
+        except Exception as e:
+            logger.error(f"❌ Erro ao buscar faces de baixa prioridade: {e}")
+    connection.call_later(BAIXA_PRIORIDADE_INTERVALO_MS / 1000, buscar_baixa_prioridade)
+
 # -------------------------------
 # Função Principal
 # -------------------------------
 def main():
     global executor
-    executor = ProcessPoolExecutor(max_workers=4)
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
-    print("🎯 Aguardando mensagens...")
-    channel.start_consuming()
+    prontos = Queue() if RECONHECIMENTO_AQUECER else None
+    executor = ProcessPoolExecutor(
+        max_workers=RECONHECIMENTO_WORKERS, initializer=inicializar_processo, initargs=(prontos,)
+    )
+    if prontos is not None:
+        aguardar_aquecimento(prontos)
+    # SIGTERM (docker stop): para de consumir e encerra o pool pelo caminho normal
+    signal.signal(signal.SIGTERM, lambda *_: connection.add_callback_threadsafe(channel.stop_consuming))
+    # global_qos: o limite de mensagens em voo vale para o canal, somando todos os shards
+    channel.basic_qos(prefetch_count=RECONHECIMENTO_PREFETCH, global_qos=len(FILAS_ENTRADA) > 1)
+    for fila in FILAS_ENTRADA:
+        channel.basic_consume(queue=fila, on_message_callback=callback)
+    connection.call_later(BAIXA_PRIORIDADE_INTERVALO_MS / 1000, buscar_baixa_prioridade)
+    print(
+        f"🎯 Aguardando mensagens de {', '.join(FILAS_ENTRADA)}... "
+        f"({RECONHECIMENTO_WORKERS} processos, até {RECONHECIMENTO_PREFETCH} em voo, "
+        f"lotes de até {RECONHECIMENTO_LOTE_MAX} faces / {RECONHECIMENTO_LOTE_ESPERA_MS:.0f} ms)"
+    )
+    try:
+        channel.start_consuming()
+    finally:
+        # Mensagens sem ack voltam para a fila quando a conexão fecha. Espera os
+        # lotes em andamento: os processos do pool gravam as galerias ao sair
+        executor.shutdown(wait=True, cancel_futures=True)
 
 if __name__ == '__main__':
     freeze_support()  # Necessário para Windows ou sistemas que usem spawn
@@ -0,0 +1,320 @@
+"""
+Repositório de embeddings em formato binário compacto.
+
+Os embeddings saem dos documentos de `pessoas` (listas de doubles BSON) e vão
+para a coleção `embeddings`, um documento por vetor:
+
+    {
+        "pessoa": <uuid>, "tag_video": ..., "modelo": <MODEL_NAME>,
+        "formato": "float32" | "float16" | "int8", "dim": 512,
+        "escala": <só int8>, "slot": <só com compactação>,
+        "vetor": <bytes do vetor empacotado>
+    }
+
+A leitura junta os bytes de todos os documentos e converte de uma vez com
+np.frombuffer, sem conversão elemento a elemento. Uma lista BSON de doubles
+gasta ~12 bytes por elemento (contando as chaves do array); float32 ocupa 4,
+float16 2 e int8 1 (com uma escala por vetor).
+"""
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+from bson.binary import Binary
+from pymongo import ASCENDING, DeleteMany, ReplaceOne, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from galeria import Galeria, normalize_rows
+
+FORMATOS = ("float32", "float16", "int8")
+SLOT_CENTROIDE = -1  # slot reservado ao centróide das pessoas compactadas
+
+# Documentos gravados até JANELA segundos "fora de ordem" (de _id ou criado_em)
+# ainda são vistos pelas sincronizações incrementais
+JANELA_SINCRONIZACAO = 10.0
+
+EstadoPessoa = namedtuple("EstadoPessoa", "exemplares centroide total com_slots id_centroide")
+# linhas de uma tag_video na ordem de gravação (usadas pelo armazém em disco)
+LinhasEmbeddings = namedtuple("LinhasEmbeddings", "ids pessoas matrix tempos")
+# até onde uma galeria carregada reflete a coleção: maior `criado_em` visto e
+# {_id: criado_em} dos documentos dentro da janela de sincronização antes dele
+Marco = namedtuple("Marco", "ate vistos")
+
+
+def empacotar(vetor, formato: str = "float32") -> dict:
+    """Campos do documento para um vetor no formato pedido."""
+    vetor = np.asarray(vetor, dtype=np.float32)
+    campos = {"formato": formato, "dim": int(vetor.shape[0])}
+    if formato == "float32":
+        dados = vetor
+    elif formato == "float16":
+        dados = vetor.astype(np.float16)
+    elif formato == "int8":
+        escala = float(np.abs(vetor).max()) / 127.0 or 1.0
+        dados = np.round(vetor / escala).astype(np.int8)
+        campos["escala"] = escala
+    else:
+        raise ValueError(f"Formato de embedding desconhecido: {formato}")
+    campos["vetor"] = Binary(dados.tobytes())
+    return campos
+
+
+def desempacotar(docs: list) -> np.ndarray:
+    """Matriz (N, D) float32 com os vetores dos documentos, na mesma ordem."""
+    if not docs:
+        return np.empty((0, 0), dtype=np.float32)
+
+    dim = docs[0]["dim"]
+    matrix = np.empty((len(docs), dim), dtype=np.float32)
+    grupos = {}
+    for i, doc in enumerate(docs):
+        grupos.setdefault(doc["formato"], []).append(i)
+
+    for formato, idx in grupos.items():
+        dados = b"".join(docs[i]["vetor"] for i in idx)
+        bloco = np.frombuffer(dados, dtype=np.dtype(formato)).reshape(len(idx), dim)
+        if formato == "int8":
+            escalas = np.array([docs[i]["escala"] for i in idx], dtype=np.float32)
+            bloco = bloco * escalas[:, None]
+        matrix[idx] = bloco
+    return matrix
+
+
+def marco_de(tempos, id_da_linha) -> Marco:
+    """Marco das linhas carregadas, a partir dos `criado_em` e do _id da linha i."""
+    tempos = np.asarray(tempos, dtype=np.float64)
+    if not len(tempos):
+        return Marco(0.0, {})
+    ate = float(tempos.max())
+    recentes = np.flatnonzero(tempos >= ate - JANELA_SINCRONIZACAO)
+    return Marco(ate, {id_da_linha(int(i)): float(tempos[i]) for i in recentes})
+
+
+class ConflitoGravacao(Exception):
+    """Outro processo gravou a pessoa entre a leitura do estado e a gravação."""
+
+
+class RepositorioEmbeddings:
+    """
+    Acesso à coleção `embeddings` para um modelo de reconhecimento.
+
+    Com `fonte_id`, o repositório é o de uma execução offline (reprocessar.py):
+    os documentos gravados levam o campo e as leituras por tag_video só veem os
+    dela. Sem ele, as leituras ignoram os embeddings das execuções offline, que
+    não fazem parte das galerias ao vivo.
+    """
+
+    projecao = {"pessoa": 1, "slot": 1, "formato": 1, "dim": 1, "escala": 1, "vetor": 1}
+
+    def __init__(self, colecao: Collection, modelo: str, formato: str = "float32", pessoas: Collection = None,
+                 fonte_id=None):
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato de embedding desconhecido: {formato}")
+        self.colecao = colecao
+        self.modelo = modelo
+        self.formato = formato
+        self.pessoas = pessoas  # coleção `pessoas`, fonte da recência (opcional)
+        self.fonte_id = fonte_id
+
+    def _escopo(self, **filtro) -> dict:
+        """Filtro restrito a este modelo e às galerias ao vivo (ou à execução `fonte_id`)."""
+        fonte = self.fonte_id if self.fonte_id is not None else {"$exists": False}
+        return {**filtro, "modelo": self.modelo, "fonte_id": fonte}
+
+    def criar_indices(self):
+        self.colecao.create_index(
+            [("tag_video", ASCENDING), ("modelo", ASCENDING), ("pessoa", ASCENDING)],
+            name="idx_tag_video_modelo_pessoa",
+            background=True
+        )
+        self.colecao.create_index(
+            [("pessoa", ASCENDING), ("modelo", ASCENDING), ("slot", ASCENDING)],
+            name="idx_pessoa_modelo_slot",
+            background=True
+        )
+        self.colecao.create_index(
+            [("tag_video", ASCENDING), ("modelo", ASCENDING), ("criado_em", ASCENDING)],
+            name="idx_tag_video_modelo_criado_em",
+            background=True
+        )
+
+    def _documento(self, pessoa: str, tag_video: str, vetor, slot=None) -> dict:
+        doc = {
+            "pessoa": pessoa,
+            "tag_video": tag_video,
+            "modelo": self.modelo,
+            "criado_em": datetime.now().timestamp(),
+            **empacotar(vetor, self.formato),
+        }
+        if slot is not None:
+            doc["slot"] = slot
+        if self.fonte_id is not None:
+            doc["fonte_id"] = self.fonte_id
+        return doc
+
+    def adicionar(self, pessoa: str, tag_video: str, vetor):
+        """Grava mais um embedding da pessoa (galeria sem compactação); retorna o _id."""
+        return self.colecao.insert_one(self._documento(pessoa, tag_video, vetor)).inserted_id
+
+    def adicionar_varios(self, pessoa: str, tag_video: str, vetores):
+        """Grava vários embeddings de uma vez (migração)."""
+        docs = [self._documento(pessoa, tag_video, v) for v in vetores]
+        if docs:
+            self.colecao.insert_many(docs, ordered=False)
+
+    def ler_pessoa(self, pessoa: str) -> EstadoPessoa:
+        """Exemplares (ordem dos slots), centróide e total de uma pessoa."""
+        docs = list(self.colecao.find(
+            {"pessoa": pessoa, "modelo": self.modelo},
+            {**self.projecao, "total": 1}
+        ).sort("_id", ASCENDING))
+
+        centroide, total, id_centroide = None, 0, None
+        exemplares = [d for d in docs if d.get("slot") != SLOT_CENTROIDE]
+        for doc in docs:
+            if doc.get("slot") == SLOT_CENTROIDE:
+                centroide = desempacotar([doc])[0]
+                total = doc.get("total", 0)
+                id_centroide = doc["_id"]
+        com_slots = all(d.get("slot") is not None for d in exemplares)
+        if com_slots:
+            exemplares.sort(key=lambda d: d["slot"])
+        return EstadoPessoa(desempacotar(exemplares), centroide, total, com_slots, id_centroide)
+
+    def gravar_pessoa(self, pessoa: str, tag_video: str, atualizacao, reescrever: bool = False,
+                      anterior: EstadoPessoa = None):
+        """
+        Aplica uma atualização da política de compactação (slots alterados e
+        centróide) em um único bulk_write. Com `reescrever`, todos os embeddings
+        da pessoa são substituídos.
+
+        Com `anterior` (o estado a partir do qual a atualização foi calculada) a
+        gravação é condicional: a primeira operação só atualiza o centróide se ele
+        ainda tiver o `total` lido. Se outro processo gravou antes, o upsert tenta
+        inserir um segundo documento com o mesmo _id, o bulk ordenado para ali sem
+        tocar nos slots e ConflitoGravacao é levantado — quem chamou relê e recalcula.
+        """
+        filtro = {"pessoa": pessoa, "modelo": self.modelo}
+        centroide = self._documento(pessoa, tag_video, atualizacao.centroide, SLOT_CENTROIDE)
+        centroide["total"] = atualizacao.total
+
+        ops = []
+        if anterior is not None:
+            # _id determinístico para o primeiro centróide: duas criações simultâneas colidem
+            id_centroide = anterior.id_centroide or f"{self.modelo}:{pessoa}:centroide"
+            ops.append(UpdateOne({"_id": id_centroide, "total": anterior.total}, {"$set": centroide}, upsert=True))
+        if reescrever:
+            ops.append(DeleteMany(filtro if anterior is None else {**filtro, "slot": {"$ne": SLOT_CENTROIDE}}))
+            slots = dict(enumerate(atualizacao.exemplares))
+        else:
+            slots = atualizacao.slots
+        for slot, vetor in slots.items():
+            doc = self._documento(pessoa, tag_video, vetor, slot)
+            ops.append(ReplaceOne({**filtro, "slot": slot}, doc, upsert=True))
+        if anterior is None:
+            ops.append(ReplaceOne({**filtro, "slot": SLOT_CENTROIDE}, centroide, upsert=True))
+
+        try:
+            self.colecao.bulk_write(ops, ordered=True)
+        except BulkWriteError as e:
+            erros = e.details.get("writeErrors", [])
+            if anterior is not None and erros and erros[0]["index"] == 0 and erros[0]["code"] == 11000:
+                raise ConflitoGravacao(pessoa) from e
+            raise
+
+    def carregar_por_pessoa(self, filtro: dict) -> dict:
+        """{uuid: matriz (n, D)} de todas as linhas que casam com o filtro."""
+        docs = list(self.colecao.find(self._escopo(**filtro), self.projecao).sort("_id", ASCENDING))
+        if not docs:
+            return {}
+        matrix = desempacotar(docs)
+        uuids, owners = np.unique([d["pessoa"] for d in docs], return_inverse=True)
+        order = np.argsort(owners, kind="stable")
+        blocos = np.split(matrix[order], np.cumsum(np.bincount(owners))[:-1])
+        return dict(zip(uuids.tolist(), blocos))
+
+    def carregar_galeria(self, tag_video: str, classe_galeria=Galeria, parametros_galeria: dict = None) -> Galeria:
+        """
+        Monta a galeria da tag_video: pessoas na ordem do primeiro embedding
+        gravado e, dentro de cada pessoa, linhas na ordem dos slots com o
+        centróide por último. A recência vem de `recencia`.
+        """
+        return self.carregar_sincronizado(tag_video, classe_galeria, parametros_galeria)[0]
+
+    def carregar_sincronizado(self, tag_video: str, classe_galeria=Galeria, parametros_galeria: dict = None) -> tuple:
+        """Como `carregar_galeria`, mas retorna (galeria, Marco) para as atualizações incrementais."""
+        docs = list(self.colecao.find(
+            self._escopo(tag_video=tag_video),
+            {**self.projecao, "criado_em": 1}
+        ).sort("_id", ASCENDING))
+        if not docs:
+            return classe_galeria.from_people([], **(parametros_galeria or {})), Marco(0.0, {})
+
+        matrix = desempacotar(docs)
+        primeira = {}
+        owners = np.fromiter(
+            (primeira.setdefault(d["pessoa"], len(primeira)) for d in docs),
+            dtype=np.int32, count=len(docs)
+        )
+        ordem_slot = np.array([
+            np.iinfo(np.int32).max if d.get("slot") == SLOT_CENTROIDE
+            else d.get("slot", i) for i, d in enumerate(docs)
+        ], dtype=np.int64)
+        order = np.lexsort((ordem_slot, owners))
+        tempos = np.array([d.get("criado_em", 0.0) for d in docs], dtype=np.float64)
+        recencia = np.zeros(len(primeira), dtype=np.float64)
+        np.maximum.at(recencia, owners, tempos)
+        galeria = classe_galeria(list(primeira), normalize_rows(matrix[order]), owners[order],
+                                 self.recencia(tag_video, list(primeira), recencia), **(parametros_galeria or {}))
+        return galeria, marco_de(tempos, lambda i: docs[i]["_id"])
+
+    def recencia(self, tag_video: str, uuids: list, recencia_embeddings: np.ndarray) -> np.ndarray:
+        """
+        Recência de cada pessoa (ordem de busca da galeria): o `last_appearance`
+        do documento em `pessoas`, que toda aparição atualiza. O `criado_em` dos
+        embeddings não serve sozinho — a migração grava todos com o instante em
+        que rodou — e só é usado sem a coleção ou para pessoas sem o campo.
+        """
+        if self.pessoas is None or not uuids:
+            return recencia_embeddings
+        ultima = {
+            d["uuid"]: d.get("last_appearance")
+            for d in self.pessoas.find({"tag_video": tag_video}, {"_id": 0, "uuid": 1, "last_appearance": 1})
+        }
+        return np.array([ultima.get(u) or r for u, r in zip(uuids, recencia_embeddings)], dtype=np.float64)
+
+    def contar(self, tag_video: str) -> int:
+        """Quantidade de embeddings da tag_video neste modelo."""
+        return self.colecao.count_documents(self._escopo(tag_video=tag_video))
+
+    def alteracoes_desde(self, tag_video: str, desde: float) -> list:
+        """
+        Documentos da tag_video gravados com `criado_em` >= `desde`, na ordem de
+        _id. Slots da compactação regravados no lugar também aparecem (o
+        `criado_em` é renovado a cada gravação).
+        """
+        filtro = self._escopo(tag_video=tag_video, criado_em={"$gte": desde})
+        return list(self.colecao.find(filtro, {**self.projecao, "criado_em": 1}).sort("_id", ASCENDING))
+
+    def ids_desde(self, tag_video: str, desde) -> list:
+        """_ids dos embeddings da tag_video com _id >= `desde` (sem trazer os vetores)."""
+        filtro = self._escopo(tag_video=tag_video, _id={"$gte": desde})
+        return [d["_id"] for d in self.colecao.find(filtro, {"_id": 1}).sort("_id", ASCENDING)]
+
+    def ler_linhas(self, tag_video: str, ids: list = None) -> LinhasEmbeddings:
+        """
+        Linhas da tag_video na ordem de `_id` (só as de `ids`, se dado), com os
+        vetores já normalizados.
+        """
+        filtro = self._escopo(tag_video=tag_video)
+        if ids is not None:
+            filtro["_id"] = {"$in": ids}
+        docs = list(self.colecao.find(filtro, {**self.projecao, "criado_em": 1}).sort("_id", ASCENDING))
+        matrix = normalize_rows(desempacotar(docs)) if docs else np.empty((0, 0), dtype=np.float32)
+        return LinhasEmbeddings(
+            [d["_id"] for d in docs],
+            [d["pessoa"] for d in docs],
+            matrix,
+            np.array([d.get("criado_em", 0.0) for d in docs], dtype=np.float64),
+        )
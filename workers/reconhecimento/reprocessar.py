@@ -0,0 +1,303 @@
+"""
+Re-reconhecimento offline de uma tag_video com outro modelo.
+
+As fontes são identificadas por (tag_video, modelo_utilizado), mas até aqui a
+única forma de avaliar um vídeo com outro modelo era capturá-lo de novo em
+tempo real. Este comando reaproveita os recortes já gravados:
+
+  1. lê as presenças de uma fonte existente (os recortes em BUCKET_RECONHECIMENTO),
+     na ordem em que foram processadas
+  2. divide-as em lotes; cada processo do pool baixa os recortes do seu lote em
+     paralelo e gera os embeddings com um único forward do modelo escolhido
+  3. refaz as identidades do zero, na ordem original, com o mesmo casamento do
+     worker (Galeria.match e o limiar do modelo)
+  4. copia no próprio MinIO cada recorte para `<modelo>/<pessoa>/...`, para que
+     as pessoas novas não dividam objetos com as da fonte original (apagar uma
+     delas pela API apagaria a foto da outra)
+  5. grava em lote as presenças, as pessoas (marcadas com `modelo_utilizado`)
+     e os embeddings, todos com o `fonte_id` da fonte nova (tag_video, modelo),
+     gravada por último; se algo falhar no meio, o que já foi gravado é removido
+
+Os embeddings reprocessados não entram nas galerias ao vivo: os workers (e a
+busca da API) ignoram os documentos com `fonte_id`, e o contador de versão da
+tag_video não é incrementado.
+
+As presenças novas copiam as da fonte original (tempos, frame, gold_standard)
+e apontam para a cópia do recorte; só a pessoa, a foto e a similaridade mudam.
+Os frames não são duplicados: o documento de frame é único por frame_uuid.
+
+    python reprocessar.py --tag-video A09 --modelo ArcFace [--fonte-origem <id>] [--workers 8]
+"""
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+from galeria import Galeria
+
+# Campos de métricas zerados na fonte nova (preenchidos depois pela API)
+METRICAS_FONTE = {
+    "true_positives": 0, "true_negatives": 0, "false_positives": 0, "false_negatives": 0,
+    "accuracy": None, "precision": None, "recall": None, "f1_score": None,
+    "covering": None, "inter_cluster_distance": None, "intra_cluster_distance": None,
+    "silhouette": None, "homogeneity": None, "completeness": None, "v_measure": None,
+    "time_to_complete_video_total_time": None, "auxiliary_db_size": None,
+}
+
+# Campos da presença original que não valem para o novo reconhecimento
+CAMPOS_RECALCULADOS = (
+    "_id", "pessoa", "tags", "fonte_id", "similarity_value", "cascata", "confusionCategory", "continuacao_rastreio",
+)
+
+# Estado de cada processo do pool (preenchido em `inicializar_processo`)
+_minio = None
+_bucket = None
+_modelo = None
+_downloads = None
+
+
+def inicializar_processo(endpoint: str, access_key: str, secret_key: str, bucket: str, modelo: str, downloads: int):
+    """Inicializador do pool: cliente MinIO e modelo carregados uma vez por processo."""
+    global _minio, _bucket, _modelo, _downloads
+    from minio import Minio
+    from lote import aquecer_modelo
+
+    _minio = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=False)
+    _bucket, _modelo = bucket, modelo
+    _downloads = ThreadPoolExecutor(max_workers=downloads)
+    aquecer_modelo(modelo)
+
+
+def _baixar(path: str):
+    from PIL import Image
+
+    response = _minio.get_object(_bucket, path)
+    try:
+        return np.array(Image.open(BytesIO(response.read())))
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def _baixar_ou_none(path: str):
+    try:
+        return _baixar(path)
+    except Exception as e:
+        print(f"❌ Erro ao baixar {path}: {e}")
+        return None
+
+
+def embeddings_do_lote(paths: list) -> tuple:
+    """Executado no pool: baixa os recortes em paralelo e gera os embeddings num forward."""
+    from lote import gerar_embeddings_lote
+
+    imagens = list(_downloads.map(_baixar_ou_none, paths))
+    validas = [i for i, imagem in enumerate(imagens) if imagem is not None]
+    inicio = time.monotonic()
+    gerados = gerar_embeddings_lote([imagens[i] for i in validas], _modelo) if validas else []
+    embeddings = [None] * len(paths)
+    for i, embedding in zip(validas, gerados):
+        embeddings[i] = embedding
+    return embeddings, time.monotonic() - inicio
+
+
+def reconstruir_identidades(embeddings: list, limiar: float) -> list:
+    """
+    Casa os embeddings na ordem original contra uma galeria que começa vazia,
+    como o worker faria. Retorna (uuid, distância ou None) por embedding, ou None
+    para os que falharam.
+    """
+    galeria = Galeria.from_people([])
+    resultado = []
+    for embedding in embeddings:
+        if embedding is None:
+            resultado.append(None)
+            continue
+        uuid_str, distancia = galeria.match(embedding, limiar)
+        if uuid_str is None:
+            uuid_str = str(uuid.uuid4())
+        galeria.add_embedding(uuid_str, embedding)
+        resultado.append((uuid_str, distancia))
+    return resultado
+
+
+def copiar_recorte(minio, bucket: str, path: str, modelo: str, uuid_str: str):
+    """Cópia server-side do recorte para o prefixo do modelo; None se falhar."""
+    from minio.commonconfig import CopySource
+
+    destino = f"{modelo}/{uuid_str}/{os.path.basename(path)}"
+    try:
+        minio.copy_object(bucket, destino, CopySource(bucket, path))
+        return destino
+    except Exception as e:
+        print(f"❌ Erro ao copiar {path}: {e}")
+        return None
+
+
+def main():
+    from bson import ObjectId
+    from dotenv import load_dotenv
+    from minio import Minio
+    from pymongo import MongoClient
+
+    from repositorio_embeddings import RepositorioEmbeddings
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Re-reconhece os recortes gravados de uma tag_video com outro modelo.")
+    parser.add_argument("--tag-video", required=True)
+    parser.add_argument("--modelo", required=True, help="modelo do DeepFace usado no reprocessamento")
+    parser.add_argument("--fonte-origem", help="fonte cujas presenças são reprocessadas (padrão: a mais recente de outro modelo)")
+    parser.add_argument("--limiar", type=float, help="padrão: limiar de cosseno do modelo no DeepFace")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="processos do pool")
+    parser.add_argument("--lote", type=int, default=32, help="recortes por forward do modelo")
+    parser.add_argument("--downloads", type=int, default=8, help="downloads simultâneos por processo")
+    args = parser.parse_args()
+
+    if args.limiar is None:
+        from deepface.modules.verification import find_threshold
+        args.limiar = find_threshold(args.modelo, "cosine")
+
+    db = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB_NAME")]
+    fontes, presencas, pessoas = db["fonte"], db["presencas"], db["pessoas"]
+
+    if fontes.find_one({"tag_video": args.tag_video, "modelo_utilizado": args.modelo}):
+        raise SystemExit(f"❌ Já existe fonte de {args.tag_video} com o modelo {args.modelo}")
+    if args.fonte_origem:
+        origem = fontes.find_one({"_id": ObjectId(args.fonte_origem)})
+    else:
+        origem = fontes.find_one(
+            {"tag_video": args.tag_video, "modelo_utilizado": {"$ne": args.modelo}}, sort=[("_id", -1)]
+        )
+    if not origem:
+        raise SystemExit(f"❌ Nenhuma fonte de origem encontrada para {args.tag_video}")
+
+    docs = list(presencas.find({"fonte_id": origem["_id"]}).sort([("inicio_processamento", 1), ("_id", 1)]))
+    docs = [d for d in docs if d.get("foto_captura")]
+    print(f"📂 {len(docs)} recortes da fonte {origem['_id']} ({origem.get('modelo_utilizado')}) → {args.modelo}")
+    if not docs:
+        return
+
+    # 1-2) embeddings em lotes no pool, devolvidos na ordem dos lotes
+    inicio = time.monotonic()
+    paths = [d["foto_captura"] for d in docs]
+    lotes = [paths[i:i + args.lote] for i in range(0, len(paths), args.lote)]
+    embeddings, tempo_inferencia = [], 0.0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=inicializar_processo,
+        initargs=(os.getenv("MINIO_ENDPOINT"), os.getenv("MINIO_ACCESS_KEY"), os.getenv("MINIO_SECRET_KEY"),
+                  os.getenv("BUCKET_RECONHECIMENTO"), args.modelo, args.downloads),
+    ) as executor:
+        for n, (gerados, tempo) in enumerate(executor.map(embeddings_do_lote, lotes), 1):
+            embeddings.extend(gerados)
+            tempo_inferencia += tempo
+            if n % 20 == 0 or n == len(lotes):
+                decorrido = time.monotonic() - inicio
+                print(f"⏱ {len(embeddings)}/{len(paths)} recortes ({len(embeddings) / decorrido:.1f} faces/s)")
+    tempo_embeddings = time.monotonic() - inicio
+
+    # 3) identidades refeitas do zero, na ordem original
+    identidades = reconstruir_identidades(embeddings, args.limiar)
+    falhas = sum(1 for r in identidades if r is None)
+    if falhas == len(identidades):
+        raise SystemExit(f"❌ Nenhum embedding gerado para os {len(paths)} recortes; nada foi gravado")
+    tempo_por_face = tempo_inferencia / max(len(paths) - falhas, 1)
+
+    # 4) cópias dos recortes por modelo/pessoa (a presença fica com o original se a cópia falhar)
+    bucket = os.getenv("BUCKET_RECONHECIMENTO")
+    minio = Minio(os.getenv("MINIO_ENDPOINT"), access_key=os.getenv("MINIO_ACCESS_KEY"),
+                  secret_key=os.getenv("MINIO_SECRET_KEY"), secure=False)
+    with ThreadPoolExecutor(max_workers=args.downloads) as copias:
+        copiados = list(copias.map(
+            lambda par: None if par[1] is None else copiar_recorte(minio, bucket, par[0]["foto_captura"], args.modelo, par[1][0]),
+            zip(docs, identidades),
+        ))
+
+    # 5) escrita em lote: presenças, pessoas e embeddings marcados com o _id da fonte
+    # nova, que só é gravada no fim (uma falha no meio desfaz o que já foi gravado)
+    fonte_id = ObjectId()
+    novas_presencas, por_pessoa = [], {}
+    for doc, embedding, identidade, copia in zip(docs, embeddings, identidades, copiados):
+        if identidade is None:
+            continue
+        uuid_str, distancia = identidade
+        pessoa = por_pessoa.setdefault(uuid_str, {"vetores": [], "paths": [], "ultima": 0.0})
+        pessoa["vetores"].append(embedding)
+        if copia:
+            pessoa["paths"].append(copia)
+        pessoa["ultima"] = max(pessoa["ultima"], float(doc.get("timestamp_final") or 0))
+
+        presenca = {k: v for k, v in doc.items() if k not in CAMPOS_RECALCULADOS}
+        presenca.update({
+            "pessoa": uuid_str,
+            "tags": [uuid_str],
+            "fonte_id": fonte_id,
+            "similarity_value": None if distancia is None else 1 - distancia,
+            "tempo_reconhecimento": tempo_por_face,
+            "confusionCategory": "N/A",
+            "presenca_origem": doc["_id"],
+            "foto_captura": copia or doc["foto_captura"],
+        })
+        novas_presencas.append(presenca)
+
+    # embeddings da execução offline: fora das galerias ao vivo (os workers filtram
+    # por `fonte_id`), então a versão das galerias da tag_video não muda
+    repositorio = RepositorioEmbeddings(
+        db["embeddings"], args.modelo, os.getenv("EMBEDDINGS_FORMATO", "float32"), fonte_id=fonte_id
+    )
+    try:
+        presencas.insert_many(novas_presencas, ordered=False)
+        pessoas.insert_many([
+            {
+                "uuid": uuid_str,
+                "tags": [uuid_str],
+                "tag_video": args.tag_video,
+                "image_paths": p["paths"],
+                "last_appearance": p["ultima"],
+                "modelo_utilizado": args.modelo,
+                "fonte_id": fonte_id,
+            }
+            for uuid_str, p in por_pessoa.items()
+        ], ordered=False)
+        for uuid_str, p in por_pessoa.items():
+            repositorio.adicionar_varios(uuid_str, args.tag_video, p["vetores"])
+
+        agora = time.time()
+        nova_fonte = {k: v for k, v in origem.items() if k != "_id"}
+        nova_fonte.update(METRICAS_FONTE)
+        nova_fonte.update({
+            "_id": fonte_id,
+            "modelo_utilizado": args.modelo,
+            "total_faces_analisadas": len(novas_presencas),
+            "total_clusters_gerados": len(por_pessoa),
+            "tempo_total_processamento": time.monotonic() - inicio,
+            "reprocessamento": {
+                "fonte_origem": origem["_id"],
+                "inicio": agora - (time.monotonic() - inicio),
+                "fim": agora,
+                "recortes": len(paths),
+                "falhas": falhas,
+                "workers": args.workers,
+                "tempo_embeddings": tempo_embeddings,
+                "faces_por_segundo": len(paths) / max(tempo_embeddings, 1e-9),
+            },
+        })
+        fontes.insert_one(nova_fonte)
+    except Exception:
+        print(f"❌ Falha ao gravar o reprocessamento; removendo o que foi gravado de {fonte_id}")
+        for colecao in (presencas, pessoas, db["embeddings"]):
+            colecao.delete_many({"fonte_id": fonte_id})
+        raise
+
+    print(
+        f"✅ Fonte {fonte_id}: {len(novas_presencas)} presenças, {len(por_pessoa)} pessoas, {falhas} falhas "
+        f"em {time.monotonic() - inicio:.1f}s ({len(paths) / max(tempo_embeddings, 1e-9):.1f} faces/s nos embeddings)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Serviço local de embeddings.
+
+Um único processo carrega o modelo do DeepFace e atende todos os clientes
+(processos do worker de reconhecimento, API) por HTTP local ou socket Unix,
+em vez de cada processo manter sua própria cópia do TensorFlow e do modelo.
+Os pedidos de todos os clientes entram na mesma fila e uma thread de
+inferência os junta em lotes (até EMBEDDING_SERVICE_LOTE_MAX imagens ou
+EMBEDDING_SERVICE_LOTE_ESPERA_MS de espera) antes do forward do modelo.
+
+Endpoints:
+    GET  /info[?modelo=X]  -> {"modelo", "threshold", "estatisticas"}
+    POST /embeddings       {"imagens": [<base64>, ...], "modelo": opcional}
+                           -> {"embeddings": [[...] | null, ...]}
+
+O modelo padrão é MODEL_NAME, carregado na subida; outros modelos (ex.: o
+modelo rápido da cascata) são carregados no primeiro pedido.
+
+Uso:
+    python servico_embeddings.py
+    (clientes com EMBEDDING_SERVICE_URL=http://127.0.0.1:8765 ou unix:///tmp/embeddings.sock)
+"""
+import base64
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image
+
+from lote import EstatisticasLote, aquecer_modelo, gerar_embeddings_lote
+
+# -------------------------------
+# Configurações
+# -------------------------------
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = os.getenv("MODEL_NAME")
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "http://127.0.0.1:8765")
+EMBEDDING_SERVICE_LOTE_MAX = int(os.getenv("EMBEDDING_SERVICE_LOTE_MAX", "32"))
+EMBEDDING_SERVICE_LOTE_ESPERA_MS = float(os.getenv("EMBEDDING_SERVICE_LOTE_ESPERA_MS", "10"))
+ESTATISTICAS_INTERVALO = float(os.getenv("ESTATISTICAS_INTERVALO", "30"))
+
+
+class Inferencia(threading.Thread):
+    """Única thread que usa o modelo: junta os pedidos de todos os clientes em lotes."""
+
+    def __init__(self, model_name: str, lote_max: int, espera_ms: float):
+        super().__init__(daemon=True)
+        self.model_name = model_name
+        self.lote_max = lote_max
+        self.espera = espera_ms / 1000
+        self.fila = queue.Queue()
+        self.estatisticas = EstatisticasLote(ESTATISTICAS_INTERVALO)
+
+    def enviar(self, imagens: list, modelo: str = None) -> list:
+        """Enfileira as imagens e retorna um Future por imagem."""
+        modelo = modelo or self.model_name
+        futuros = []
+        for image_np in imagens:
+            futuro = Future()
+            self.fila.put((modelo, image_np, futuro, time.monotonic()))
+            futuros.append(futuro)
+        return futuros
+
+    def _proximo_lote(self) -> list:
+        itens = [self.fila.get()]
+        limite = time.monotonic() + self.espera
+        while len(itens) < self.lote_max:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                itens.append(self.fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return itens
+
+    def run(self):
+        while True:
+            lote = self._proximo_lote()
+            por_modelo = {}
+            for item in lote:
+                por_modelo.setdefault(item[0], []).append(item)
+
+            # um forward por modelo presente no lote
+            for modelo, itens in por_modelo.items():
+                formacao = time.monotonic() - itens[0][3]
+                inicio = time.monotonic()
+                try:
+                    embeddings = gerar_embeddings_lote([image_np for _, image_np, _, _ in itens], modelo)
+                except Exception as e:
+                    logger.error(f"❌ Erro no lote de {len(itens)} imagens ({modelo}): {e}")
+                    for _, _, futuro, _ in itens:
+                        futuro.set_exception(e)
+                    continue
+
+                agora = time.monotonic()
+                for (_, _, futuro, _), embedding in zip(itens, embeddings):
+                    futuro.set_result(embedding)
+                self.estatisticas.registrar(len(itens), formacao, agora - inicio, [agora - t for _, _, _, t in itens])
+            self.estatisticas.talvez_relatar()
+
+
+def decodificar(imagem_b64: str):
+    """Mesma entrada do worker: np.array de uma imagem aberta pelo PIL."""
+    try:
+        return np.array(Image.open(BytesIO(base64.b64decode(imagem_b64))))
+    except Exception as e:
+        logger.error(f"❌ Imagem inválida: {e}")
+        return None
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: cada cliente reaproveita sua conexão
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/info":
+            return self._json(404, {"detail": "Não encontrado"})
+        modelo = parse_qs(url.query).get("modelo", [MODEL_NAME])[0]
+        self._json(200, {
+            "modelo": modelo,
+            "threshold": threshold(modelo),
+            "estatisticas": self.server.inferencia.estatisticas.resumo(),
+        })
+
+    def do_POST(self):
+        if self.path != "/embeddings":
+            return self._json(404, {"detail": "Não encontrado"})
+        try:
+            corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            imagens = [decodificar(b) for b in corpo["imagens"]]
+        except Exception as e:
+            return self._json(400, {"detail": f"Requisição inválida: {e}"})
+
+        validas = [i for i, image_np in enumerate(imagens) if image_np is not None]
+        futuros = self.server.inferencia.enviar([imagens[i] for i in validas], corpo.get("modelo"))
+        embeddings = [None] * len(imagens)
+        try:
+            for i, futuro in zip(validas, futuros):
+                embeddings[i] = futuro.result()
+        except Exception as e:
+            return self._json(500, {"detail": str(e)})
+        self._json(200, {"embeddings": embeddings})
+
+    def _json(self, status: int, dados: dict):
+        conteudo = json.dumps(dados).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def log_message(self, format, *args):
+        # client_address é vazio em socket Unix; o log padrão do http.server quebra
+        logger.debug(format % args)
+
+
+class ServidorUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def threshold(modelo: str) -> float:
+    from deepface.modules.verification import find_threshold
+    return find_threshold(modelo, "cosine")
+
+
+def criar_servidor(url: str):
+    destino = urlparse(url)
+    if destino.scheme == "unix":
+        if os.path.exists(destino.path):
+            os.remove(destino.path)
+        return ServidorUnix(destino.path, Handler)
+    if destino.scheme == "http":
+        return ThreadingHTTPServer((destino.hostname, destino.port or 80), Handler)
+    raise ValueError(f"EMBEDDING_SERVICE_URL inválida: {url}")
+
+
+def main():
+    tempo = aquecer_modelo(MODEL_NAME, sorted({1, EMBEDDING_SERVICE_LOTE_MAX}))
+    logger.info(f"✅ Modelo {MODEL_NAME} carregado e aquecido em {tempo:.1f}s")
+
+    inferencia = Inferencia(MODEL_NAME, EMBEDDING_SERVICE_LOTE_MAX, EMBEDDING_SERVICE_LOTE_ESPERA_MS)
+    inferencia.start()
+
+    servidor = criar_servidor(EMBEDDING_SERVICE_URL)
+    servidor.inferencia = inferencia
+    print(f"🎯 Serviço de embeddings ({MODEL_NAME}) em {EMBEDDING_SERVICE_URL}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("⏹ Encerrando serviço de embeddings...")
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Coleção do MongoDB em memória para os testes (só o que os módulos do worker usam).
+
+Filtros com igualdade, campos pontilhados, $and/$or e os operadores de
+comparação mais comuns; atualizações com $set/$unset/$inc/$max/$setOnInsert/$push;
+upsert, _id duplicado (DuplicateKeyError) e bulk_write ordenado.
+"""
+import copy
+from datetime import datetime
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo import DeleteMany, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_AUSENTE = object()
+
+
+def _valor(doc, campo):
+    for parte in campo.split("."):
+        if not isinstance(doc, dict) or parte not in doc:
+            return _AUSENTE
+        doc = doc[parte]
+    return doc
+
+
+def _ordem_bson(valor):
+    """Chave de ordenação na ordem de tipos do BSON (números < strings < ... < ObjectId)."""
+    if valor is _AUSENTE or valor is None:
+        return (0, 0)
+    if isinstance(valor, bool):
+        return (5, valor)
+    if isinstance(valor, (int, float)):
+        return (1, valor)
+    if isinstance(valor, str):
+        return (2, valor)
+    if isinstance(valor, ObjectId):
+        return (4, valor.binary)
+    if isinstance(valor, datetime):
+        return (6, valor)
+    return (3, repr(valor))
+
+
+def _compara(valor, condicao):
+    if not isinstance(condicao, dict) or not any(k.startswith("$") for k in condicao):
+        if condicao is None:
+            return valor is _AUSENTE or valor is None
+        return valor is not _AUSENTE and valor == condicao
+    for operador, argumento in condicao.items():
+        if operador == "$exists":
+            if (valor is not _AUSENTE) != bool(argumento):
+                return False
+        elif operador == "$in":
+            if not any(_compara(valor, a) for a in argumento):
+                return False
+        elif operador == "$nin":
+            if any(_compara(valor, a) for a in argumento):
+                return False
+        elif operador == "$ne":
+            if _compara(valor, argumento):
+                return False
+        elif operador in ("$lt", "$lte", "$gt", "$gte"):
+            if valor is _AUSENTE or valor is None or _ordem_bson(valor)[0] != _ordem_bson(argumento)[0]:
+                return False
+            a, b = _ordem_bson(valor)[1], _ordem_bson(argumento)[1]
+            if not {"$lt": a < b, "$lte": a <= b, "$gt": a > b, "$gte": a >= b}[operador]:
+                return False
+        else:
+            raise NotImplementedError(operador)
+    return True
+
+
+def casa(doc, filtro) -> bool:
+    for campo, condicao in filtro.items():
+        if campo == "$and":
+            if not all(casa(doc, f) for f in condicao):
+                return False
+        elif campo == "$or":
+            if not any(casa(doc, f) for f in condicao):
+                return False
+        elif not _compara(_valor(doc, campo), condicao):
+            return False
+    return True
+
+
+def _igualdades(filtro) -> dict:
+    """Campos de igualdade do filtro (o documento inicial de um upsert)."""
+    doc = {}
+    for campo, condicao in filtro.items():
+        if campo == "$and":
+            for f in condicao:
+                doc.update(_igualdades(f))
+        elif not campo.startswith("$") and not (isinstance(condicao, dict) and any(k.startswith("$") for k in condicao)):
+            doc[campo] = condicao
+    return doc
+
+
+def _atribuir(doc, campo, valor):
+    *caminho, ultimo = campo.split(".")
+    for parte in caminho:
+        doc = doc.setdefault(parte, {})
+    doc[ultimo] = valor
+
+
+def _aplicar(doc, atualizacao, inserindo: bool):
+    if not any(k.startswith("$") for k in atualizacao):
+        # substituição: mantém só o _id
+        _id = doc["_id"]
+        doc.clear()
+        doc.update(copy.deepcopy(atualizacao))
+        doc["_id"] = _id
+        return
+    for operador, campos in atualizacao.items():
+        for campo, valor in campos.items():
+            atual = _valor(doc, campo)
+            if operador == "$set" or (operador == "$setOnInsert" and inserindo):
+                _atribuir(doc, campo, copy.deepcopy(valor))
+            elif operador == "$unset" and atual is not _AUSENTE:
+                *caminho, ultimo = campo.split(".")
+                pai = _valor(doc, ".".join(caminho)) if caminho else doc
+                del pai[ultimo]
+            elif operador == "$inc":
+                _atribuir(doc, campo, (0 if atual is _AUSENTE else atual) + valor)
+            elif operador == "$max":
+                if atual is _AUSENTE or valor > atual:
+                    _atribuir(doc, campo, valor)
+            elif operador == "$push":
+                _atribuir(doc, campo, ([] if atual is _AUSENTE else atual) + [valor])
+            elif operador not in ("$set", "$setOnInsert", "$unset"):
+                raise NotImplementedError(operador)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, chave, direcao=1):
+        chaves = [(chave, direcao)] if isinstance(chave, str) else list(chave)
+        for campo, sentido in reversed(chaves):
+            self._docs.sort(key=lambda d: _ordem_bson(_valor(d, campo)), reverse=sentido < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self._docs)
+
+
+class ColecaoFalsa:
+    def __init__(self):
+        self.docs = {}  # _id -> documento, na ordem de inserção
+        self.consultas = 0  # leituras de documentos (find/find_one/count)
+
+    def _casados(self, filtro):
+        return [d for d in self.docs.values() if casa(d, filtro or {})]
+
+    def create_index(self, *args, **kwargs):
+        return kwargs.get("name")
+
+    def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError(f"_id duplicado: {doc['_id']}")
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    def insert_many(self, docs, ordered=True):
+        return SimpleNamespace(inserted_ids=[self.insert_one(d).inserted_id for d in docs])
+
+    def find(self, filtro=None, projecao=None):
+        self.consultas += 1
+        return Cursor([copy.deepcopy(d) for d in self._casados(filtro)])
+
+    def find_one(self, filtro=None, projecao=None):
+        self.consultas += 1
+        casados = self._casados(filtro)
+        return copy.deepcopy(casados[0]) if casados else None
+
+    def count_documents(self, filtro):
+        self.consultas += 1
+        return len(self._casados(filtro))
+
+    def _atualizar(self, filtro, atualizacao, upsert, varios=False):
+        casados = self._casados(filtro)
+        if not casados:
+            if not upsert:
+                return None, None
+            novo = _igualdades(filtro)
+            novo.setdefault("_id", ObjectId())
+            if novo["_id"] in self.docs:
+                raise DuplicateKeyError(f"_id duplicado: {novo['_id']}")
+            _aplicar(novo, atualizacao, inserindo=True)
+            self.docs[novo["_id"]] = novo
+            return None, novo
+        for doc in casados if varios else casados[:1]:
+            antes = copy.deepcopy(doc)
+            _aplicar(doc, atualizacao, inserindo=False)
+        return antes, doc
+
+    def find_one_and_update(self, filtro, atualizacao, projection=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        antes, depois = self._atualizar(filtro, atualizacao, upsert)
+        doc = depois if return_document == ReturnDocument.AFTER else antes
+        return copy.deepcopy(doc)
+
+    def update_one(self, filtro, atualizacao, upsert=False):
+        antes, depois = self._atualizar(filtro, atualizacao, upsert)
+        return SimpleNamespace(matched_count=int(antes is not None), upserted_id=None if antes else depois and depois["_id"])
+
+    def update_many(self, filtro, atualizacao, upsert=False):
+        n = len(self._casados(filtro))
+        self._atualizar(filtro, atualizacao, upsert, varios=True)
+        return SimpleNamespace(matched_count=n, modified_count=n)
+
+    def replace_one(self, filtro, doc, upsert=False):
+        return self.update_one(filtro, doc, upsert)
+
+    def delete_many(self, filtro):
+        casados = self._casados(filtro)
+        for doc in casados:
+            del self.docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(casados))
+
+    def bulk_write(self, operacoes, ordered=True):
+        for indice, op in enumerate(operacoes):
+            try:
+                if isinstance(op, DeleteMany):
+                    self.delete_many(op._filter)
+                elif isinstance(op, (UpdateOne, ReplaceOne)):
+                    self.update_one(op._filter, op._doc, upsert=op._upsert)
+                else:
+                    raise NotImplementedError(type(op).__name__)
+            except DuplicateKeyError as e:
+                raise BulkWriteError({"writeErrors": [{"index": indice, "code": 11000, "errmsg": str(e)}]}) from e
+
+
+class BancoFalso(dict):
+    """db["colecao"] cria a coleção na primeira vez."""
+
+    def __missing__(self, nome):
+        colecao = self[nome] = ColecaoFalsa()
+        return colecao
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import armazem_mmap
+from armazem_mmap import MMAP_SUPORTADO, ArmazemMmap
+from mongo_falso import BancoFalso
+from repositorio_embeddings import RepositorioEmbeddings
+
+pytestmark = pytest.mark.skipif(not MMAP_SUPORTADO, reason="armazém mapeado em memória requer POSIX")
+
+TAG = "camera-1"
+DIM = 8
+
+
+@pytest.fixture
+def repositorio():
+    db = BancoFalso()
+    return RepositorioEmbeddings(db["embeddings"], "Facenet", pessoas=db["pessoas"])
+
+
+def vetor(i):
+    v = np.zeros(DIM, dtype=np.float32)
+    v[i % DIM] = 1.0
+    return v
+
+
+def gravar(repositorio, n, inicio=0):
+    return [repositorio.adicionar(f"p{i}", TAG, vetor(i)) for i in range(inicio, inicio + n)]
+
+
+def test_reconstroi_e_outro_processo_mapeia_sem_copiar(repositorio, tmp_path):
+    gravar(repositorio, 3)
+    galeria, marco = ArmazemMmap(str(tmp_path), TAG).carregar_galeria(repositorio, TAG, 0)
+    assert len(galeria.owners) == 3 and len(marco.vistos) == 3
+
+    # outro processo: abre os mesmos arquivos, sem consultar os vetores no banco
+    outra, _ = ArmazemMmap(str(tmp_path), TAG).carregar_galeria(repositorio, TAG, 0)
+    assert isinstance(outra._base, np.memmap)
+    np.testing.assert_array_equal(outra.matrix, galeria.matrix)
+    assert outra.match(vetor(2), 0.1)[0] == "p2"
+
+
+def test_sincroniza_o_que_foi_gravado_por_outro_processo(repositorio, tmp_path):
+    gravar(repositorio, 3)
+    armazem = ArmazemMmap(str(tmp_path), TAG)
+    armazem.carregar_galeria(repositorio, TAG, 0)
+
+    gravar(repositorio, 2, inicio=3)  # sem `anexar`: só o MongoDB sabe
+    galeria, _ = armazem.carregar_galeria(repositorio, TAG, 0)
+    assert len(galeria.owners) == repositorio.contar(TAG) == 5
+    assert galeria.match(vetor(4), 0.1)[0] == "p4"
+
+
+def test_anexar_nao_duplica_documento_ja_sincronizado(repositorio, tmp_path):
+    a, b = ArmazemMmap(str(tmp_path), TAG), ArmazemMmap(str(tmp_path), TAG)
+    gravar(repositorio, 2)
+    a.carregar_galeria(repositorio, TAG, 0)
+
+    [doc_id] = gravar(repositorio, 1, inicio=2)
+    b.carregar_galeria(repositorio, TAG, 0)  # `b` traz o documento antes de `a` anexar
+    a.anexar(doc_id, "p2", vetor(2), time.time())
+    a.anexar(doc_id, "p2", vetor(2), time.time())
+    galeria, _ = b.carregar_galeria(repositorio, TAG, 0)
+    assert len(galeria.owners) == 3
+
+
+def test_contagem_divergente_reconstroi(repositorio, tmp_path, monkeypatch):
+    monkeypatch.setattr(armazem_mmap, "INTERVALO_CONTAGEM", 0.0)
+    gravar(repositorio, 3)
+    armazem = ArmazemMmap(str(tmp_path), TAG)
+    armazem.carregar_galeria(repositorio, TAG, 0)
+
+    repositorio.colecao.delete_many({"pessoa": "p1"})
+    galeria, _ = armazem.carregar_galeria(repositorio, TAG, 0)
+    assert "p1" not in galeria and len(galeria.owners) == 2
+
+
+def test_geracao_nova_troca_arquivos_sem_afetar_mapas_abertos(repositorio, tmp_path):
+    gravar(repositorio, 3)
+    antiga, _ = ArmazemMmap(str(tmp_path), TAG).carregar_galeria(repositorio, TAG, 0)
+    copia = np.array(antiga.matrix)
+
+    repositorio.colecao.delete_many({"pessoa": "p0"})
+    gravar(repositorio, 1, inicio=5)
+    nova, _ = ArmazemMmap(str(tmp_path), TAG).carregar_galeria(repositorio, TAG, 1)
+    assert "p0" not in nova and nova.match(vetor(5), 0.1)[0] == "p5"
+    # o mapa antigo continua no arquivo antigo (outro inode)
+    np.testing.assert_array_equal(antiga.matrix, copia)
+
+
+def test_trava_exclui_outro_processo(repositorio, tmp_path):
+    gravar(repositorio, 2)
+    a, b = ArmazemMmap(str(tmp_path), TAG), ArmazemMmap(str(tmp_path), TAG)
+    carregadas = []
+    with a._trava():
+        leitor = threading.Thread(target=lambda: carregadas.append(b.carregar_galeria(repositorio, TAG, 0)))
+        leitor.start()
+        leitor.join(0.2)
+        assert leitor.is_alive() and not carregadas  # flock de outro descritor bloqueia
+    leitor.join(5)
+    assert len(carregadas) == 1
+    a.fechar()
+    b.fechar()
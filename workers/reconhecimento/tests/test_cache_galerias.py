@@ -0,0 +1,224 @@
+import numpy as np
+import pytest
+
+import cache_galerias
+from cache_galerias import CacheGalerias
+from compactacao import PoliticaReservatorio
+from mongo_falso import BancoFalso
+from repositorio_embeddings import RepositorioEmbeddings
+
+TAG = "camera-1"
+DIM = 8
+
+
+@pytest.fixture
+def db():
+    return BancoFalso()
+
+
+def processo(db, **parametros):
+    """Um worker: repositório e cache próprios sobre o mesmo banco."""
+    repositorio = RepositorioEmbeddings(db["embeddings"], "Facenet", pessoas=db["pessoas"])
+    return CacheGalerias(repositorio, db["galerias"], **parametros)
+
+
+def vetor(i):
+    v = np.zeros(DIM, dtype=np.float32)
+    v[i % DIM] = 1.0
+    return v
+
+
+def gravar(cache, uuid_str, embedding, criacao=False):
+    """O caminho de gravar_embedding sem compactação: grava e publica a versão."""
+    doc_id = cache.repositorio.adicionar(uuid_str, TAG, embedding)
+    cache.registrar_embedding(TAG, uuid_str, embedding, criacao=criacao, doc_id=doc_id)
+
+
+def linhas_no_banco(db):
+    return db["embeddings"].count_documents({"tag_video": TAG})
+
+
+def test_versao_igual_nao_consulta_embeddings(db):
+    a = processo(db)
+    gravar(a, "p0", vetor(0))
+    a.get(TAG)
+    leituras = db["embeddings"].consultas
+    for _ in range(5):
+        a.get(TAG)
+    assert db["embeddings"].consultas == leituras
+    assert a.hits == 5 and a.recargas == 1
+
+
+def test_escrita_de_outro_processo_e_aplicada_sem_recarregar(db):
+    a, b = processo(db), processo(db)
+    for i in range(3):
+        gravar(a, f"p{i}", vetor(i))
+    assert len(b.get(TAG)) == 3 and b.recargas == 1
+
+    gravar(a, "p3", vetor(3))
+    gravar(a, "p0", vetor(0) + 0.01)
+    galeria = b.get(TAG)
+    assert b.recargas == 1 and b.atualizacoes == 1
+    assert galeria.match(vetor(3), 0.1)[0] == "p3"
+    assert len(galeria.owners) == linhas_no_banco(db) == 5
+    assert b.versao(TAG) == db["galerias"].find_one({"_id": TAG})["versao"]
+
+
+def test_escrita_propria_nao_e_duplicada_na_atualizacao(db):
+    a, b = processo(db), processo(db)
+    gravar(a, "p0", vetor(0))
+    a.get(TAG)
+    b.get(TAG)
+
+    gravar(a, "p1", vetor(1))  # aplicada no lugar em `a`
+    gravar(b, "p2", vetor(2))  # `b` não viu p1: a escrita dele fica para a atualização
+    assert len(b.get(TAG).owners) == 3
+    assert len(a.get(TAG).owners) == 3 == linhas_no_banco(db)
+    assert a.recargas == b.recargas == 1
+
+
+def test_geracao_nova_recarrega_tudo(db):
+    a = processo(db)
+    for i in range(3):
+        gravar(a, f"p{i}", vetor(i))
+    a.get(TAG)
+
+    # um job apaga p1 e incrementa versão e geração (como a consolidação)
+    db["embeddings"].delete_many({"pessoa": "p1"})
+    db["galerias"].update_one({"_id": TAG}, {"$inc": {"versao": 1, "geracao": 1}})
+    galeria = a.get(TAG)
+    assert a.recargas == 2 and a.atualizacoes == 0
+    assert "p1" not in galeria and len(galeria) == 2
+
+
+def test_contagem_divergente_recarrega(db, monkeypatch):
+    monkeypatch.setattr(cache_galerias, "INTERVALO_CONTAGEM", 0.0)
+    a, b = processo(db), processo(db)
+    gravar(a, "p0", vetor(0))
+    gravar(a, "p1", vetor(1))
+    b.get(TAG)
+
+    # remoção sem geração nova: só a conferência da contagem percebe
+    db["embeddings"].delete_many({"pessoa": "p1"})
+    gravar(a, "p2", vetor(2))
+    galeria = b.get(TAG)
+    assert b.recargas == 2
+    assert len(galeria.owners) == linhas_no_banco(db) == 2
+
+
+def test_reserva_de_criacao_e_compare_and_swap(db):
+    a, b = processo(db), processo(db)
+    gravar(a, "p0", vetor(0))
+    a.get(TAG)
+    b.get(TAG)
+    versao = a.versao(TAG)
+
+    # os dois não casaram a mesma face nova: só o primeiro reserva
+    assert a.reservar_criacao(TAG, versao, "nova-a")
+    assert not b.reservar_criacao(TAG, versao, "nova-b")
+    # reserva pendente de `a`: nem na versão atual outro processo reserva
+    assert not b.reservar_criacao(TAG, a.versao(TAG), "nova-b")
+
+    gravar(a, "nova-a", vetor(5), criacao=True)
+    assert db["galerias"].find_one({"_id": TAG}).get("criando") is None
+    b.aguardar_criacao(TAG)
+    # `b` recarrega, casa de novo e acha a pessoa criada por `a`
+    assert b.get(TAG).match(vetor(5), 0.1)[0] == "nova-a"
+    assert b.reservar_criacao(TAG, b.versao(TAG), "outra")
+
+
+def test_reserva_abandonada_expira(db):
+    a, b = processo(db, prazo_criacao=0.0), processo(db, prazo_criacao=0.0)
+    assert a.reservar_criacao(TAG, 0, "x")  # primeira escrita da tag_video (upsert)
+    b.get(TAG)
+    assert b.reservar_criacao(TAG, b.versao(TAG), "y")
+
+
+def test_despejo_lru_e_por_ociosidade(db):
+    a = processo(db, max_galerias=2)
+    for tag in ("t1", "t2", "t3"):
+        a.get(tag)
+    assert list(a._entradas) == ["t2", "t3"]
+    a.get("t2")
+    a.get("t1")
+    assert list(a._entradas) == ["t2", "t1"]
+
+    ocioso = processo(db, ttl_ocioso=60.0)
+    ocioso.get("t1")
+    ocioso._entradas["t1"].ultimo_uso -= 61.0
+    ocioso.get("t2")
+    assert list(ocioso._entradas) == ["t2"]
+
+
+def test_pessoa_compactada_e_relida_na_atualizacao(db):
+    a, b = processo(db), processo(db)
+    politica = PoliticaReservatorio(max_exemplares=2)
+    gravar(a, "p0", vetor(0))
+    b.get(TAG)
+
+    # três embeddings de p1 pela política (dois exemplares + centróide), gravados por `a`
+    estado = None
+    for i in range(3):
+        anterior = estado or a.repositorio.ler_pessoa("p1")._replace(exemplares=np.empty((0, DIM), np.float32))
+        atualizacao = politica.atualizar(anterior.exemplares, anterior.centroide, anterior.total, vetor(1) + 0.1 * i)
+        a.repositorio.gravar_pessoa("p1", TAG, atualizacao, reescrever=atualizacao.reescrever, anterior=anterior)
+        a.registrar_pessoa(TAG, "p1", PoliticaReservatorio.linhas(atualizacao))
+        estado = a.repositorio.ler_pessoa("p1")
+
+    galeria = b.get(TAG)
+    assert b.recargas == 1
+    np.testing.assert_array_equal(galeria.counts, [1, 3])
+    assert len(galeria.owners) == linhas_no_banco(db)
+    assert galeria.match(vetor(1), 0.1)[0] == "p1"
+
+
+def sem_recarga_do_mongo(cache, monkeypatch):
+    def falhar(*args, **kwargs):
+        raise AssertionError("a galeria não deveria ser recarregada inteira do MongoDB")
+    monkeypatch.setattr(cache.repositorio, "carregar_sincronizado", falhar)
+    return cache
+
+
+def test_disco_mais_antigo_recebe_so_o_que_mudou(db, tmp_path, monkeypatch):
+    a = processo(db, dir_persistencia=str(tmp_path))
+    for i in range(3):
+        gravar(a, f"p{i}", vetor(i))
+    a.get(TAG)
+    gravar(a, "p3", vetor(3))
+    a.salvar_todas()  # encerramento do processo
+
+    outro = processo(db)
+    gravar(outro, "p4", vetor(4))
+    gravar(outro, "p0", vetor(0) + 0.01)
+
+    reiniciado = sem_recarga_do_mongo(processo(db, dir_persistencia=str(tmp_path)), monkeypatch)
+    galeria = reiniciado.get(TAG)
+    assert len(galeria.owners) == linhas_no_banco(db) == 6
+    assert galeria.match(vetor(4), 0.1)[0] == "p4"
+    assert reiniciado.versao(TAG) == db["galerias"].find_one({"_id": TAG})["versao"]
+
+
+def test_disco_de_outra_geracao_e_descartado(db, tmp_path):
+    a = processo(db, dir_persistencia=str(tmp_path))
+    gravar(a, "p0", vetor(0))
+    gravar(a, "p1", vetor(1))
+    a.get(TAG)
+    a.salvar_todas()
+
+    db["embeddings"].delete_many({"pessoa": "p1"})
+    db["galerias"].update_one({"_id": TAG}, {"$inc": {"versao": 1, "geracao": 1}})
+    galeria = processo(db, dir_persistencia=str(tmp_path)).get(TAG)
+    assert "p1" not in galeria and len(galeria.owners) == 1
+
+
+def test_disco_sem_marco_so_serve_na_versao_exata(db, tmp_path, monkeypatch):
+    a = processo(db, dir_persistencia=str(tmp_path))
+    gravar(a, "p0", vetor(0))
+    a.get(TAG)
+    # arquivo no formato antigo: só a versão, sem geração nem marco
+    a._entradas[TAG].galeria.salvar(a._arquivo(TAG), a.versao(TAG))
+
+    assert len(sem_recarga_do_mongo(processo(db, dir_persistencia=str(tmp_path)), monkeypatch).get(TAG)) == 1
+    monkeypatch.undo()
+    gravar(processo(db), "p1", vetor(1))
+    assert len(processo(db, dir_persistencia=str(tmp_path)).get(TAG)) == 2
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from cascata import Cascata
+from galeria import Galeria
+
+
+class GaleriaContada(Galeria):
+    """Galeria que conta quantas vezes as distâncias foram calculadas."""
+
+    comparacoes = 0
+
+    def match_varios(self, *args, **kwargs):
+        self.comparacoes += 1
+        return super().match_varios(*args, **kwargs)
+
+    def match(self, *args, **kwargs):
+        raise AssertionError("a cascata deve usar match_varios")
+
+
+def unitario(graus):
+    rad = np.radians(graus)
+    return np.array([np.cos(rad), np.sin(rad)], dtype=np.float32)
+
+
+def galeria_com(*pessoas, classe=GaleriaContada):
+    """Uma linha por pessoa, nos ângulos dados (distância de cosseno = 1 - cos(Δ))."""
+    return classe.from_people([{"uuid": u, "embeddings": [unitario(g).tolist()]} for u, g in pessoas])
+
+
+LIMIAR = 1 - np.cos(np.radians(30))  # ~0.134; a faixa de 15% vai de ~0.114 a ~0.154
+CASCATA = Cascata("rapido", "pesado", faixa=0.15)
+
+
+def test_caso_claro_casa_no_estagio_rapido():
+    galeria = galeria_com(("a", 0), ("b", 90))
+    triagem = CASCATA.triagem(galeria, unitario(10), LIMIAR)
+    assert galeria.comparacoes == 1
+    assert triagem.decisao.uuid == "a"
+    assert triagem.decisao.cascata["estagio_decisao"] == "rapido"
+    assert triagem.decisao.cascata["resultado"] == "casou"
+    assert triagem.normal == (triagem.decisao.uuid, triagem.decisao.distancia)
+
+
+def test_caso_claro_de_pessoa_nova():
+    galeria = galeria_com(("a", 0))
+    triagem = CASCATA.triagem(galeria, unitario(80), LIMIAR)
+    assert galeria.comparacoes == 1
+    assert triagem.decisao.uuid is None and triagem.decisao.cascata["resultado"] == "nova"
+    assert triagem.decisao.embeddings == {"rapido": pytest.approx(unitario(80))}
+
+
+@pytest.mark.parametrize("graus, normal", [(29, "a"), (31, None)])
+def test_faixa_de_incerteza_vai_para_o_pesado(graus, normal):
+    galeria = galeria_com(("a", 0))
+    triagem = CASCATA.triagem(galeria, unitario(graus), LIMIAR)
+    assert triagem.decisao is None
+    assert triagem.normal[0] == normal
+    assert galeria.comparacoes == 1
+
+
+def test_decidir_pesado_usa_a_galeria_pesada():
+    rapida = galeria_com(("a", 0))
+    pesada = galeria_com(("b", 0), classe=Galeria)
+    triagem = CASCATA.triagem(rapida, unitario(29), LIMIAR)
+    decisao = CASCATA.decidir_pesado(triagem, unitario(29), pesada, (unitario(5), "pesado"), 0.1)
+    assert decisao.uuid == "b"
+    assert set(decisao.embeddings) == {"rapido", "pesado"}
+    assert decisao.cascata["estagio_decisao"] == "pesado" and decisao.cascata["resultado"] == "casou"
+    # o fallback no limiar normal reaproveita a triagem: a galeria rápida não é comparada de novo
+    assert rapida.comparacoes == 1
+
+
+@pytest.mark.parametrize("pesado, esperado", [
+    ((unitario(90), "pesado"), ("a", "sem_candidato_pesado", "pesado")),
+    ((None, "pesado"), ("a", "falha_pesado", "rapido")),
+])
+def test_sem_candidato_pesado_usa_a_triagem_no_limiar_normal(pesado, esperado):
+    rapida = galeria_com(("a", 0))
+    triagem = CASCATA.triagem(rapida, unitario(29), LIMIAR)
+    decisao = CASCATA.decidir_pesado(triagem, unitario(29), galeria_com(("b", 0), classe=Galeria), pesado, 0.1)
+    assert (decisao.uuid, decisao.cascata["resultado"], decisao.cascata["estagio_decisao"]) == esperado
+    assert decisao.distancia == triagem.normal[1]
+    assert rapida.comparacoes == 1
+
+
+def test_faixa_sem_ninguem_no_limiar_normal_vira_nova():
+    triagem = CASCATA.triagem(galeria_com(("a", 0)), unitario(31), LIMIAR)
+    decisao = CASCATA.decidir_pesado(triagem, unitario(31), galeria_com(("b", 90), classe=Galeria), (unitario(0), "pesado"), 0.1)
+    assert decisao.uuid is None and decisao.cascata["resultado"] == "nova"
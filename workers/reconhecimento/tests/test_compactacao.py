@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from compactacao import PoliticaReservatorio, selecionar_exemplares
+from galeria import normalize_rows
+
+
+@pytest.mark.parametrize("k", [1, 3, 8])
+def test_reservatorio_invariantes(k):
+    rng = np.random.default_rng(k)
+    politica = PoliticaReservatorio(k)
+    vistos = rng.normal(size=(60, 16)).astype(np.float32)
+    exemplares, centroide, total = np.empty((0, 16), dtype=np.float32), None, 0
+
+    for n, novo in enumerate(vistos, 1):
+        anterior = exemplares
+        atualizacao = politica.atualizar(exemplares, centroide, total, novo)
+        exemplares, centroide, total = atualizacao.exemplares, atualizacao.centroide, atualizacao.total
+
+        assert total == n
+        assert len(exemplares) == min(n, k)
+        assert not atualizacao.reescrever
+        # só os slots alterados mudam, e recebem o embedding novo
+        for slot, vetor in atualizacao.slots.items():
+            np.testing.assert_array_equal(vetor, novo)
+            np.testing.assert_array_equal(exemplares[slot], novo)
+        for slot in set(range(len(anterior))) - set(atualizacao.slots):
+            np.testing.assert_array_equal(exemplares[slot], anterior[slot])
+        # centróide = média de todos os embeddings (normalizados) já vistos
+        np.testing.assert_allclose(centroide, normalize_rows(vistos[:n]).mean(axis=0), atol=1e-5)
+
+    # exemplares são sempre embeddings observados, sem repetição
+    assert len({tuple(e) for e in exemplares}) == len(exemplares)
+    assert all((vistos == e).all(axis=1).any() for e in exemplares)
+    assert len(PoliticaReservatorio.linhas(atualizacao)) == len(exemplares) + 1
+
+
+def test_reservatorio_acima_do_limite_reseleciona():
+    rng = np.random.default_rng(0)
+    atualizacao = PoliticaReservatorio(4).atualizar(rng.normal(size=(9, 8)), None, 0, rng.normal(size=8))
+    assert atualizacao.reescrever
+    assert len(atualizacao.exemplares) == 4
+    assert atualizacao.total == 10
+
+
+def test_compactar_e_mesclar():
+    rng = np.random.default_rng(2)
+    politica = PoliticaReservatorio(5)
+    pequena = rng.normal(size=(5, 8)).astype(np.float32)
+    assert politica.compactar(pequena) is None
+
+    grande = rng.normal(size=(30, 8)).astype(np.float32)
+    compactada = politica.compactar(grande)
+    assert len(compactada.exemplares) == 5 and compactada.total == 30
+
+    estados = [
+        SimpleNamespace(exemplares=compactada.exemplares, centroide=compactada.centroide, total=30),
+        SimpleNamespace(exemplares=pequena, centroide=None, total=0),
+    ]
+    mesclada = politica.mesclar(estados)
+    assert mesclada.total == 35
+    assert len(mesclada.exemplares) == 5
+    esperado = (normalize_rows(grande).sum(axis=0) + normalize_rows(pequena).sum(axis=0)) / 35
+    np.testing.assert_allclose(mesclada.centroide, esperado, atol=1e-5)
+
+
+def test_selecionar_exemplares_indices_unicos_e_ordenados():
+    indices = selecionar_exemplares(np.random.default_rng(4).normal(size=(50, 8)), 10)
+    assert len(indices) == 10
+    assert list(indices) == sorted(set(indices.tolist()))
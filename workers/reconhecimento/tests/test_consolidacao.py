@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from consolidacao import agrupar, centroides
+from galeria import normalize_rows
+
+
+def no_circulo(*graus):
+    """Vetores unitários em 2D nos ângulos dados (distância de cosseno = 1 - cos(Δ))."""
+    rad = np.radians(graus)
+    return np.stack([np.cos(rad), np.sin(rad)], axis=1).astype(np.float32)
+
+
+@pytest.mark.parametrize("bloco", [1, 2, 2048])
+def test_agrupar_componentes_transitivos(bloco):
+    # 0-1-2 encadeados a 10° (0 e 2 a 20° não se ligam direto), 3-4 juntos, 5 sozinho
+    centros = no_circulo(0, 10, 20, 100, 105, 200)
+    limiar = 1 - np.cos(np.radians(12))
+    grupos = agrupar(centros, limiar, bloco=bloco)
+
+    assert sorted(sorted(membros) for membros, _ in grupos) == [[0, 1, 2], [3, 4]]
+    menores = {tuple(sorted(membros)): distancia for membros, distancia in grupos}
+    assert menores[(0, 1, 2)] == pytest.approx(1 - np.cos(np.radians(10)), abs=1e-5)
+    assert menores[(3, 4)] == pytest.approx(1 - np.cos(np.radians(5)), abs=1e-5)
+
+
+def test_agrupar_sem_pares_e_todos_juntos():
+    centros = no_circulo(0, 90, 180, 270)
+    assert agrupar(centros, 0.5) == []
+    grupos = agrupar(centros, 2.5)
+    assert len(grupos) == 1 and sorted(grupos[0][0]) == [0, 1, 2, 3]
+
+
+def test_agrupar_aleatorio_igual_a_busca_em_largura():
+    rng = np.random.default_rng(0)
+    centros = normalize_rows(rng.normal(size=(80, 4)).astype(np.float32))
+    limiar = 0.05
+    vizinhos = (1 - centros @ centros.T) < limiar
+
+    visitados, esperados = set(), []
+    for i in range(len(centros)):
+        if i in visitados:
+            continue
+        componente, pilha = set(), [i]
+        while pilha:
+            j = pilha.pop()
+            if j not in componente:
+                componente.add(j)
+                pilha.extend(np.flatnonzero(vizinhos[j]).tolist())
+        visitados |= componente
+        if len(componente) > 1:
+            esperados.append(sorted(componente))
+
+    obtidos = [sorted(membros) for membros, _ in agrupar(centros, limiar, bloco=7)]
+    assert sorted(obtidos) == sorted(esperados)
+
+
+def test_centroides_normalizados():
+    uuids, matriz = centroides({"a": np.array([[2.0, 0.0], [0.0, 3.0]]), "b": np.array([[0.0, -1.0]])})
+    assert uuids == ["a", "b"]
+    np.testing.assert_allclose(np.linalg.norm(matriz, axis=1), 1.0, rtol=1e-6)
+    np.testing.assert_allclose(matriz[0], [np.sqrt(0.5), np.sqrt(0.5)], rtol=1e-6)
@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+
+from galeria import MIN_MATCH_RATIO, Galeria
+from indice_ann import GaleriaIVF
+
+
+def votacao_por_pessoa(pessoas, recencias, embedding, limiar, min_ratio=MIN_MATCH_RATIO):
+    """Referência: o laço antigo, uma pessoa por vez, distância a distância."""
+    q = np.asarray(embedding, dtype=np.float64)
+    q = q / np.linalg.norm(q)
+    vencedor = None
+    for posicao, pessoa in enumerate(pessoas):
+        linhas = pessoa["embeddings"]
+        acertos, distancia = 0, None
+        for linha in linhas:
+            v = np.asarray(linha, dtype=np.float64)
+            d = 1 - float(v @ q) / np.linalg.norm(v)
+            if d < limiar:
+                acertos += 1
+                if distancia is None and acertos / len(linhas) >= min_ratio:
+                    distancia = d
+        if distancia is not None and (vencedor is None or recencias[posicao] > vencedor[2]):
+            vencedor = (pessoa["uuid"], distancia, recencias[posicao])
+    return (vencedor[0], vencedor[1]) if vencedor else (None, None)
+
+
+def galeria_aleatoria(rng, n_pessoas, dim=16):
+    centros = rng.normal(size=(n_pessoas, dim))
+    pessoas = [
+        {"uuid": f"p{i}", "embeddings": (centros[i] + 0.4 * rng.normal(size=(rng.integers(1, 12), dim))).tolist()}
+        for i in range(n_pessoas)
+    ]
+    return pessoas, centros
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_votacao_igual_ao_laco_por_pessoa(seed):
+    rng = np.random.default_rng(seed)
+    pessoas, centros = galeria_aleatoria(rng, int(rng.integers(1, 200)))
+    # recências com empates, para exercitar o desempate pela ordem de `uuids`
+    recencias = rng.integers(0, 20, size=len(pessoas)).astype(np.float64)
+    galeria = Galeria.from_people(pessoas)
+    for i, uuid_str in enumerate(galeria.uuids):
+        galeria.marcar_aparicao(uuid_str, recencias[i])
+
+    for _ in range(10):
+        consulta = centros[rng.integers(len(centros))] + 0.5 * rng.normal(size=centros.shape[1])
+        limiar = float(rng.uniform(0.1, 0.6))
+        esperado = votacao_por_pessoa(pessoas, recencias, consulta, limiar)
+        uuid_str, distancia = galeria.match(consulta, limiar)
+        assert uuid_str == esperado[0]
+        if uuid_str is not None:
+            assert distancia == pytest.approx(esperado[1], abs=1e-5)
+        # o primeiro bloco de quentes não muda o vencedor
+        assert galeria.match(consulta, limiar, quentes_desde=15.0)[0] == esperado[0]
+
+
+def test_add_embedding_equivale_a_from_people():
+    rng = np.random.default_rng(1)
+    pessoas, centros = galeria_aleatoria(rng, 30)
+    incremental = Galeria.from_people([])
+    for pessoa in pessoas:
+        for linha in pessoa["embeddings"]:
+            assert incremental.add_embedding(pessoa["uuid"], linha)
+    completa = Galeria.from_people(pessoas)
+
+    assert incremental.uuids == completa.uuids
+    np.testing.assert_array_equal(incremental.counts, completa.counts)
+    for consulta in centros:
+        assert incremental.match(consulta, 0.3) == completa.match(consulta, 0.3)
+    assert not incremental.add_embedding("p0", np.ones(centros.shape[1] + 1))
+
+
+def ivf_e_exata(rng, n_pessoas=400, dim=32, nprobe=8):
+    pessoas, centros = galeria_aleatoria(rng, n_pessoas, dim)
+    ivf = GaleriaIVF.from_people(pessoas, nprobe=nprobe, min_treino=500)
+    return ivf, Galeria.from_people(pessoas), centros
+
+
+def test_ivf_recall_contra_forca_bruta():
+    rng = np.random.default_rng(7)
+    ivf, exata, centros = ivf_e_exata(rng)
+    assert ivf.treinado and 16 <= ivf.n_celulas <= 4096
+
+    consultas = centros + 0.3 * rng.normal(size=centros.shape)
+    esperados = [exata.match(c, 0.4)[0] for c in consultas]
+    encontrados = [ivf.match(c, 0.4)[0] for c in consultas]
+    com_par = [i for i, e in enumerate(esperados) if e is not None]
+    assert len(com_par) > len(consultas) // 2
+    recall = np.mean([encontrados[i] == esperados[i] for i in com_par])
+    assert recall >= 0.9
+
+
+def test_ivf_com_todas_as_celulas_e_exato():
+    rng = np.random.default_rng(3)
+    ivf, exata, centros = ivf_e_exata(rng, nprobe=10 ** 6)
+    for consulta in centros + 0.3 * rng.normal(size=centros.shape):
+        uuid_ivf, dist_ivf = ivf.match(consulta, 0.4)
+        uuid_exata, dist_exata = exata.match(consulta, 0.4)
+        assert uuid_ivf == uuid_exata
+        if uuid_ivf is not None:
+            assert dist_ivf == pytest.approx(dist_exata, abs=1e-5)
+
+
+def test_ivf_insercoes_incrementais_entram_nas_listas():
+    rng = np.random.default_rng(5)
+    ivf, _, centros = ivf_e_exata(rng, nprobe=10 ** 6)
+    for i in range(50):
+        ivf.add_embedding(f"nova{i}", rng.normal(size=centros.shape[1]))
+    assert int(ivf._tam_listas.sum()) == ivf._size
+    assert ivf.match(ivf.matrix[-1], 0.01)[0] == "nova49"
+
+
+@pytest.mark.parametrize("classe", [Galeria, GaleriaIVF])
+def test_match_varios_igual_a_um_match_por_limiar(classe):
+    rng = np.random.default_rng(11)
+    pessoas, centros = galeria_aleatoria(rng, 300)
+    galeria = classe.from_people(pessoas, **({"nprobe": 4, "min_treino": 100} if classe is GaleriaIVF else {}))
+    for i, uuid_str in enumerate(galeria.uuids):
+        galeria.marcar_aparicao(uuid_str, float(i % 17))
+
+    limiares = [0.15, 0.5, 0.3]
+    for consulta in centros[:60] + 0.4 * rng.normal(size=(60, centros.shape[1])):
+        for quentes_desde in (None, 12.0):
+            esperado = [galeria.match(consulta, limiar, quentes_desde=quentes_desde) for limiar in limiares]
+            assert galeria.match_varios(consulta, limiares, quentes_desde=quentes_desde) == esperado
+
+
+@pytest.mark.parametrize("classe", [Galeria, GaleriaIVF])
+def test_base_somente_leitura_nao_e_copiada_ao_anexar(classe, tmp_path):
+    rng = np.random.default_rng(13)
+    pessoas, centros = galeria_aleatoria(rng, 120)
+    # IVF com todas as células: o mesmo resultado da busca exata, com as listas exercitadas
+    parametros = {"min_treino": 100, "nprobe": 10 ** 6} if classe is GaleriaIVF else {}
+    completa = classe.from_people(pessoas, **parametros)
+    n_base = len(completa.owners) - 40
+
+    # base mapeada em memória (como no armazém) com as primeiras linhas; as demais são anexadas
+    caminho = tmp_path / "base.f32"
+    completa.matrix[:n_base].tofile(caminho)
+    base = np.memmap(caminho, dtype=np.float32, mode="r", shape=(n_base, completa.dim))
+    donos = completa.owners[:n_base]
+    galeria = classe(completa.uuids[:donos.max() + 1], base, donos, **parametros)
+    for linha, dono in zip(completa.matrix[n_base:], completa.owners[n_base:]):
+        assert galeria.add_embedding(completa.uuids[dono], linha)
+
+    assert galeria._base is base and len(galeria._matrix) < n_base
+    # add_embedding normaliza de novo a linha: diferença de arredondamento
+    np.testing.assert_allclose(galeria.matrix, completa.matrix, atol=1e-6)
+    for consulta in centros:
+        uuid_str, distancia = galeria.match(consulta, 0.3)
+        esperado = completa.match(consulta, 0.3)
+        assert uuid_str == esperado[0]
+        if uuid_str is not None:
+            assert distancia == pytest.approx(esperado[1], abs=1e-5)
+    # linhas na base não podem ser reescritas; as anexadas sim
+    assert not galeria.substituir_embeddings(completa.uuids[0], np.ones((20, completa.dim)))
+    ultima = completa.uuids[completa.owners[-1]]
+    if galeria.rows_of(ultima)[0] >= n_base:
+        assert galeria.substituir_embeddings(ultima, np.ones((len(galeria.rows_of(ultima)), completa.dim)))
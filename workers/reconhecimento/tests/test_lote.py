@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import lote
+
+
+class ModeloKeras:
+    """Grafo Keras: `model(batch)` devolve um vetor por face do lote."""
+
+    def __init__(self):
+        self.chamadas = []
+
+    def model(self, batch, training=False):
+        self.chamadas.append(len(batch))
+        return batch.reshape(len(batch), -1)[:, :4] * 2
+
+
+class ModeloSemGrafo:
+    def __init__(self):
+        self.chamadas = 0
+
+    def forward(self, entrada):
+        self.chamadas += 1
+        return entrada.reshape(-1)[:4].tolist()
+
+
+@pytest.fixture
+def modelo(monkeypatch):
+    def usar(instancia):
+        monkeypatch.setattr(lote, "carregar_modelo", lambda model_name: instancia)
+        return instancia
+
+    def preparar(image_np, model_name):
+        if image_np is None:
+            raise ValueError("recorte vazio")
+        return np.asarray(image_np, dtype=np.float32)[None]
+
+    monkeypatch.setattr(lote, "preparar_face", preparar)
+    return usar
+
+
+def imagem(valor):
+    return np.full((2, 2, 1), valor, dtype=np.float32)
+
+
+def test_lote_roda_um_unico_forward(modelo):
+    keras = modelo(ModeloKeras())
+    embeddings = lote.gerar_embeddings_lote([imagem(1), imagem(2), imagem(3)], "Facenet")
+    assert keras.chamadas == [3]
+    assert embeddings == [[2.0] * 4, [4.0] * 4, [6.0] * 4]
+
+
+def test_falha_no_preparo_vira_none_sem_perder_a_ordem(modelo):
+    keras = modelo(ModeloKeras())
+    embeddings = lote.gerar_embeddings_lote([imagem(1), None, imagem(3)], "Facenet")
+    assert keras.chamadas == [2]
+    assert embeddings[1] is None
+    assert embeddings[0] == [2.0] * 4 and embeddings[2] == [6.0] * 4
+
+    assert lote.gerar_embeddings_lote([None], "Facenet") == [None]
+    assert keras.chamadas == [2]
+
+
+def test_modelo_sem_grafo_segue_face_a_face(modelo):
+    sem_grafo = modelo(ModeloSemGrafo())
+    assert lote.gerar_embeddings_lote([imagem(1), imagem(2)], "SFace") == [[1.0] * 4, [2.0] * 4]
+    assert sem_grafo.chamadas == 2
+
+
+def test_aquecimento_roda_um_lote_por_tamanho(modelo):
+    keras = modelo(ModeloKeras())
+    lote.aquecer_modelo("Facenet", tamanhos_lote=(1, 4))
+    assert keras.chamadas == [1, 4]
+
+
+def test_estatisticas_resumem_e_recomecam_a_janela(caplog):
+    estatisticas = lote.EstatisticasLote(intervalo=0.0)
+    estatisticas.registrar(4, 0.010, 0.040, [0.1] * 4)
+    estatisticas.registrar(2, 0.030, 0.020, [0.3] * 2)
+    r = estatisticas.resumo()
+    assert r["lotes"] == 2 and r["faces"] == 6
+    assert r["tamanho_medio_lote"] == pytest.approx(3.0)
+    assert r["espera_formacao_ms"] == pytest.approx(20.0)
+    assert r["inferencia_ms_face"] == pytest.approx(10.0)
+    assert r["latencia_p95_ms"] == pytest.approx(300.0)
+
+    with caplog.at_level("INFO", logger=lote.__name__):
+        estatisticas.talvez_relatar()
+    assert "Lotes: 2" in caplog.text
+    assert estatisticas.lotes == 0 and estatisticas.latencias == []
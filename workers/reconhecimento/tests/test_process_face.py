@@ -0,0 +1,108 @@
+from collections import defaultdict
+from unittest import mock
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("deepface")
+pytest.importorskip("dotenv")
+Image = pytest.importorskip("PIL.Image")
+pika = pytest.importorskip("pika")
+minio = pytest.importorskip("minio")
+import pymongo  # noqa: E402
+
+from mongo_falso import BancoFalso  # noqa: E402
+
+MODELO = "Facenet"
+TAG = "camera-1"
+DIM = 128
+
+
+@pytest.fixture(scope="module")
+def reconhecimento(tmp_path_factory):
+    """O módulo do worker importado sem RabbitMQ, MinIO nem MongoDB de verdade."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("TEMP_DIR", str(tmp_path_factory.mktemp("temp")))
+        mp.setenv("MODEL_NAME", MODELO)
+        mp.setenv("EMBEDDING_CACHE_MAX", "0")
+        for variavel in ("EMBEDDING_SERVICE_URL", "CASCATA_MODELO_RAPIDO", "GALERIA_MAX_EXEMPLARES",
+                         "GALERIA_MMAP_DIR", "ANN_ATIVO", "ANN_DIR", "GALERIA_JANELA_QUENTE"):
+            mp.delenv(variavel, raising=False)
+        mp.setattr(pymongo, "MongoClient", lambda *args, **kwargs: defaultdict(BancoFalso))
+        mp.setattr(minio, "Minio", mock.MagicMock())
+        mp.setattr(pika, "BlockingConnection", mock.MagicMock())
+        import reconhecimento
+    return reconhecimento
+
+
+@pytest.fixture
+def banco(reconhecimento, monkeypatch):
+    """Banco vazio e recursos do modelo (cache de galerias) novos para cada teste."""
+    db = BancoFalso()
+    monkeypatch.setattr(reconhecimento, "db", db)
+    monkeypatch.setattr(reconhecimento, "pessoas", db["pessoas"])
+    monkeypatch.setattr(reconhecimento, "galerias", db["galerias"])
+    recursos = reconhecimento.RecursosModelo(MODELO)
+    monkeypatch.setattr(reconhecimento, "recursos_pesado", recursos)
+    monkeypatch.setattr(reconhecimento, "recursos_primeiro", recursos)
+    monkeypatch.setattr(reconhecimento, "recursos_por_modelo", {MODELO: recursos})
+    return db
+
+
+def vetor(i, ruido=0.0):
+    v = np.full(DIM, ruido, dtype=np.float32)
+    v[i % DIM] = 1.0
+    return v.tolist()
+
+
+def imagem():
+    return Image.new("RGB", (32, 32))
+
+
+def test_face_nova_e_depois_reconhecida(reconhecimento, banco):
+    primeira = reconhecimento.process_face(imagem(), TAG, vetor(0))
+    assert primeira["similarity_value"] is None
+    assert banco["galerias"].find_one({"_id": TAG}).get("criando") is None  # reserva liberada
+
+    segunda = reconhecimento.process_face(imagem(), TAG, vetor(0, ruido=0.01))
+    assert segunda["uuid"] == primeira["uuid"]
+    assert segunda["similarity_value"] == pytest.approx(1.0, abs=0.01)
+
+    pessoa = banco["pessoas"].find_one({"uuid": primeira["uuid"]})
+    assert pessoa["tags"] == [primeira["uuid"]] and len(pessoa["image_paths"]) == 2
+    assert segunda["primary_photo"] == pessoa["image_paths"][0]
+    assert banco["embeddings"].count_documents({"pessoa": primeira["uuid"]}) == 2
+
+
+def test_criacao_concorrente_casa_com_a_pessoa_do_outro_processo(reconhecimento, banco, monkeypatch):
+    local = reconhecimento.recursos_primeiro
+    outro = reconhecimento.RecursosModelo(MODELO)
+    local.cache_galerias.get(TAG)
+
+    # o outro processo reservou a criação da mesma face e ainda está gravando:
+    # a reserva local falha e, durante a espera, a gravação do outro termina
+    assert outro.cache_galerias.reservar_criacao(TAG, 0, "do-outro")
+
+    def outro_termina(tag_video):
+        reconhecimento.gravar_embedding(outro, "do-outro", tag_video, vetor(0), False, criacao=True)
+
+    monkeypatch.setattr(local.cache_galerias, "aguardar_criacao", outro_termina)
+    resultado = reconhecimento.process_face(imagem(), TAG, vetor(0))
+
+    assert resultado["uuid"] == "do-outro"
+    assert [p["uuid"] for p in banco["pessoas"].find()] == ["do-outro"]
+    assert banco["embeddings"].count_documents({"pessoa": "do-outro"}) == 2
+
+
+def test_galeria_disputada_cria_sem_reserva(reconhecimento, banco, monkeypatch):
+    cache = reconhecimento.recursos_primeiro.cache_galerias
+    tentativas = []
+    monkeypatch.setattr(reconhecimento, "MAX_TENTATIVAS_CRIACAO", 2)
+    monkeypatch.setattr(cache, "reservar_criacao", lambda *args: tentativas.append(args) or False)
+    monkeypatch.setattr(cache, "aguardar_criacao", lambda tag_video: None)
+
+    resultado = reconhecimento.process_face(imagem(), TAG, vetor(3))
+    assert len(tentativas) == 2
+    assert resultado["uuid"] == tentativas[-1][2]
+    assert banco["embeddings"].count_documents({"pessoa": resultado["uuid"]}) == 1
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from repositorio_embeddings import FORMATOS, desempacotar, empacotar
+
+
+@pytest.mark.parametrize("formato", FORMATOS)
+def test_empacotar_desempacotar_ida_e_volta(formato):
+    vetores = np.random.default_rng(0).normal(size=(20, 512)).astype(np.float32)
+    docs = [empacotar(v, formato) for v in vetores]
+    assert all(d["formato"] == formato and d["dim"] == 512 for d in docs)
+
+    matriz = desempacotar(docs)
+    assert matriz.dtype == np.float32 and matriz.shape == vetores.shape
+    if formato == "float32":
+        np.testing.assert_array_equal(matriz, vetores)
+    elif formato == "float16":
+        np.testing.assert_allclose(matriz, vetores, rtol=1e-3, atol=1e-4)
+    else:
+        # int8: erro de no máximo meio passo de quantização por vetor
+        escalas = np.array([d["escala"] for d in docs], dtype=np.float32)[:, None]
+        assert (np.abs(matriz - vetores) <= escalas / 2 + 1e-6).all()
+    assert len(docs[0]["vetor"]) == 512 * np.dtype(formato).itemsize
+
+
+def test_desempacotar_formatos_misturados_mantem_a_ordem():
+    vetores = np.random.default_rng(1).normal(size=(9, 16)).astype(np.float32)
+    docs = [empacotar(v, FORMATOS[i % len(FORMATOS)]) for i, v in enumerate(vetores)]
+    matriz = desempacotar(docs)
+    for i, formato in enumerate(FORMATOS * 3):
+        np.testing.assert_allclose(matriz[i], desempacotar([empacotar(vetores[i], formato)])[0])
+
+
+def test_int8_vetor_nulo_e_formato_invalido():
+    doc = empacotar(np.zeros(8), "int8")
+    assert doc["escala"] == 1.0
+    np.testing.assert_array_equal(desempacotar([doc]), np.zeros((1, 8), dtype=np.float32))
+    assert desempacotar([]).shape == (0, 0)
+    with pytest.raises(ValueError):
+        empacotar(np.zeros(8), "float64")